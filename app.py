@@ -29,9 +29,31 @@ app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
 }
 
 # Configure upload settings
-app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
+# The index keeps every chunk's text in memory, so this still bounds what one upload adds
+app.config['MAX_CONTENT_LENGTH'] = int(os.environ.get("MAX_UPLOAD_MB", "16")) * 1024 * 1024
 app.config['UPLOAD_FOLDER'] = 'uploads'
 app.config['VECTOR_STORE_FOLDER'] = 'vector_store'
+app.config['UPLOAD_WORKERS'] = int(os.environ.get("UPLOAD_WORKERS", "4"))  # files of one upload embedded in parallel
+
+# Configure batch question answering
+app.config['BATCH_MAX_QUESTIONS'] = int(os.environ.get("BATCH_MAX_QUESTIONS", "500"))
+app.config['LLM_MAX_CONCURRENCY'] = int(os.environ.get("LLM_MAX_CONCURRENCY", "4"))
+app.config['LLM_RATE_LIMIT'] = float(os.environ.get("LLM_RATE_LIMIT", "2"))  # Gemini calls started per second
+app.config['ASGI_THREADS'] = int(os.environ.get("ASGI_THREADS", "16"))  # threads for retrieval and database work under asgi.py
+
+# Configure conversational retrieval
+app.config['CONVERSATION_TURNS'] = int(os.environ.get("CONVERSATION_TURNS", "6"))
+app.config['CONVERSATION_TOKEN_BUDGET'] = int(os.environ.get("CONVERSATION_TOKEN_BUDGET", "32"))  # max retrieval query tokens
+app.config['CONVERSATION_CACHE_SIZE'] = int(os.environ.get("CONVERSATION_CACHE_SIZE", "1024"))
+
+# Configure chat history pages
+app.config['CHAT_MESSAGES_PAGE'] = int(os.environ.get("CHAT_MESSAGES_PAGE", "50"))
+app.config['CHAT_SESSIONS_PAGE'] = int(os.environ.get("CHAT_SESSIONS_PAGE", "30"))
+app.config['DOCUMENTS_PAGE'] = int(os.environ.get("DOCUMENTS_PAGE", "50"))
+
+# Configure metrics
+app.config['METRICS_TOKEN'] = os.environ.get("METRICS_TOKEN")  # Bearer token for /metrics, open if unset
+app.config['DEBUG_TIMINGS'] = os.environ.get("DEBUG_TIMINGS", "").lower() in ("1", "true", "yes")
 
 # Ensure upload directories exist
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
@@ -43,17 +65,30 @@ db.init_app(app)
 # Initialize Flask-Login
 login_manager = LoginManager()
 login_manager.init_app(app)
-login_manager.login_view = 'auth.login'
+login_manager.login_view = 'login'
 login_manager.login_message_category = 'info'
 login_manager.login_message = 'Please log in to access this page.'
 
 @login_manager.user_loader
 def load_user(user_id):
+    """Load the logged-in user: one primary-key query per request, so account changes apply at once"""
     from models import User
-    return User.query.get(int(user_id))
+    return db.session.get(User, int(user_id))
+
+def init_db():
+    """Create missing tables and indexes.
 
-with app.app_context():
+    Run once per deploy (`flask --app main init-db`) or by `python main.py`,
+    not on every worker boot.
+    """
     # Import models to ensure tables are created
     import models  # noqa: F401
-    db.create_all()
+    with app.app_context():
+        db.create_all()
+        models.create_missing_indexes()
     logging.info("Database tables created successfully")
+
+@app.cli.command('init-db')
+def init_db_command():
+    """Create the database tables and indexes"""
+    init_db()
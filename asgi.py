@@ -0,0 +1,338 @@
+"""ASGI entry point: async question answering alongside the Flask app
+
+Run with an ASGI server, one process per core:
+
+    uvicorn asgi:application --host 0.0.0.0 --port 5000
+
+POST /ask, /ask/stream and /ask_batch are served by coroutines. Retrieval and
+database work run on worker threads, while the wait for the LLM is awaited,
+so a question in flight holds no thread. All other routes run the Flask WSGI
+app unchanged on the same worker threads.
+"""
+import io
+import sys
+import json
+import asyncio
+import logging
+from contextlib import aclosing
+from concurrent.futures import ThreadPoolExecutor
+from flask import request, jsonify, current_app
+from werkzeug.exceptions import ClientDisconnected
+from flask_login import current_user
+
+from app import app, db
+import routes
+from metrics import collect_timings
+
+
+class ASGIInput(io.RawIOBase):
+    """`wsgi.input` for an app on a worker thread: pulls the request body from the event loop as it is read"""
+
+    def __init__(self, receive, loop):
+        self.receive = receive
+        self.loop = loop
+        self.pending = bytearray()
+        self.more_body = True
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        while not self.pending and self.more_body:
+            message = asyncio.run_coroutine_threadsafe(self.receive(), self.loop).result()
+            if message['type'] == 'http.disconnect':
+                raise ClientDisconnected()
+            self.pending.extend(message.get('body', b''))
+            self.more_body = message.get('more_body', False)
+        size = min(len(buffer), len(self.pending))
+        buffer[:size] = self.pending[:size]
+        del self.pending[:size]
+        return size
+
+
+def wsgi_environ(scope, body) -> dict:
+    """A WSGI environ for an ASGI HTTP scope, so Flask's request context, session and login work as usual.
+
+    `body` is the whole request body, or a readable stream of it.
+    """
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': 'HTTP/' + scope.get('http_version', '1.1'),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body) if isinstance(body, bytes) else body,
+        # The stream ends with the body, so chunked requests without a Content-Length are read too
+        'wsgi.input_terminated': True,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    if scope.get('client'):
+        environ['REMOTE_ADDR'] = scope['client'][0]
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        key = name if name in ('CONTENT_TYPE', 'CONTENT_LENGTH') else 'HTTP_' + name
+        value = value.decode('latin-1')
+        environ[key] = environ[key] + ',' + value if key in environ else value
+    return environ
+
+
+def json_lines(events):
+    """Encode an async iterator of dicts as JSON lines"""
+    async def encode():
+        async with aclosing(events) as source:
+            async for event in source:
+                yield json.dumps(event) + "\n"
+    return encode()
+
+
+async def ask(data, user_id):
+    question = data.get('question')
+    if not question:
+        return jsonify({'error': 'Question is required'}), 400
+
+    try:
+        debug = bool(data.get('debug')) or current_app.config['DEBUG_TIMINGS']
+        with collect_timings(debug) as timings:
+            chat_session, _, state, retrieval_query = await asyncio.to_thread(
+                _start_turn, question, data.get('session_id'), bool(data.get('conversational')))
+
+            response_data = await routes.rag_engine.aanswer_question(
+                question, user_id, retrieval_query=retrieval_query, extractive=routes._extractive_flag(data))
+
+            def finish():
+                assistant_message = routes._finish_turn(chat_session, state, question, response_data['answer'],
+                                                        response_data.get('context_documents', []))
+                return routes._ask_response(question, retrieval_query, response_data, assistant_message, timings)
+            response = await asyncio.to_thread(finish)
+
+        return jsonify(response)
+
+    except Exception as e:
+        logging.error(f"Question answering error: {e}")
+        await asyncio.to_thread(db.session.rollback)
+        return jsonify({'error': 'Failed to process question'}), 500
+
+
+async def ask_stream(data, user_id):
+    question = data.get('question')
+    if not question:
+        return jsonify({'error': 'Question is required'}), 400
+
+    try:
+        chat_session, session_id, state, retrieval_query = await asyncio.to_thread(
+            _start_turn, question, data.get('session_id'), bool(data.get('conversational')))
+    except Exception as e:
+        logging.error(f"Question answering error: {e}")
+        await asyncio.to_thread(db.session.rollback)
+        return jsonify({'error': 'Failed to process question'}), 500
+
+    async def events():
+        pieces = []
+        context_docs = []
+        try:
+            async for event in routes.rag_engine.astream_answer(question, user_id,
+                                                                retrieval_query=retrieval_query,
+                                                                extractive=routes._extractive_flag(data)):
+                if 'delta' in event:
+                    pieces.append(event['delta'])
+                else:
+                    context_docs = event['context_documents']
+                    if retrieval_query != question:
+                        event['retrieval_query'] = retrieval_query
+                yield event
+
+            message_id = await asyncio.to_thread(
+                lambda: routes._finish_turn(chat_session, state, question, "".join(pieces), context_docs).id)
+            yield {'done': True, 'message_id': message_id, 'session_id': session_id}
+        except Exception as e:
+            logging.error(f"Streaming answer error: {e}")
+            await asyncio.to_thread(db.session.rollback)
+            yield {'error': 'Failed to process question'}
+
+    return json_lines(events())
+
+
+async def ask_batch(data, user_id):
+    questions = data.get('questions')
+    error = routes._batch_error(questions)
+    if error:
+        return jsonify({'error': error}), 400
+
+    async def events():
+        try:
+            async with aclosing(routes.rag_engine.aanswer_questions(
+                    questions, user_id,
+                    max_concurrency=current_app.config['LLM_MAX_CONCURRENCY'],
+                    rate_limit=current_app.config['LLM_RATE_LIMIT'],
+                    extractive=routes._extractive_flag(data))) as results:
+                async for result in results:
+                    yield result
+        except Exception as e:
+            logging.error(f"Batch question answering error: {e}")
+            yield {'error': 'Failed to process batch'}
+
+    return json_lines(events())
+
+
+def _start_turn(question, session_id, conversational):
+    """`routes._start_turn`, committed so the question is saved and no connection is held while answering.
+
+    Also returns the session id, read before the commit expires the session.
+    """
+    chat_session, state, retrieval_query = routes._start_turn(question, session_id, conversational)
+    session_id = chat_session.id
+    db.session.commit()
+    return chat_session, session_id, state, retrieval_query
+
+
+ASYNC_ROUTES = {
+    ('POST', '/ask'): ask,
+    ('POST', '/ask/stream'): ask_stream,
+    ('POST', '/ask_batch'): ask_batch,
+}
+
+
+class AskScribeASGI:
+    """Dispatches the question endpoints to coroutines and everything else to the Flask app"""
+
+    def __init__(self, flask_app):
+        self.flask_app = flask_app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            return
+        handler = ASYNC_ROUTES.get((scope['method'], scope['path']))
+        if handler is None:
+            await asyncio.to_thread(self._call_wsgi, scope, receive, send, asyncio.get_running_loop())
+            return
+
+        body = bytearray()
+        limit = self.flask_app.config.get('MAX_CONTENT_LENGTH')
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return
+            body.extend(message.get('body', b''))
+            if limit and len(body) > limit:
+                await self._send_json(send, 413, {'error': 'Request too large'})
+                return
+            if not message.get('more_body'):
+                break
+
+        with self.flask_app.request_context(wsgi_environ(scope, bytes(body))):
+            await self._dispatch(handler, receive, send)
+
+    async def _dispatch(self, handler, receive, send):
+        # Loading the user may query the database; later commits expire it, so keep the id
+        user_id = await asyncio.to_thread(lambda: current_user.id if current_user.is_authenticated else None)
+        if user_id is None:
+            await self._send_response(send, self.flask_app.login_manager.unauthorized())
+            return
+
+        result = await handler(request.get_json(silent=True) or {}, user_id)
+        if not hasattr(result, '__aiter__'):
+            await self._send_response(send, self.flask_app.make_response(result))
+            return
+
+        # Streamed JSON lines; a client that goes away cancels the answer
+        response = self.flask_app.process_response(self.flask_app.response_class(mimetype='application/x-ndjson'))
+        await self._start(send, response)
+        stream = asyncio.ensure_future(self._stream(result, send))
+        disconnect = asyncio.ensure_future(self._wait_disconnect(receive))
+        done, pending = await asyncio.wait({stream, disconnect}, return_when=asyncio.FIRST_COMPLETED)
+        for task in pending:
+            task.cancel()
+        if stream in done:
+            stream.result()
+
+    def _call_wsgi(self, scope, receive, send, loop):
+        """Run the Flask app for one request on this worker thread, relaying the response to the loop"""
+        def emit(message):
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        response = {'started': False}
+
+        def start_response(status, headers, exc_info=None):
+            if exc_info and response['started']:
+                raise exc_info[1].with_traceback(exc_info[2])
+            response['status'] = int(status.split(' ', 1)[0])
+            response['headers'] = [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                                   for name, value in headers]
+            return write
+
+        def write(data):
+            # Headers go out with the first body chunk, as a WSGI server sends them
+            if not response['started']:
+                emit({'type': 'http.response.start', 'status': response['status'],
+                      'headers': response['headers']})
+                response['started'] = True
+            if data:
+                emit({'type': 'http.response.body', 'body': data, 'more_body': True})
+
+        body = io.BufferedReader(ASGIInput(receive, loop))
+        result = self.flask_app(wsgi_environ(scope, body), start_response)
+        try:
+            for data in result:
+                write(data)
+            write(b'')
+            emit({'type': 'http.response.body', 'body': b''})
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+
+    async def _stream(self, lines, send):
+        async with aclosing(lines) as source:
+            async for line in source:
+                await send({'type': 'http.response.body', 'body': line.encode('utf-8'), 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b''})
+
+    async def _wait_disconnect(self, receive):
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+
+    async def _start(self, send, response):
+        await send({
+            'type': 'http.response.start',
+            'status': response.status_code,
+            'headers': [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                        for name, value in response.headers.items()],
+        })
+
+    async def _send_response(self, send, response):
+        response = self.flask_app.process_response(response)
+        await self._start(send, response)
+        await send({'type': 'http.response.body', 'body': response.get_data()})
+
+    async def _send_json(self, send, status, payload):
+        body = json.dumps(payload).encode('utf-8')
+        await send({'type': 'http.response.start', 'status': status,
+                    'headers': [(b'content-type', b'application/json'),
+                                (b'content-length', str(len(body)).encode('latin-1'))]})
+        await send({'type': 'http.response.body', 'body': body})
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                # asyncio.to_thread runs on the default executor, only cpu count + 4 threads by default
+                asyncio.get_running_loop().set_default_executor(
+                    ThreadPoolExecutor(max_workers=self.flask_app.config['ASGI_THREADS'],
+                                       thread_name_prefix='asgi'))
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+
+application = AskScribeASGI(app)
@@ -0,0 +1 @@
+"""Offline benchmarks for AskScribe ingestion and retrieval"""
@@ -0,0 +1,120 @@
+"""Dense vector search benchmark: exact BLAS search vs the IVF index
+
+Usage:
+    python -m benchmarks.bench_dense --vectors 50000 --dimension 384 --output dense.json
+
+Reports latency and recall@k of every configuration against exact float32
+search. By default the vectors are synthetic clustered unit vectors; pass
+`--backend sentence` to embed a synthetic corpus with the local model instead.
+"""
+import time
+import argparse
+from typing import Dict, Any, List
+
+import numpy as np
+
+from benchmarks.common import SyntheticCorpus, latency_summary, emit_results
+
+
+def clustered_vectors(count: int, centres: np.ndarray, rng: np.random.Generator) -> np.ndarray:
+    """Unit vectors scattered around the given cluster centres, like topical text"""
+    labels = rng.integers(len(centres), size=count)
+    vectors = centres[labels] + 1.5 * rng.standard_normal((count, centres.shape[1])).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def recall_at_k(results: List[List[tuple]], truth: List[List[tuple]]) -> float:
+    hits = 0
+    total = 0
+    for found, expected in zip(results, truth):
+        expected_ids = {(doc_id, chunk_id) for _, doc_id, chunk_id in expected}
+        hits += sum(1 for _, doc_id, chunk_id in found if (doc_id, chunk_id) in expected_ids)
+        total += len(expected_ids)
+    return hits / total if total else 0.0
+
+
+def build_index(vectors: np.ndarray, storage: str, ann_threshold: int, nprobe: int, chunks_per_doc: int):
+    from vector_index import DenseVectorIndex
+    index = DenseVectorIndex(vectors.shape[1], storage=storage, ann_threshold=ann_threshold, nprobe=nprobe)
+    start = time.perf_counter()
+    for doc_id, offset in enumerate(range(0, len(vectors), chunks_per_doc)):
+        index.add(1, doc_id, vectors[offset:offset + chunks_per_doc])
+    return index, time.perf_counter() - start
+
+
+def time_search(index, queries: np.ndarray, k: int):
+    samples = []
+    results = []
+    for query in queries:
+        start = time.perf_counter()
+        results.append(index.search(1, query[None, :], k)[0])
+        samples.append(time.perf_counter() - start)
+    return results, latency_summary(samples)
+
+
+def run(args) -> Dict[str, Any]:
+    if args.backend == 'sentence':
+        from rag_engine import SentenceEmbedding
+        backend = SentenceEmbedding()
+        corpus = SyntheticCorpus(seed=args.seed)
+        vectors = backend.encode([corpus.document(800) for _ in range(args.vectors)])
+        queries = backend.encode_queries([corpus.query() for _ in range(args.queries)])
+    else:
+        rng = np.random.default_rng(args.seed)
+        centres = rng.standard_normal((args.clusters, args.dimension)).astype(np.float32)
+        vectors = clustered_vectors(args.vectors, centres, rng)
+        queries = clustered_vectors(args.queries, centres, rng)
+
+    # Exact float32 search is the ground truth every configuration is compared to
+    configurations = [('exact_float32', 'float32', None), ('exact_int8', 'int8', None)]
+    configurations += [(f"ivf_nprobe_{nprobe}", 'float32', nprobe) for nprobe in args.nprobe]
+    configurations += [(f"ivf_int8_nprobe_{nprobe}", 'int8', nprobe) for nprobe in args.nprobe]
+
+    results: Dict[str, Any] = {
+        'parameters': {
+            'backend': args.backend,
+            'vectors': len(vectors),
+            'dimension': int(vectors.shape[1]),
+            'queries': len(queries),
+            'k': args.k,
+            'seed': args.seed,
+        },
+        'configurations': {},
+    }
+
+    truth = None
+    for name, storage, nprobe in configurations:
+        ann_threshold = 0 if nprobe else len(vectors) + 1
+        index, build_seconds = build_index(vectors, storage, ann_threshold, nprobe or 1, args.chunks_per_doc)
+        found, latency = time_search(index, queries, args.k)
+        if truth is None:
+            truth = found
+        results['configurations'][name] = {
+            'build_seconds': build_seconds,
+            'latency': latency,
+            'recall_at_k': recall_at_k(found, truth),
+            'index_bytes': index.stats()['bytes'],
+        }
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark exact vs approximate dense vector search")
+    parser.add_argument('--backend', choices=['synthetic', 'sentence'], default='synthetic')
+    parser.add_argument('--vectors', type=int, default=50000)
+    parser.add_argument('--dimension', type=int, default=384)
+    parser.add_argument('--clusters', type=int, default=100)
+    parser.add_argument('--chunks-per-doc', type=int, default=100)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--k', type=int, default=5)
+    parser.add_argument('--nprobe', type=int, nargs='+', default=[4, 16])
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help="write JSON results here instead of stdout")
+    args = parser.parse_args()
+
+    emit_results(run(args), args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+"""DOCX extraction benchmark: python-docx object model vs the streaming body parser
+
+Usage:
+    python -m benchmarks.bench_docx --tables 20 --rows 200 --cols 8 --merge-every 5 --output docx.json
+
+Builds a synthetic table-heavy DOCX (paragraphs between tables, with
+horizontally and vertically merged cells) and times the previous extractor,
+which walks `doc.paragraphs` and then every `table.rows` -> `row.cells`,
+against `DocumentProcessor._extract_from_docx`. Extracted characters are
+reported too, since the old extractor repeats the text of merged cells.
+"""
+import os
+import time
+import zipfile
+import argparse
+import tempfile
+from typing import Dict, Any, List, Iterator
+from xml.sax.saxutils import escape
+
+from benchmarks.common import SyntheticCorpus, latency_summary, emit_results
+
+_CONTENT_TYPES = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">
+<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>
+<Default Extension="xml" ContentType="application/xml"/>
+<Override PartName="/word/document.xml" ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>
+</Types>"""
+
+_RELS = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="word/document.xml"/>
+</Relationships>"""
+
+
+def _paragraph(text: str) -> str:
+    return f'<w:p><w:r><w:t xml:space="preserve">{escape(text)}</w:t></w:r></w:p>'
+
+
+def _cell(text: str, properties: str = "") -> str:
+    return f"<w:tc><w:tcPr>{properties}</w:tcPr>{_paragraph(text)}</w:tc>"
+
+
+def _table(corpus: SyntheticCorpus, rows: int, cols: int, merge_every: int) -> Iterator[str]:
+    yield "<w:tbl><w:tblGrid>" + '<w:gridCol w:w="1000"/>' * cols + "</w:tblGrid>"
+    for row in range(rows):
+        cells = []
+        col = 0
+        while col < cols:
+            text = corpus.sentence(2, 6)
+            if merge_every and row % merge_every == 0 and col == 0 and cols > 1:
+                # A header-like cell spanning two columns
+                cells.append(_cell(text, '<w:gridSpan w:val="2"/>'))
+                col += 2
+                continue
+            if merge_every and col == cols - 1:
+                # The last column is merged vertically in runs of `merge_every` rows
+                start = row % merge_every == 0
+                cells.append(_cell(text if start else "",
+                                   '<w:vMerge w:val="restart"/>' if start else "<w:vMerge/>"))
+            else:
+                cells.append(_cell(text))
+            col += 1
+        yield "<w:tr>" + "".join(cells) + "</w:tr>"
+    yield "</w:tbl>"
+
+
+def build_docx(path: str, corpus: SyntheticCorpus, tables: int, rows: int, cols: int, merge_every: int,
+               paragraphs: int):
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('[Content_Types].xml', _CONTENT_TYPES)
+        archive.writestr('_rels/.rels', _RELS)
+        with archive.open('word/document.xml', 'w') as xml:
+            xml.write(b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                      b'<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"><w:body>')
+            for _ in range(tables):
+                for _ in range(paragraphs):
+                    xml.write(_paragraph(corpus.sentence()).encode())
+                for part in _table(corpus, rows, cols, merge_every):
+                    xml.write(part.encode())
+            xml.write(b"</w:body></w:document>")
+
+
+def legacy_extract(file_path: str) -> List[str]:
+    """The extractor this benchmark replaced: paragraphs first, then every table cell via python-docx"""
+    from docx import Document as DocxDocument
+
+    doc = DocxDocument(file_path)
+    segments = [paragraph.text for paragraph in doc.paragraphs if paragraph.text.strip()]
+    for table in doc.tables:
+        for row in table.rows:
+            cells = [cell.text for cell in row.cells if cell.text.strip()]
+            if cells:
+                segments.append(" ".join(cells))
+    return segments
+
+
+def time_extractor(extract, path: str, repeat: int) -> Dict[str, Any]:
+    samples = []
+    segments: List[str] = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        segments = list(extract(path))
+        samples.append(time.perf_counter() - start)
+    summary = latency_summary(samples)
+    summary['segments'] = len(segments)
+    summary['chars'] = sum(len(segment) for segment in segments)
+    return summary
+
+
+def run(args) -> Dict[str, Any]:
+    from document_processor import DocumentProcessor
+
+    corpus = SyntheticCorpus(seed=args.seed)
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="askscribe-bench-docx-")
+    os.makedirs(work_dir, exist_ok=True)
+    path = os.path.join(work_dir, "tables.docx")
+    build_docx(path, corpus, args.tables, args.rows, args.cols, args.merge_every, args.paragraphs)
+
+    processor = DocumentProcessor()
+    results: Dict[str, Any] = {
+        'parameters': {
+            'tables': args.tables,
+            'rows': args.rows,
+            'cols': args.cols,
+            'merge_every': args.merge_every,
+            'paragraphs': args.paragraphs,
+            'repeat': args.repeat,
+            'seed': args.seed,
+        },
+        'file_bytes': os.path.getsize(path),
+        'python_docx': time_extractor(legacy_extract, path, args.repeat),
+        'streaming': time_extractor(processor._extract_from_docx, path, args.repeat),
+    }
+    streaming_ms = results['streaming']['mean_ms']
+    results['speedup'] = results['python_docx']['mean_ms'] / streaming_ms if streaming_ms else 0.0
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare DOCX extractors on a table-heavy document")
+    parser.add_argument('--tables', type=int, default=20)
+    parser.add_argument('--rows', type=int, default=200, help="rows per table")
+    parser.add_argument('--cols', type=int, default=8, help="columns per table")
+    parser.add_argument('--merge-every', type=int, default=5,
+                        help="rows per vertical merge run and between spanning cells, 0 for no merges")
+    parser.add_argument('--paragraphs', type=int, default=10, help="paragraphs before each table")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--work-dir', help="directory for the generated document")
+    parser.add_argument('--output', help="write JSON results here instead of stdout")
+    args = parser.parse_args()
+
+    emit_results(run(args), args.output)
+
+
+if __name__ == "__main__":
+    main()
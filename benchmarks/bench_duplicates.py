@@ -0,0 +1,192 @@
+"""Near-duplicate collapsing benchmark: redundant top-k slots, search latency and LSH lookups vs a full scan
+
+Usage:
+    python -m benchmarks.bench_duplicates --reports 40 --versions 3 --chunks-per-doc 20 --queries 200 --output duplicates.json
+
+Indexes one user's reports, each uploaded as `--versions` versions: later
+versions rewrite `--edit-fraction` of the chunks and change a few words in
+the rest. Queries lift words out of random chunks. Reports, with
+COLLAPSE_DUPLICATES off and on:
+
+- how many of the top k results repeat a chunk already above them (copies of
+  one original chunk), how many documents each query cites and search latency;
+- MinHash signing throughput;
+- for sampled chunks, the near-duplicates found through the LSH buckets
+  against comparing the signature with every chunk of the user, with the
+  recall of the LSH lookup and how many signatures each one compares.
+"""
+import os
+import time
+import random
+import logging
+import argparse
+from typing import Dict, Any, List
+
+from benchmarks.common import SyntheticCorpus, setup_environment, latency_summary, emit_results
+
+
+def build_versions(args, corpus: SyntheticCorpus, rng: random.Random) -> List[tuple]:
+    """(name, chunks, origins) per uploaded version; copies of one original chunk share an origin"""
+    uploads = []
+    for r in range(args.reports):
+        original = [corpus.document(args.chunk_chars) for _ in range(args.chunks_per_doc)]
+        for v in range(args.versions):
+            chunks = []
+            origins = []
+            for c, chunk in enumerate(original):
+                if v and rng.random() < args.edit_fraction:
+                    chunks.append(corpus.document(args.chunk_chars))
+                    origins.append(('rewritten', r, v, c))
+                    continue
+                words = chunk.split()
+                for _ in range(args.word_edits if v else 0):
+                    words[rng.randrange(len(words))] = rng.choice(corpus.vocabulary)
+                chunks.append(" ".join(words))
+                origins.append(('original', r, c))
+            uploads.append((f"report_{r}_v{v + 1}.txt", chunks, origins))
+    return uploads
+
+
+def redundant_slots(results: List[Dict[str, Any]], origins: Dict[tuple, tuple]) -> int:
+    seen = set()
+    redundant = 0
+    for chunk in results:
+        origin = origins[(chunk['document_id'], chunk['chunk_id'])]
+        redundant += origin in seen
+        seen.add(origin)
+    return redundant
+
+
+def run(args) -> Dict[str, Any]:
+    work_dir = setup_environment(args.work_dir)
+
+    from app import app, db, init_db
+    import rag_engine
+    from models import User, Document
+    from generators import LocalGenerator
+
+    logging.getLogger().setLevel(logging.WARNING)
+    init_db()
+    corpus = SyntheticCorpus(vocab_size=args.vocab_size, seed=args.seed)
+    rng = random.Random(args.seed)
+    uploads = build_versions(args, corpus, rng)
+
+    results: Dict[str, Any] = {
+        'parameters': {
+            'reports': args.reports,
+            'versions': args.versions,
+            'chunks_per_doc': args.chunks_per_doc,
+            'edit_fraction': args.edit_fraction,
+            'word_edits': args.word_edits,
+            'queries': args.queries,
+            'k': args.k,
+            'seed': args.seed,
+        },
+    }
+
+    with app.app_context():
+        user = User(username=f"bench-{int(time.time() * 1000)}", email=f"bench-{time.time()}@example.com")
+        user.set_password("benchmark")
+        db.session.add(user)
+        db.session.commit()
+
+        engine = rag_engine.RAGEngine(index_file=os.path.join(work_dir, "bench_index.json"),
+                                      generator=LocalGenerator())
+        pending = []
+        origins = {}
+        for name, chunks, chunk_origins in uploads:
+            document = Document(filename=name, original_filename=name, file_path=os.path.join(work_dir, name),
+                                file_type='txt', file_size=sum(len(chunk) for chunk in chunks),
+                                processed=True, user_id=user.id)
+            db.session.add(document)
+            db.session.flush()
+            pending.append((document.id, chunks))
+            origins.update({(document.id, i): origin for i, origin in enumerate(chunk_origins)})
+        db.session.commit()
+        for _ in engine.add_documents(pending, user.id):
+            pass
+        documents = engine._get_user_documents(user.id)
+
+        all_chunks = [chunk for _, chunks, _ in uploads for chunk in chunks]
+        start = time.perf_counter()
+        engine.minhash.signatures(all_chunks)
+        elapsed = time.perf_counter() - start
+        results['signatures_per_second'] = len(all_chunks) / elapsed if elapsed else 0.0
+        results['lsh_buckets'] = len(engine.lsh_index.buckets)
+
+        queries = []
+        for _ in range(args.queries):
+            words = rng.choice(all_chunks).split()
+            queries.append(" ".join(rng.sample(words, min(len(words), rng.randint(3, 6)))))
+
+        for mode, collapse in (('separate', False), ('collapsed', True)):
+            engine.collapse_duplicates = collapse
+            samples = []
+            redundant = []
+            cited = []
+            for query in queries:
+                start = time.perf_counter()
+                hits = engine.search_similar_chunks(query, user.id, k=args.k)
+                samples.append(time.perf_counter() - start)
+                redundant.append(redundant_slots(hits, origins))
+                cited.append(len({chunk['document_id'] for chunk in hits} |
+                                 {copy['document_id'] for chunk in hits for copy in chunk.get('duplicates', [])}))
+            results[mode] = {
+                'latency': latency_summary(samples),
+                'mean_redundant_slots': sum(redundant) / len(redundant) if redundant else 0.0,
+                'queries_with_redundant_slots': sum(1 for count in redundant if count),
+                'mean_cited_documents': sum(cited) / len(cited) if cited else 0.0,
+            }
+
+        # LSH lookups against comparing each sampled signature with every chunk of the user
+        refs = [(doc_id, i) for doc_id in documents for i in range(len(engine.chunk_signatures[doc_id]))]
+        sample = rng.sample(refs, min(args.lookups, len(refs)))
+        timings = {'lsh': [], 'scan': []}
+        found = expected = compared = 0
+        for doc_id, i in sample:
+            signature = engine.chunk_signatures[doc_id][i]
+            start = time.perf_counter()
+            matches = set(engine.lsh_index.near_duplicates(signature, engine.chunk_signatures, documents))
+            timings['lsh'].append(time.perf_counter() - start)
+            compared += len({ref for key in engine.minhash.band_keys(signature)
+                             for ref in engine.lsh_index.buckets.get(key, ())})
+
+            start = time.perf_counter()
+            truth = {ref for ref in refs if engine.minhash.similarity(
+                signature, engine.chunk_signatures[ref[0]][ref[1]]) >= engine.lsh_index.threshold}
+            timings['scan'].append(time.perf_counter() - start)
+            found += len(matches & truth)
+            expected += len(truth)
+
+        results['lookups'] = {
+            'chunks': len(refs),
+            'lsh': latency_summary(timings['lsh']),
+            'scan': latency_summary(timings['scan']),
+            'lsh_recall': found / expected if expected else 1.0,
+            'mean_signatures_compared': compared / len(sample) if sample else 0.0,
+        }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure near-duplicate collapsing of search results")
+    parser.add_argument('--reports', type=int, default=40)
+    parser.add_argument('--versions', type=int, default=3, help="uploaded versions of each report")
+    parser.add_argument('--chunks-per-doc', type=int, default=20)
+    parser.add_argument('--chunk-chars', type=int, default=800)
+    parser.add_argument('--edit-fraction', type=float, default=0.2, help="share of chunks rewritten in later versions")
+    parser.add_argument('--word-edits', type=int, default=2, help="words changed in each kept chunk of later versions")
+    parser.add_argument('--vocab-size', type=int, default=5000)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--lookups', type=int, default=200, help="chunks whose near-duplicates are looked up")
+    parser.add_argument('--k', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--work-dir', help="directory for the scratch database and index")
+    parser.add_argument('--output', help="write JSON results here instead of stdout")
+    args = parser.parse_args()
+
+    emit_results(run(args), args.output)
+
+
+if __name__ == "__main__":
+    main()
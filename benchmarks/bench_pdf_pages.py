@@ -0,0 +1,147 @@
+"""PDF page classification benchmark: the old "under 50 characters" OCR rule vs PageClassifier
+
+Usage:
+    python -m benchmarks.bench_pdf_pages --repeat 5 --output pages.json
+
+Builds a mixed PDF whose page kinds are known (prose, blank, separator,
+figure with caption, scan, half-page scan with wide margins, and scan under a
+garbage text layer) and reports what each rule decides per kind, how many
+pages each sends to OCR, how many megapixels those pages render to (what
+Tesseract's time grows with) and how long classification takes. When
+Tesseract is installed, both plans are also OCR'd and timed.
+"""
+import time
+import random
+import argparse
+from typing import Dict, Any, List
+
+from benchmarks.common import SyntheticCorpus, latency_summary, emit_results
+
+# What a page of each kind should get
+EXPECTED = {
+    'prose': 'text',
+    'blank': 'skip',
+    'separator': 'text',
+    'figure': 'text',
+    'scan': 'ocr',
+    'half_scan': 'ocr',
+    'garbage_scan': 'ocr',
+}
+
+
+def _scan_image(fitz, text: str, dpi: int):
+    """A page of text rendered to a bitmap, as a scanner would produce it"""
+    source = fitz.open()
+    page = source.new_page()
+    page.insert_textbox(page.rect + (72, 72, -72, -72), text, fontsize=11)
+    pixmap = page.get_pixmap(dpi=dpi, colorspace=fitz.csGRAY)
+    source.close()
+    return pixmap
+
+
+def build_pdf(fitz, corpus: SyntheticCorpus, copies: int, scan_dpi: int):
+    rng = random.Random(7)
+    doc = fitz.open()
+    kinds: List[str] = []
+    for _ in range(copies):
+        for kind in EXPECTED:
+            page = doc.new_page()
+            kinds.append(kind)
+            if kind == 'prose':
+                page.insert_textbox(page.rect + (72, 72, -72, -72), corpus.document(2500), fontsize=11)
+            elif kind == 'separator':
+                page.insert_text((200, 400), "Part " + str(len(kinds)), fontsize=24)
+            elif kind == 'figure':
+                figure = fitz.Pixmap(fitz.csRGB, fitz.IRect(0, 0, 400, 300))
+                figure.clear_with(180)
+                page.insert_image(fitz.Rect(72, 150, 540, 500), pixmap=figure)
+                page.insert_text((72, 530), "Figure: " + corpus.sentence(3, 5), fontsize=10)
+            elif kind in ('scan', 'garbage_scan'):
+                page.insert_image(page.rect, pixmap=_scan_image(fitz, corpus.document(2000), scan_dpi))
+                if kind == 'garbage_scan':
+                    # Invisible text layer of broken glyphs, like a bad embedded OCR
+                    junk = "".join(rng.choice("#%&@~^|<>*+=$q") for _ in range(400))
+                    page.insert_textbox(page.rect + (72, 72, -72, -72), junk, fontsize=11, render_mode=3)
+            elif kind == 'half_scan':
+                # A photographed page or scanned figure: no text layer, under the full-scan coverage
+                page.insert_image(fitz.Rect(90, 200, 520, 560),
+                                  pixmap=_scan_image(fitz, corpus.document(800), scan_dpi))
+    return doc, kinds
+
+
+def old_rule(page) -> Dict[str, Any]:
+    text = page.get_text()
+    return {'mode': 'ocr' if len(text.strip()) < 50 else 'text', 'dpi': 72}
+
+
+def run(args) -> Dict[str, Any]:
+    import fitz
+    import pytesseract
+    from PIL import Image
+    from page_classifier import PageClassifier
+
+    corpus = SyntheticCorpus(seed=args.seed)
+    doc, kinds = build_pdf(fitz, corpus, args.copies, args.scan_dpi)
+    classifier = PageClassifier()
+
+    results: Dict[str, Any] = {
+        'parameters': {'copies': args.copies, 'scan_dpi': args.scan_dpi, 'repeat': args.repeat, 'seed': args.seed},
+        'pages': len(kinds),
+    }
+
+    try:
+        pytesseract.get_tesseract_version()
+        have_tesseract = True
+    except Exception:
+        have_tesseract = False
+
+    for name, decide in (('old_rule', old_rule), ('classifier', classifier.classify)):
+        samples = []
+        decisions = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            decisions = [decide(doc[i]) for i in range(len(kinds))]
+            samples.append(time.perf_counter() - start)
+
+        by_kind: Dict[str, Dict[str, int]] = {}
+        for kind, decision in zip(kinds, decisions):
+            counts = by_kind.setdefault(kind, {})
+            counts[decision['mode']] = counts.get(decision['mode'], 0) + 1
+        summary: Dict[str, Any] = {
+            'decisions': by_kind,
+            'ocr_pages': sum(1 for decision in decisions if decision['mode'] == 'ocr'),
+            'correct': sum(1 for kind, decision in zip(kinds, decisions) if decision['mode'] == EXPECTED[kind]),
+            'ocr_megapixels': sum(doc[i].rect.width * doc[i].rect.height * (decision['dpi'] / 72.0) ** 2
+                                  for i, decision in enumerate(decisions) if decision['mode'] == 'ocr') / 1e6,
+            'classify': latency_summary(samples),
+        }
+
+        if have_tesseract:
+            start = time.perf_counter()
+            for i, decision in enumerate(decisions):
+                if decision['mode'] == 'ocr':
+                    pixmap = doc[i].get_pixmap(dpi=decision['dpi'], colorspace=fitz.csGRAY)
+                    pytesseract.image_to_string(Image.frombytes("L", (pixmap.width, pixmap.height), pixmap.samples))
+            summary['ocr_seconds'] = time.perf_counter() - start
+        results[name] = summary
+
+    if not have_tesseract:
+        results['note'] = "Tesseract not installed; OCR time not measured"
+    doc.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare PDF page OCR decisions on a mixed document")
+    parser.add_argument('--copies', type=int, default=5, help="pages of each kind")
+    parser.add_argument('--scan-dpi', type=int, default=200, help="resolution of the synthetic scans")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help="write JSON results here instead of stdout")
+    args = parser.parse_args()
+
+    emit_results(run(args), args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""Per-question input token cost of each prompt template version
+
+Usage:
+    python -m benchmarks.bench_prompts --questions 200 --chunks 5
+
+Token counts are local estimates (prompts.estimate_tokens), so this runs
+offline. `uncached_tokens` is what each request sends when the system prompt
+is not served from the provider's context cache.
+"""
+import argparse
+from typing import Dict, Any
+
+from benchmarks.common import SyntheticCorpus, emit_results
+
+
+def run(args) -> Dict[str, Any]:
+    from prompts import PROMPT_TEMPLATES
+
+    corpus = SyntheticCorpus(seed=args.seed)
+    samples = [(corpus.query() + "?", "\n\n".join(corpus.document(args.chunk_chars) for _ in range(args.chunks)))
+               for _ in range(args.questions)]
+
+    results: Dict[str, Any] = {
+        'parameters': {
+            'questions': args.questions,
+            'chunks': args.chunks,
+            'chunk_chars': args.chunk_chars,
+            'seed': args.seed,
+        },
+        'templates': {},
+    }
+    for version, template in PROMPT_TEMPLATES.items():
+        user_tokens = [template.stats(question, context)['user_tokens'] for question, context in samples]
+        mean_user = sum(user_tokens) / len(user_tokens)
+        results['templates'][version] = {
+            'system_tokens': template.system_tokens,
+            'mean_user_tokens': mean_user,
+            'uncached_tokens': template.system_tokens + mean_user,
+            'cached_tokens': mean_user,
+        }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare prompt template versions by input token cost")
+    parser.add_argument('--questions', type=int, default=200)
+    parser.add_argument('--chunks', type=int, default=5, help="retrieved chunks per question")
+    parser.add_argument('--chunk-chars', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help="write JSON results here instead of stdout")
+    args = parser.parse_args()
+
+    emit_results(run(args), args.output)
+
+
+if __name__ == "__main__":
+    main()
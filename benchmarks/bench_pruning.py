@@ -0,0 +1,156 @@
+"""Sparse scoring benchmark: exhaustive postings traversal vs document-level max-score pruning
+
+Usage:
+    python -m benchmarks.bench_pruning --documents 300 --chunks-per-doc 40 --queries 200 --output pruning.json
+
+Indexes one user's topically unrelated documents (each draws most words from
+its own vocabulary, the rest from a shared one) and times the first-pass
+scoring of `RAGEngine._score_sparse` against scoring every posting of the
+query terms, as the engine did before. Both must return the same top k.
+"""
+import os
+import time
+import random
+import itertools
+import logging
+import argparse
+from typing import Dict, Any, List
+
+from benchmarks.common import SyntheticCorpus, setup_environment, latency_summary, emit_results
+
+
+def exhaustive_scores(engine, query_embedding: Dict[str, float], documents: Dict[int, str], k: int) -> list:
+    """Accumulate every posting of every query term, then keep the top k"""
+    import heapq
+
+    query_norm = sum(w * w for w in query_embedding.values()) ** 0.5
+    if query_norm == 0.0:
+        return engine._pad_unmatched([], documents, k)
+    accumulated = {}
+    for term, weight in query_embedding.items():
+        for doc_id, chunks in engine.postings.get(term, {}).items():
+            if doc_id in documents:
+                for i, chunk_weight in chunks:
+                    accumulated[(doc_id, i)] = accumulated.get((doc_id, i), 0.0) + weight * chunk_weight
+    return engine._pad_unmatched(heapq.nlargest(k, [(dot_product / query_norm, -doc_id, -i)
+                                                    for (doc_id, i), dot_product in accumulated.items()]),
+                                 documents, k)
+
+
+def build_chunks(args) -> List[List[str]]:
+    shared = SyntheticCorpus(vocab_size=args.vocab_size, seed=args.seed)
+    shared_weights = list(itertools.accumulate(shared.weights))
+    rng = random.Random(args.seed)
+    shared_words = round(args.words_per_chunk * args.shared_fraction)
+    documents = []
+    for d in range(args.documents):
+        topic = SyntheticCorpus(vocab_size=args.vocab_size // 4, seed=args.seed + 1 + d)
+        topic_weights = list(itertools.accumulate(topic.weights))
+        chunks = []
+        for _ in range(args.chunks_per_doc):
+            words = rng.choices(shared.vocabulary, cum_weights=shared_weights, k=shared_words) + \
+                rng.choices(topic.vocabulary, cum_weights=topic_weights, k=args.words_per_chunk - shared_words)
+            rng.shuffle(words)
+            chunks.append(" ".join(words))
+        documents.append(chunks)
+    return documents
+
+
+def run(args) -> Dict[str, Any]:
+    work_dir = setup_environment(args.work_dir)
+
+    from app import app, db, init_db
+    import rag_engine
+    from models import User, Document
+    from generators import LocalGenerator
+
+    logging.getLogger().setLevel(logging.WARNING)
+    init_db()
+    chunk_sets = build_chunks(args)
+    rng = random.Random(args.seed + 7)
+
+    results: Dict[str, Any] = {
+        'parameters': {
+            'documents': args.documents,
+            'chunks_per_doc': args.chunks_per_doc,
+            'words_per_chunk': args.words_per_chunk,
+            'shared_fraction': args.shared_fraction,
+            'queries': args.queries,
+            'k': args.k,
+            'seed': args.seed,
+        },
+    }
+
+    with app.app_context():
+        user = User(username=f"bench-{int(time.time() * 1000)}", email=f"bench-{time.time()}@example.com")
+        user.set_password("benchmark")
+        db.session.add(user)
+        db.session.commit()
+
+        engine = rag_engine.RAGEngine(index_file=os.path.join(work_dir, "bench_index.json"),
+                                      generator=LocalGenerator())
+        pending = []
+        for i, chunks in enumerate(chunk_sets):
+            document = Document(filename=f"bench_{i}.txt", original_filename=f"bench_{i}.txt",
+                                file_path=os.path.join(work_dir, f"bench_{i}.txt"), file_type='txt',
+                                file_size=sum(len(chunk) for chunk in chunks), processed=True, user_id=user.id)
+            db.session.add(document)
+            db.session.flush()
+            pending.append((document.id, chunks))
+        db.session.commit()
+        # One commit and one index write for the whole corpus
+        for _ in engine.add_documents(pending, user.id):
+            pass
+        documents = engine._get_user_documents(user.id)
+
+        # Queries lift a few words out of one random chunk, so each has a relevant document
+        queries = []
+        for _ in range(args.queries):
+            chunk = rng.choice(rng.choice(chunk_sets)).split()
+            queries.append(" ".join(rng.sample(chunk, min(len(chunk), rng.randint(2, 5)))))
+        embeddings = engine.embedding_model.encode_queries(queries)
+
+        timings = {'exhaustive': [], 'pruned': []}
+        candidates = []
+        mismatches = 0
+        for embedding in embeddings:
+            start = time.perf_counter()
+            expected = exhaustive_scores(engine, embedding, documents, args.k)
+            timings['exhaustive'].append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            pruned = sorted(engine._score_sparse([embedding], documents, args.k)[0], reverse=True)
+            timings['pruned'].append(time.perf_counter() - start)
+
+            if [entry[1:] for entry in expected] != [entry[1:] for entry in pruned]:
+                mismatches += 1
+            candidates.append(len({doc_id for term in embedding for doc_id in engine.term_bounds.get(term, {})}))
+
+        for name, samples in timings.items():
+            results[name] = latency_summary(samples)
+        results['mean_candidate_documents'] = sum(candidates) / len(candidates) if candidates else 0.0
+        results['top_k_mismatches'] = mismatches
+        pruned_ms = results['pruned']['mean_ms']
+        results['speedup'] = results['exhaustive']['mean_ms'] / pruned_ms if pruned_ms else 0.0
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare exhaustive and pruned sparse scoring")
+    parser.add_argument('--documents', type=int, default=300)
+    parser.add_argument('--chunks-per-doc', type=int, default=40)
+    parser.add_argument('--words-per-chunk', type=int, default=150)
+    parser.add_argument('--shared-fraction', type=float, default=0.3, help="share of words from the common vocabulary")
+    parser.add_argument('--vocab-size', type=int, default=5000)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--k', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--work-dir', help="directory for the scratch database and index")
+    parser.add_argument('--output', help="write JSON results here instead of stdout")
+    args = parser.parse_args()
+
+    emit_results(run(args), args.output)
+
+
+if __name__ == "__main__":
+    main()
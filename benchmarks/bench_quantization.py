@@ -0,0 +1,95 @@
+"""Memory saved vs recall lost for quantized dense vector storage
+
+Usage:
+    python -m benchmarks.bench_quantization --vectors 50000 --dimension 384 --pq-subvectors 16 48
+
+Every configuration is compared to exact float32 search over the same
+synthetic clustered vectors. Re-ranking reads the original float vectors,
+standing in for the engine re-encoding candidate chunks.
+"""
+import argparse
+from typing import Dict, Any
+
+import numpy as np
+
+from benchmarks.common import emit_results
+from benchmarks.bench_dense import clustered_vectors, recall_at_k, time_search
+
+
+def build_index(vectors: np.ndarray, chunks_per_doc: int, **settings):
+    from vector_index import DenseVectorIndex
+
+    def vector_source(refs):
+        return vectors[[doc_id * chunks_per_doc + chunk_id for doc_id, chunk_id in refs]]
+
+    index = DenseVectorIndex(vectors.shape[1], ann_threshold=len(vectors) + 1,
+                             vector_source=vector_source, **settings)
+    for doc_id, offset in enumerate(range(0, len(vectors), chunks_per_doc)):
+        index.add(1, doc_id, vectors[offset:offset + chunks_per_doc])
+    return index
+
+
+def run(args) -> Dict[str, Any]:
+    rng = np.random.default_rng(args.seed)
+    centres = rng.standard_normal((args.clusters, args.dimension)).astype(np.float32)
+    vectors = clustered_vectors(args.vectors, centres, rng)
+    queries = clustered_vectors(args.queries, centres, rng)
+
+    configurations = [('float32', {'storage': 'float32'}),
+                      ('int8', {'storage': 'int8'}),
+                      (f"int8_rerank_{args.rerank}", {'storage': 'int8', 'rerank': args.rerank})]
+    for m in args.pq_subvectors:
+        configurations.append((f"pq{m}", {'storage': 'pq', 'pq_subvectors': m}))
+        configurations.append((f"pq{m}_rerank_{args.rerank}",
+                               {'storage': 'pq', 'pq_subvectors': m, 'rerank': args.rerank}))
+
+    results: Dict[str, Any] = {
+        'parameters': {
+            'vectors': args.vectors,
+            'dimension': args.dimension,
+            'queries': args.queries,
+            'k': args.k,
+            'rerank': args.rerank,
+            'seed': args.seed,
+        },
+        'configurations': {},
+    }
+
+    truth = None
+    baseline_bytes = None
+    for name, settings in configurations:
+        index = build_index(vectors, args.chunks_per_doc, **settings)
+        found, latency = time_search(index, queries, args.k)
+        stats = index.stats()
+        if truth is None:
+            truth = found
+            baseline_bytes = stats['bytes']
+        results['configurations'][name] = {
+            'index_bytes': stats['bytes'],
+            'memory_saved': 1.0 - stats['bytes'] / baseline_bytes,
+            'recall_at_k': recall_at_k(found, truth),
+            'latency': latency,
+        }
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Report memory saved vs recall@k for vector quantization")
+    parser.add_argument('--vectors', type=int, default=50000)
+    parser.add_argument('--dimension', type=int, default=384)
+    parser.add_argument('--clusters', type=int, default=100)
+    parser.add_argument('--chunks-per-doc', type=int, default=100)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--k', type=int, default=5)
+    parser.add_argument('--rerank', type=int, default=50, help="candidates re-scored with float vectors")
+    parser.add_argument('--pq-subvectors', type=int, nargs='+', default=[16, 48])
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help="write JSON results here instead of stdout")
+    args = parser.parse_args()
+
+    emit_results(run(args), args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""End-to-end /ask and /ask/stream benchmark against the local answer generator
+
+Usage:
+    python -m benchmarks.bench_serving --requests 200 --concurrency 4 --llm-latency-ms 300 --tokens-per-second 50
+
+Requests go through the Flask app (login, session, retrieval, generation,
+message save) with the deterministic local generator standing in for the
+LLM, so the numbers isolate AskScribe's own serving path. With the default
+zero latency and unlimited token rate, generation costs nothing.
+`--extractive` turns on the extractive fast path; `answers` then shows the
+share of questions served without an LLM call.
+"""
+import os
+import json
+import time
+import logging
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List
+
+from benchmarks.common import SyntheticCorpus, setup_environment, latency_summary, emit_results
+
+
+def ask(client, payload: Dict[str, Any]) -> Dict[str, float]:
+    start = time.perf_counter()
+    response = client.post('/ask', json=payload)
+    if response.status_code != 200:
+        raise RuntimeError(f"/ask returned {response.status_code}")
+    return {'latency': time.perf_counter() - start}
+
+
+def ask_stream(client, payload: Dict[str, Any]) -> Dict[str, float]:
+    start = time.perf_counter()
+    response = client.post('/ask/stream', json=payload, buffered=False)
+    first_delta = None
+    for line in response.response:
+        for event in line.decode().splitlines():
+            if first_delta is None and 'delta' in json.loads(event):
+                first_delta = time.perf_counter() - start
+    response.close()
+    latency = time.perf_counter() - start
+    return {'latency': latency, 'first_delta': first_delta if first_delta is not None else latency}
+
+
+def run_load(app, user_id: int, questions: List[str], concurrency: int, call, extractive: bool) -> Dict[str, Any]:
+    def worker(chunk: List[str]) -> List[Dict[str, float]]:
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session['_user_id'] = str(user_id)
+        return [call(client, {'question': question, 'extractive': extractive}) for question in chunk]
+
+    # One untimed request so lazy imports and caches don't land in the samples
+    worker(questions[:1])
+
+    chunks = [questions[i::concurrency] for i in range(concurrency)]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        samples = [sample for result in executor.map(worker, chunks) for sample in result]
+    elapsed = time.perf_counter() - start
+
+    summary: Dict[str, Any] = {
+        'requests': len(samples),
+        'seconds': elapsed,
+        'requests_per_second': len(samples) / elapsed if elapsed else 0.0,
+        'latency': latency_summary([sample['latency'] for sample in samples]),
+    }
+    if samples and 'first_delta' in samples[0]:
+        summary['time_to_first_delta'] = latency_summary([sample['first_delta'] for sample in samples])
+    return summary
+
+
+def run(args) -> Dict[str, Any]:
+    work_dir = setup_environment(args.work_dir)
+    os.environ["LLM_BACKEND"] = "local"
+
+    from app import app, db, init_db
+    import routes
+    from models import User, Document
+    from rag_engine import RAGEngine
+    from generators import LocalGenerator
+
+    logging.getLogger().setLevel(logging.WARNING)
+    init_db()
+
+    corpus = SyntheticCorpus(vocab_size=args.vocab_size, seed=args.seed)
+    questions = [corpus.query() for _ in range(args.requests)]
+    generator = LocalGenerator(latency=args.llm_latency_ms / 1000.0, tokens_per_second=args.tokens_per_second)
+
+    with app.app_context():
+        user = User(username=f"bench-{int(time.time() * 1000)}", email=f"bench-{time.time()}@example.com")
+        user.set_password("benchmark")
+        db.session.add(user)
+        db.session.commit()
+        user_id = user.id
+
+        # Serve from a scratch index instead of the one routes loaded from vector_store/
+        routes.rag_engine = RAGEngine(index_file=os.path.join(work_dir, "bench_index.json"), generator=generator)
+        for i in range(args.documents):
+            text = corpus.document(args.chunks_per_doc * 800)
+            document = Document(
+                filename=f"bench_{i}.txt",
+                original_filename=f"bench_{i}.txt",
+                file_path=os.path.join(work_dir, f"bench_{i}.txt"),
+                file_type='txt',
+                file_size=len(text),
+                processed=True,
+                user_id=user_id
+            )
+            db.session.add(document)
+            db.session.commit()
+            document.chunk_count = routes.rag_engine.add_document(
+                document.id, routes.document_processor.create_chunks(text), user_id=user_id)
+            db.session.commit()
+
+    return {
+        'parameters': {
+            'requests': args.requests,
+            'concurrency': args.concurrency,
+            'documents': args.documents,
+            'chunks_per_doc': args.chunks_per_doc,
+            'llm_latency_ms': args.llm_latency_ms,
+            'tokens_per_second': args.tokens_per_second,
+            'extractive': args.extractive,
+            'seed': args.seed,
+        },
+        'ask': run_load(app, user_id, questions, args.concurrency, ask, args.extractive),
+        'ask_stream': run_load(app, user_id, questions, args.concurrency, ask_stream, args.extractive),
+        # Evaluated last, so it covers both runs
+        'answers': routes.rag_engine.answer_stats(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the question answering endpoints offline")
+    parser.add_argument('--requests', type=int, default=200, help="questions per endpoint")
+    parser.add_argument('--concurrency', type=int, default=4, help="concurrent clients")
+    parser.add_argument('--documents', type=int, default=10)
+    parser.add_argument('--chunks-per-doc', type=int, default=50)
+    parser.add_argument('--vocab-size', type=int, default=5000)
+    parser.add_argument('--llm-latency-ms', type=float, default=0.0, help="simulated time to first token")
+    parser.add_argument('--tokens-per-second', type=float, default=0.0, help="simulated generation rate, 0 for instant")
+    parser.add_argument('--extractive', action='store_true', help="let lookups be answered without the LLM")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--work-dir', help="directory for the scratch database and index")
+    parser.add_argument('--output', help="write JSON results here instead of stdout")
+    args = parser.parse_args()
+
+    emit_results(run(args), args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+"""Worker boot cost: import time, peak memory and which heavy libraries a fresh process has loaded
+
+Usage:
+    python -m benchmarks.bench_startup --module main --top 20 --output startup.json
+
+Prepares a scratch database and index, then runs fresh interpreters on it:
+
+- `python -X importtime -c "import main"`; the per-module timings it prints
+  are parsed into the total import time and the slowest imports by
+  cumulative time;
+- a child that boots the app and serves a chat page and then a question,
+  reporting elapsed time, peak RSS and the heavy libraries in `sys.modules`
+  after each step, once with the default lazy index load and once with
+  INDEX_PRELOAD.
+
+For the full tree, run `python -X importtime -c "import main" 2> import.log`
+and open it with a viewer such as tuna.
+"""
+import os
+import sys
+import json
+import argparse
+import subprocess
+from typing import Dict, Any, List
+
+from benchmarks.common import ROOT_DIR, setup_environment, emit_results
+
+# Libraries a worker should only import when it uploads a document or answers a question
+HEAVY_MODULES = ['fitz', 'pytesseract', 'PIL', 'lxml', 'google.genai', 'numpy', 'sentence_transformers', 'torch']
+
+
+def parse_importtime(stderr: str) -> List[Dict[str, Any]]:
+    """Rows of `-X importtime` output: module, nesting depth, self and cumulative milliseconds"""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|', 2)
+        stripped = name.lstrip()
+        rows.append({
+            'module': stripped.strip(),
+            'depth': (len(name) - len(stripped) - 1) // 2,
+            'self_ms': int(self_us) / 1000.0,
+            'cumulative_ms': int(cumulative_us) / 1000.0,
+        })
+    return rows
+
+
+def import_report(module: str, env: Dict[str, str], work_dir: str, top: int) -> Dict[str, Any]:
+    completed = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                               cwd=work_dir, env=env, capture_output=True, text=True, check=True)
+    rows = parse_importtime(completed.stderr)
+    loaded = {row['module'] for row in rows}
+    return {
+        # Everything imported on behalf of the module, including the interpreter's own top-level imports
+        'total_ms': sum(row['cumulative_ms'] for row in rows if row['depth'] == 0),
+        'module_ms': next((row['cumulative_ms'] for row in rows if row['module'] == module), 0.0),
+        'modules': len(rows),
+        'heavy_modules': [name for name in HEAVY_MODULES if name in loaded],
+        'slowest': sorted(rows, key=lambda row: row['cumulative_ms'], reverse=True)[:top],
+    }
+
+
+def peak_rss_mb() -> float:
+    """Peak resident memory of this process; unlike ru_maxrss, Linux's VmHWM is not inherited from the parent"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024.0
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def boot_phases(module: str, question: str):
+    """Child process: boot the app, serve a page and a question, printing one JSON report"""
+    import time
+
+    from benchmarks.load_test import USERNAME, PASSWORD
+
+    start = time.perf_counter()
+    phases = []
+
+    def record(name):
+        phases.append({
+            'phase': name,
+            'seconds': time.perf_counter() - start,
+            'peak_rss_mb': peak_rss_mb(),
+            'heavy_modules': [module_name for module_name in HEAVY_MODULES if module_name in sys.modules],
+        })
+
+    __import__(module)
+    from app import app
+    record('import')
+
+    client = app.test_client()
+    client.post('/login', data={'username': USERNAME, 'password': PASSWORD})
+    assert client.get('/chat').status_code == 200
+    record('chat_page')
+
+    assert client.post('/ask', json={'question': question}).status_code == 200
+    record('first_question')
+    print(json.dumps(phases))
+
+
+def run(args) -> Dict[str, Any]:
+    work_dir = setup_environment(args.work_dir)
+
+    from benchmarks.load_test import prepare
+    questions = prepare(argparse.Namespace(vocab_size=args.vocab_size, seed=args.seed, documents=args.documents,
+                                           chunks_per_doc=args.chunks_per_doc, requests=1), work_dir)
+
+    env = dict(os.environ)
+    env.update({'PYTHONPATH': ROOT_DIR, 'LLM_BACKEND': 'local'})
+    env.pop('INDEX_PRELOAD', None)
+
+    results: Dict[str, Any] = {
+        'parameters': {
+            'module': args.module,
+            'documents': args.documents,
+            'chunks_per_doc': args.chunks_per_doc,
+            'seed': args.seed,
+        },
+        'importtime': import_report(args.module, env, work_dir, args.top),
+    }
+    for name, preload in (('lazy', 'false'), ('preload', 'true')):
+        completed = subprocess.run([sys.executable, '-m', 'benchmarks.bench_startup', '--boot-phases',
+                                    '--module', args.module, '--question', questions[0]],
+                                   cwd=work_dir, env=dict(env, INDEX_PRELOAD=preload),
+                                   capture_output=True, text=True, check=True)
+        results[name] = json.loads(completed.stdout.strip().splitlines()[-1])
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Report the import time and boot cost of an app worker")
+    parser.add_argument('--module', default='main', help="module a worker imports, e.g. main or asgi")
+    parser.add_argument('--top', type=int, default=20, help="slowest imports to list")
+    parser.add_argument('--documents', type=int, default=200)
+    parser.add_argument('--chunks-per-doc', type=int, default=20)
+    parser.add_argument('--vocab-size', type=int, default=5000)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--work-dir', help="directory for the scratch database and index")
+    parser.add_argument('--output', help="write JSON results here instead of stdout")
+    parser.add_argument('--boot-phases', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--question', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.boot_phases:
+        boot_phases(args.module, args.question)
+        return
+    emit_results(run(args), args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""Shared helpers for the benchmark suite: synthetic corpora, scratch environment and timing"""
+import os
+import sys
+import json
+import math
+import time
+import random
+import string
+import tempfile
+from typing import List, Dict, Any, Optional
+
+# Benchmarks are run from the repository root with `python -m benchmarks.<name>`
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+
+class SyntheticCorpus:
+    """Deterministic random corpus with a Zipf-distributed vocabulary"""
+
+    def __init__(self, vocab_size: int = 5000, seed: int = 42):
+        self.random = random.Random(seed)
+        self.vocabulary = [self._make_word() for _ in range(vocab_size)]
+        # Zipf weights so a few terms are common and most are rare, like real text
+        self.weights = [1.0 / (rank + 1) for rank in range(vocab_size)]
+
+    def _make_word(self) -> str:
+        length = self.random.randint(3, 10)
+        return "".join(self.random.choice(string.ascii_lowercase) for _ in range(length))
+
+    def sentence(self, min_words: int = 6, max_words: int = 20) -> str:
+        words = self.random.choices(self.vocabulary, self.weights,
+                                    k=self.random.randint(min_words, max_words))
+        return " ".join(words).capitalize() + "."
+
+    def document(self, num_chars: int) -> str:
+        """Generate roughly `num_chars` characters of paragraph text"""
+        sentences = []
+        size = 0
+        while size < num_chars:
+            sentence = self.sentence()
+            sentences.append(sentence)
+            size += len(sentence) + 1
+            if self.random.random() < 0.15:
+                sentences.append("\n")
+        return " ".join(sentences)
+
+    def query(self, min_words: int = 2, max_words: int = 5) -> str:
+        return " ".join(self.random.choices(self.vocabulary, self.weights,
+                                            k=self.random.randint(min_words, max_words)))
+
+
+def setup_environment(work_dir: Optional[str] = None) -> str:
+    """Point the app at a throwaway SQLite database before it is imported"""
+    work_dir = work_dir or tempfile.mkdtemp(prefix="askscribe-bench-")
+    os.makedirs(work_dir, exist_ok=True)
+    os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(work_dir, "bench.db")
+    # Answers come from the deterministic local generator unless the caller chose otherwise
+    os.environ.setdefault("LLM_BACKEND", "local")
+    return work_dir
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of a list of values"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, math.ceil(pct / 100.0 * len(ordered)) - 1)
+    return ordered[rank]
+
+
+def latency_summary(samples: List[float]) -> Dict[str, float]:
+    """Summarize latency samples given in seconds as milliseconds"""
+    return {
+        'count': len(samples),
+        'mean_ms': 1000.0 * sum(samples) / len(samples) if samples else 0.0,
+        'p50_ms': 1000.0 * percentile(samples, 50),
+        'p99_ms': 1000.0 * percentile(samples, 99),
+        'max_ms': 1000.0 * max(samples) if samples else 0.0,
+    }
+
+
+def emit_results(results: Dict[str, Any], output: Optional[str] = None):
+    """Write benchmark results as JSON to a file or stdout"""
+    payload = json.dumps(results, indent=2, sort_keys=True)
+    if output:
+        with open(output, 'w') as f:
+            f.write(payload + "\n")
+    else:
+        print(payload)
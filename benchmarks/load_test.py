@@ -0,0 +1,222 @@
+"""Concurrency load test: threaded WSGI serving vs the ASGI server, over HTTP with a slow fake LLM
+
+Usage:
+    python -m benchmarks.load_test --concurrency 50 200 --requests 400 --llm-latency-ms 500 --threads 8
+
+Prepares a scratch database and index, then starts each server as a
+subprocess on it:
+
+- `wsgi`: the Flask app on a WSGI server with a fixed pool of `--threads`
+  worker threads, like a gunicorn gthread worker;
+- `asgi`: `asgi:application` on uvicorn, one process.
+
+The local generator stands in for Gemini and waits `--llm-latency-ms` before
+answering (LOCAL_LLM_LATENCY_MS). An httpx client logs in and keeps
+`concurrency` questions in flight against `/ask` on each server, reporting
+throughput and latency. With the thread pool, throughput is capped near
+threads / latency however many questions are waiting; the ASGI server should
+keep scaling with concurrency.
+"""
+import os
+import sys
+import time
+import asyncio
+import logging
+import argparse
+import subprocess
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List
+
+from benchmarks.common import ROOT_DIR, SyntheticCorpus, setup_environment, latency_summary, emit_results
+
+USERNAME = "loadtest"
+PASSWORD = "loadtest-password"
+
+
+def prepare(args, work_dir: str) -> List[str]:
+    """Create the user and documents in the scratch database; returns the questions to ask"""
+    from app import app, db, init_db
+    from models import User, Document
+    from rag_engine import RAGEngine
+    from generators import LocalGenerator
+    from document_processor import DocumentProcessor
+
+    logging.getLogger().setLevel(logging.WARNING)
+    init_db()
+    corpus = SyntheticCorpus(vocab_size=args.vocab_size, seed=args.seed)
+    processor = DocumentProcessor()
+
+    with app.app_context():
+        user = User(username=USERNAME, email="loadtest@example.com")
+        user.set_password(PASSWORD)
+        db.session.add(user)
+        db.session.commit()
+
+        # The servers run in work_dir and load vector_store/simple_index.json from there
+        engine = RAGEngine(index_file=os.path.join(work_dir, "vector_store", "simple_index.json"),
+                           generator=LocalGenerator())
+        pending = []
+        for i in range(args.documents):
+            text = corpus.document(args.chunks_per_doc * 800)
+            document = Document(filename=f"load_{i}.txt", original_filename=f"load_{i}.txt",
+                                file_path=os.path.join(work_dir, f"load_{i}.txt"), file_type='txt',
+                                file_size=len(text), processed=True, user_id=user.id)
+            db.session.add(document)
+            db.session.flush()
+            pending.append((document.id, processor.create_chunks(text)))
+        db.session.commit()
+        for _ in engine.add_documents(pending, user.id):
+            pass
+
+    return [corpus.query() for _ in range(args.requests)]
+
+
+def serve_wsgi(port: int, threads: int):
+    """Run the Flask app on werkzeug with a fixed worker pool, in the foreground"""
+    from werkzeug.serving import ThreadedWSGIServer
+    from app import app
+    import routes  # noqa: F401
+
+    logging.getLogger().setLevel(logging.WARNING)
+
+    class PooledWSGIServer(ThreadedWSGIServer):
+        """Werkzeug's threaded server limited to `threads` request threads"""
+        pool = ThreadPoolExecutor(max_workers=threads)
+
+        def process_request(self, request, client_address):
+            self.pool.submit(self.process_request_thread, request, client_address)
+
+    PooledWSGIServer('127.0.0.1', port, app).serve_forever()
+
+
+def start_server(mode: str, port: int, args, work_dir: str) -> subprocess.Popen:
+    env = dict(os.environ)
+    env.update({
+        'PYTHONPATH': ROOT_DIR,
+        'LLM_BACKEND': 'local',
+        'LOCAL_LLM_LATENCY_MS': str(args.llm_latency_ms),
+        'SESSION_SECRET': 'load-test-secret',
+    })
+    if mode == 'wsgi':
+        command = [sys.executable, '-m', 'benchmarks.load_test', '--serve-wsgi', str(port),
+                   '--threads', str(args.threads)]
+    else:
+        # A saturated server may not read a pooled connection's next request within the
+        # default 5s keep-alive, and would close it under the client
+        command = [sys.executable, '-m', 'uvicorn', 'asgi:application', '--port', str(port),
+                   '--timeout-keep-alive', '60', '--log-level', 'warning', '--no-access-log']
+    return subprocess.Popen(command, cwd=work_dir, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+async def wait_ready(client, timeout: float = 60.0):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            if (await client.get('/login')).status_code == 200:
+                return
+        except Exception:
+            pass
+        if time.monotonic() > deadline:
+            raise RuntimeError("Server did not start")
+        await asyncio.sleep(0.2)
+
+
+async def drive(base_url: str, questions: List[str], concurrency: int) -> Dict[str, Any]:
+    import httpx
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, timeout=600.0, limits=limits) as client:
+        await wait_ready(client)
+        await client.post('/login', data={'username': USERNAME, 'password': PASSWORD})
+        # One untimed question so lazy imports and caches don't land in the samples
+        await client.post('/ask', json={'question': questions[0]})
+
+        samples: List[float] = []
+        errors: Counter = Counter()
+        queue = iter(questions)
+
+        async def worker():
+            for question in queue:
+                start = time.perf_counter()
+                try:
+                    response = await client.post('/ask', json={'question': question})
+                except Exception as e:
+                    errors[type(e).__name__] += 1
+                    continue
+                if response.status_code != 200:
+                    errors[f"HTTP {response.status_code}"] += 1
+                    continue
+                samples.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+
+    return {
+        'requests': len(samples),
+        'errors': sum(errors.values()),
+        'error_kinds': dict(errors),
+        'seconds': elapsed,
+        'requests_per_second': len(samples) / elapsed if elapsed else 0.0,
+        'latency': latency_summary(samples),
+    }
+
+
+def run(args) -> Dict[str, Any]:
+    work_dir = setup_environment(args.work_dir)
+    questions = prepare(args, work_dir)
+
+    results: Dict[str, Any] = {
+        'parameters': {
+            'requests': args.requests,
+            'concurrency': args.concurrency,
+            'threads': args.threads,
+            'llm_latency_ms': args.llm_latency_ms,
+            'documents': args.documents,
+            'chunks_per_doc': args.chunks_per_doc,
+            'seed': args.seed,
+        },
+    }
+    for offset, mode in enumerate(('wsgi', 'asgi')):
+        port = args.port + offset
+        server = start_server(mode, port, args, work_dir)
+        try:
+            results[mode] = {
+                str(concurrency): asyncio.run(drive(f"http://127.0.0.1:{port}", questions, concurrency))
+                for concurrency in args.concurrency
+            }
+        finally:
+            server.terminate()
+            server.wait()
+
+    # The most one server thread pool can do when every question waits on the LLM
+    results['wsgi_ceiling_rps'] = args.threads / (args.llm_latency_ms / 1000.0) if args.llm_latency_ms else None
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare threaded WSGI and ASGI serving under concurrent questions")
+    parser.add_argument('--requests', type=int, default=400, help="questions per concurrency level")
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[50, 200], help="questions in flight")
+    parser.add_argument('--threads', type=int, default=8, help="request threads of the WSGI server")
+    parser.add_argument('--llm-latency-ms', type=float, default=500.0, help="simulated LLM response time")
+    parser.add_argument('--documents', type=int, default=10)
+    parser.add_argument('--chunks-per-doc', type=int, default=20)
+    parser.add_argument('--vocab-size', type=int, default=5000)
+    parser.add_argument('--port', type=int, default=5810, help="first of two local ports")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--work-dir', help="directory for the scratch database, index and servers")
+    parser.add_argument('--output', help="write JSON results here instead of stdout")
+    parser.add_argument('--serve-wsgi', type=int, metavar='PORT', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve_wsgi:
+        serve_wsgi(args.serve_wsgi, args.threads)
+        return
+    emit_results(run(args), args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,246 @@
+"""Ingestion and retrieval benchmarks
+
+Usage:
+    python -m benchmarks.run_benchmarks --documents 20 --chunks-per-doc 50 --output bench.json
+
+Covers chunking, `add_document` with prepared chunks, uploads streamed from
+text files through extraction and `split_stream`, index save/load, search
+and whole answers (blocking and streamed) from the local generator.
+
+Everything runs offline against a temporary SQLite database and the local
+answer generator, so numbers only reflect AskScribe's own code paths.
+"""
+import os
+import time
+import logging
+import argparse
+import platform
+import tracemalloc
+from datetime import datetime, timezone
+from typing import Dict, Any, List
+
+from benchmarks.common import SyntheticCorpus, setup_environment, latency_summary, emit_results
+
+
+def bench_chunking(processor, texts: List[str]) -> Dict[str, Any]:
+    total_chars = sum(len(text) for text in texts)
+    start = time.perf_counter()
+    chunk_sets = [processor.create_chunks(text) for text in texts]
+    elapsed = time.perf_counter() - start
+    total_chunks = sum(len(chunks) for chunks in chunk_sets)
+    return {
+        'documents': len(texts),
+        'chunks': total_chunks,
+        'seconds': elapsed,
+        'chars_per_second': total_chars / elapsed if elapsed else 0.0,
+        'chunks_per_second': total_chunks / elapsed if elapsed else 0.0,
+    }, chunk_sets
+
+
+def bench_add_document(engine, user_id: int, document_ids: List[int], chunk_sets: List[List[str]]) -> Dict[str, Any]:
+    samples = []
+    tracemalloc.start()
+    for document_id, chunks in zip(document_ids, chunk_sets):
+        start = time.perf_counter()
+        engine.add_document(document_id, chunks, user_id=user_id)
+        samples.append(time.perf_counter() - start)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    summary = latency_summary(samples)
+    summary['total_seconds'] = sum(samples)
+    summary['peak_memory_mb'] = peak / (1024 * 1024)
+    return summary
+
+
+def bench_streaming_ingest(engine, processor, user_id: int, document_ids: List[int],
+                           paths: List[str]) -> Dict[str, Any]:
+    """Uploads as the app runs them: text files streamed through extraction, `split_stream` and batched embedding"""
+    samples = []
+    total_chars = sum(os.path.getsize(path) for path in paths)
+    chunks = 0
+    tracemalloc.start()
+    for document_id, path in zip(document_ids, paths):
+        start = time.perf_counter()
+        chunks += engine.add_document(document_id, processor.iter_chunks(path, 'txt'), user_id=user_id)
+        samples.append(time.perf_counter() - start)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    summary = latency_summary(samples)
+    elapsed = sum(samples)
+    summary['total_seconds'] = elapsed
+    summary['chunks'] = chunks
+    summary['chars_per_second'] = total_chars / elapsed if elapsed else 0.0
+    summary['peak_memory_mb'] = peak / (1024 * 1024)
+    return summary
+
+
+def bench_index_io(engine, rag_engine_module, repeat: int) -> Dict[str, Any]:
+    save_samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        engine._save_index()
+        save_samples.append(time.perf_counter() - start)
+
+    load_samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        # Engines read their index on first use; load it explicitly to time it
+        rag_engine_module.RAGEngine(index_file=engine.index_file).load_index()
+        load_samples.append(time.perf_counter() - start)
+
+    return {
+        'index_bytes': os.path.getsize(engine.index_file),
+        'save': latency_summary(save_samples),
+        'load': latency_summary(load_samples),
+    }
+
+
+def bench_search(engine, user_id: int, queries: List[str], k: int) -> Dict[str, Any]:
+    # Warm up once so the first sample doesn't pay for lazy imports
+    engine.search_similar_chunks(queries[0], user_id, k=k)
+
+    samples = []
+    tracemalloc.start()
+    for query in queries:
+        start = time.perf_counter()
+        engine.search_similar_chunks(query, user_id, k=k)
+        samples.append(time.perf_counter() - start)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    summary = latency_summary(samples)
+    summary['k'] = k
+    summary['peak_memory_mb'] = peak / (1024 * 1024)
+    return summary
+
+
+def bench_answer(engine, user_id: int, queries: List[str]) -> Dict[str, Any]:
+    """Whole questions through retrieval, prompt building and the local generator, blocking and streamed"""
+    engine.answer_question(queries[0], user_id)
+
+    samples = []
+    for query in queries:
+        start = time.perf_counter()
+        engine.answer_question(query, user_id)
+        samples.append(time.perf_counter() - start)
+
+    first_event = []
+    stream_samples = []
+    for query in queries:
+        start = time.perf_counter()
+        for i, _ in enumerate(engine.stream_answer(query, user_id)):
+            if i == 0:
+                first_event.append(time.perf_counter() - start)
+        stream_samples.append(time.perf_counter() - start)
+
+    return {
+        'answer_question': latency_summary(samples),
+        'stream_answer': latency_summary(stream_samples),
+        'stream_first_event': latency_summary(first_event),
+    }
+
+
+def run(args) -> Dict[str, Any]:
+    work_dir = setup_environment(args.work_dir)
+
+    # The app has to be imported after the environment points it at the scratch database
+    from app import app, db, init_db
+    import rag_engine
+    from models import User, Document
+    from document_processor import DocumentProcessor
+    from generators import LocalGenerator
+
+    logging.getLogger().setLevel(logging.WARNING)
+    init_db()
+
+    corpus = SyntheticCorpus(vocab_size=args.vocab_size, seed=args.seed)
+    # Chunks are ~1000 chars with 200 chars of overlap, so each one adds ~800 new chars
+    texts = [corpus.document(args.chunks_per_doc * 800) for _ in range(args.documents)]
+    queries = [corpus.query() for _ in range(args.queries)]
+
+    processor = DocumentProcessor()
+    results: Dict[str, Any] = {
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'parameters': {
+            'documents': args.documents,
+            'chunks_per_doc': args.chunks_per_doc,
+            'vocab_size': args.vocab_size,
+            'queries': args.queries,
+            'seed': args.seed,
+        },
+    }
+
+    results['create_chunks'], chunk_sets = bench_chunking(processor, texts)
+
+    with app.app_context():
+        user = User(username=f"bench-{int(time.time() * 1000)}", email=f"bench-{time.time()}@example.com")
+        user.set_password("benchmark")
+        db.session.add(user)
+        db.session.commit()
+
+        document_ids = []
+        for i, chunks in enumerate(chunk_sets):
+            document = Document(
+                filename=f"bench_{i}.txt",
+                original_filename=f"bench_{i}.txt",
+                file_path=os.path.join(work_dir, f"bench_{i}.txt"),
+                file_type='txt',
+                file_size=len(texts[i]),
+                chunk_count=len(chunks),
+                processed=True,
+                user_id=user.id
+            )
+            db.session.add(document)
+            db.session.flush()
+            document_ids.append(document.id)
+        db.session.commit()
+
+        engine = rag_engine.RAGEngine(index_file=os.path.join(work_dir, "bench_index.json"),
+                                      generator=LocalGenerator())
+
+        results['add_document'] = bench_add_document(engine, user.id, document_ids, chunk_sets)
+        results['index_io'] = bench_index_io(engine, rag_engine, args.io_repeat)
+        results['search_similar_chunks'] = bench_search(engine, user.id, queries, args.k)
+        results['answer'] = bench_answer(engine, user.id, queries)
+
+        # The same texts again as files, uploaded through the streaming path into a separate index
+        paths = []
+        stream_ids = []
+        for i, text in enumerate(texts):
+            path = os.path.join(work_dir, f"bench_stream_{i}.txt")
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(text)
+            document = Document(filename=os.path.basename(path), original_filename=os.path.basename(path),
+                                file_path=path, file_type='txt', file_size=len(text),
+                                processed=True, user_id=user.id)
+            db.session.add(document)
+            db.session.flush()
+            paths.append(path)
+            stream_ids.append(document.id)
+        db.session.commit()
+        stream_engine = rag_engine.RAGEngine(index_file=os.path.join(work_dir, "bench_stream_index.json"),
+                                             generator=LocalGenerator())
+        results['streaming_ingest'] = bench_streaming_ingest(stream_engine, processor, user.id, stream_ids, paths)
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark AskScribe ingestion and retrieval offline")
+    parser.add_argument('--documents', type=int, default=20, help="number of synthetic documents")
+    parser.add_argument('--chunks-per-doc', type=int, default=50, help="approximate chunks per document")
+    parser.add_argument('--vocab-size', type=int, default=5000, help="size of the synthetic vocabulary")
+    parser.add_argument('--queries', type=int, default=200, help="number of search queries to time")
+    parser.add_argument('--k', type=int, default=5, help="results per search")
+    parser.add_argument('--io-repeat', type=int, default=3, help="repetitions of index save/load")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--work-dir', help="directory for the scratch database and index")
+    parser.add_argument('--output', help="write JSON results here instead of stdout")
+    args = parser.parse_args()
+
+    emit_results(run(args), args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+import heapq
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Any
+from utils import tokenize, STOPWORDS
+
+
+class ConversationState:
+    """Decayed keyword weights summarising the recent turns of one chat session.
+
+    Every turn halves the existing weights and adds the new question's terms,
+    so an update costs one turn of work however long the conversation is.
+    Answers are left out: their wording comes from the answer template and the
+    model (headings, "answer", "documents", ...) rather than from the user.
+    Terms older than `turns` turns fade out and at most `token_budget` terms
+    are kept.
+    """
+
+    def __init__(self, turns: int = 6, token_budget: int = 32, context_terms: int = 8, decay: float = 0.5):
+        self.turns = turns
+        self.token_budget = token_budget
+        self.context_terms = context_terms
+        self.decay = decay
+        self.terms: Dict[str, float] = {}
+
+    def add_turn(self, question: str):
+        """Fold one question into the state"""
+        min_weight = self.decay ** self.turns
+        terms = {term: weight * self.decay for term, weight in self.terms.items()
+                 if weight * self.decay >= min_weight}
+        self._add_terms(terms, question, 1.0)
+
+        if len(terms) > self.token_budget:
+            terms = dict(heapq.nlargest(self.token_budget, terms.items(), key=lambda item: item[1]))
+        # Swap in a new dict so concurrent readers never see a half-updated state
+        self.terms = terms
+
+    def _add_terms(self, terms: Dict[str, float], text: str, weight: float):
+        tokens = [token for token in tokenize(text) if token not in STOPWORDS]
+        for token in tokens:
+            terms[token] = terms.get(token, 0.0) + weight / len(tokens)
+
+    def condense(self, question: str) -> str:
+        """Standalone retrieval query: the question plus the strongest terms from earlier turns.
+
+        The result never exceeds `token_budget` tokens, and the question's own
+        terms always come first.
+        """
+        question_tokens = tokenize(question)
+        room = min(self.context_terms, self.token_budget - len(question_tokens))
+        if room <= 0 or not self.terms:
+            return question
+
+        present = set(question_tokens)
+        ranked = sorted(self.terms.items(), key=lambda item: item[1], reverse=True)
+        context = [term for term, _ in ranked if term not in present][:room]
+        if not context:
+            return question
+        return f"{question} {' '.join(context)}"
+
+
+class ConversationCache:
+    """Thread-safe LRU of conversation states keyed by chat session id.
+
+    Each entry remembers the session version (its `updated_at`) it was built
+    for, so a turn handled elsewhere invalidates it instead of being missed.
+    """
+
+    def __init__(self, max_sessions: int = 1024):
+        self.max_sessions = max_sessions
+        self._entries: 'OrderedDict[int, tuple]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, session_id: int, version: Any) -> Optional[ConversationState]:
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is None or entry[0] != version:
+                return None
+            self._entries.move_to_end(session_id)
+            return entry[1]
+
+    def put(self, session_id: int, version: Any, state: ConversationState):
+        with self._lock:
+            self._entries[session_id] = (version, state)
+            self._entries.move_to_end(session_id)
+            while len(self._entries) > self.max_sessions:
+                self._entries.popitem(last=False)
+
+    def discard(self, session_id: int):
+        with self._lock:
+            self._entries.pop(session_id, None)
+
+
+def build_state(messages: List[Any], turns: int = 6, token_budget: int = 32) -> ConversationState:
+    """Rebuild a session's state from its recent ChatMessages, oldest first; only questions are used"""
+    state = ConversationState(turns=turns, token_budget=token_budget)
+    for message in messages:
+        if message.message_type == 'user':
+            state.add_turn(message.content)
+    return state
@@ -1,11 +1,23 @@
 import os
+import codecs
 import logging
-from typing import List, Optional
-import fitz  # PyMuPDF
-from docx import Document as DocxDocument
-import pytesseract
-from PIL import Image
-import io
+import zipfile
+from typing import List, Optional, Iterable, Iterator
+from metrics import span, UPLOAD_STAGES, PDF_PAGES
+from page_classifier import PageClassifier
+
+# WordprocessingML element names used by the streaming DOCX extractor
+_W = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+_DOCX_PARAGRAPH = _W + 'p'
+_DOCX_TEXT = _W + 't'
+_DOCX_ROW = _W + 'tr'
+_DOCX_CELL = _W + 'tc'
+_DOCX_BODY = _W + 'body'
+_DOCX_TABLE = _W + 'tbl'
+_DOCX_SPECIAL_TEXT = {_W + 'tab': '\t', _W + 'ptab': '\t', _W + 'br': '\n', _W + 'cr': '\n',
+                      _W + 'noBreakHyphen': '-'}
+# Alternate renderings (e.g. VML copies of text boxes) would repeat their text
+_MC_FALLBACK = '{http://schemas.openxmlformats.org/markup-compatibility/2006}Fallback'
 
 # Simple text splitter implementation
 class SimpleTextSplitter:
@@ -22,16 +34,8 @@ class SimpleTextSplitter:
         start = 0
         
         while start < len(text):
-            end = start + self.chunk_size
-            
             # Try to break at sentence boundary
-            if end < len(text):
-                last_period = text[:end].rfind('.')
-                last_newline = text[:end].rfind('\n')
-                
-                break_point = max(last_period, last_newline)
-                if break_point > start + self.chunk_size // 2:
-                    end = break_point + 1
+            end = self._chunk_end(text, start)
             
             chunk = text[start:end].strip()
             if len(chunk) > 50:  # Only include meaningful chunks
@@ -42,123 +46,306 @@ class SimpleTextSplitter:
                 break
         
         return chunks
+    
+    def split_stream(self, segments: Iterable[str]) -> Iterator[str]:
+        """Split a stream of text segments into the same chunks as split_text.
+
+        Segments are joined with single spaces. Only the unchunked tail is
+        buffered, so memory stays around a few chunk sizes whatever the input length.
+        """
+        parts = []
+        size = 0
+        buffer = ""
+        for segment in segments:
+            parts.append(segment)
+            size += len(segment) + 1
+            if size < 2 * self.chunk_size:
+                continue
+            
+            buffer = " ".join([buffer] + parts) if buffer else " ".join(parts)
+            parts = []
+            
+            # A chunk is final once the text after its end is known
+            start = 0
+            while len(buffer) - start > self.chunk_size:
+                end = self._chunk_end(buffer, start)
+                chunk = buffer[start:end].strip()
+                if len(chunk) > 50:
+                    yield chunk
+                start = end - self.chunk_overlap
+            buffer = buffer[start:]
+            size = len(buffer)
+        
+        if parts:
+            buffer = " ".join([buffer] + parts) if buffer else " ".join(parts)
+        yield from self.split_text(buffer)
+    
+    def _chunk_end(self, text: str, start: int) -> int:
+        """End of the chunk starting at start, pulled back to a sentence boundary when possible"""
+        end = start + self.chunk_size
+        if end < len(text):
+            last_period = text[:end].rfind('.')
+            last_newline = text[:end].rfind('\n')
+            
+            break_point = max(last_period, last_newline)
+            if break_point > start + self.chunk_size // 2:
+                end = break_point + 1
+        return end
 
 class DocumentProcessor:
     """Handles document text extraction and chunking"""
     
-    def __init__(self):
+    def __init__(self, preview_chars: int = 10000):
         self.text_splitter = SimpleTextSplitter(
             chunk_size=1000,
             chunk_overlap=200
         )
+        self.preview_chars = preview_chars
+        self.page_classifier = PageClassifier()
     
     def extract_text(self, file_path: str, file_type: str) -> str:
         """Extract text from document based on file type"""
+        text = "\n".join(self.iter_text(file_path, file_type))
+        if file_type == 'txt':
+            return text
+        return text.strip()
+    
+    def iter_text(self, file_path: str, file_type: str) -> Iterator[str]:
+        """Yield a document's text a page (PDF), paragraph (DOCX) or line (TXT) at a time"""
+        if file_type == 'pdf':
+            segments = self._extract_from_pdf(file_path)
+        elif file_type == 'docx':
+            segments = self._extract_from_docx(file_path)
+        elif file_type == 'txt':
+            segments = self._extract_from_txt(file_path)
+        else:
+            logging.error(f"Text extraction failed for {file_path}: unsupported file type {file_type}")
+            raise ValueError(f"Unsupported file type: {file_type}")
+        
         try:
-            if file_type == 'pdf':
-                return self._extract_from_pdf(file_path)
-            elif file_type == 'docx':
-                return self._extract_from_docx(file_path)
-            elif file_type == 'txt':
-                return self._extract_from_txt(file_path)
-            else:
-                raise ValueError(f"Unsupported file type: {file_type}")
+            while True:
+                with span(UPLOAD_STAGES, 'extract'):
+                    segment = next(segments, None)
+                if segment is None:
+                    return
+                yield segment
         except Exception as e:
             logging.error(f"Text extraction failed for {file_path}: {e}")
             raise
     
-    def _extract_from_pdf(self, file_path: str) -> str:
-        """Extract text from PDF with OCR fallback for scanned documents"""
+    def iter_chunks(self, file_path: str, file_type: str, preview: Optional[List[str]] = None) -> Iterator[str]:
+        """Stream a document straight from its extractor into chunks.
+
+        The full text is never assembled. If a preview list is given, the first
+        preview_chars characters of the extracted text are appended to it.
+        """
+        segments = self.iter_text(file_path, file_type)
+        if preview is not None:
+            segments = self._capture_preview(segments, preview)
+        
+        count = 0
+        for chunk in self.text_splitter.split_stream(self._preprocess_segments(segments)):
+            count += 1
+            yield chunk
+        logging.info(f"Created {count} chunks from {file_path}")
+    
+    def _capture_preview(self, segments: Iterable[str], preview: List[str]) -> Iterator[str]:
+        remaining = self.preview_chars
+        for segment in segments:
+            if remaining > 0:
+                text = (f"\n{segment}" if preview else segment)[:remaining]
+                preview.append(text)
+                remaining -= len(text)
+            yield segment
+    
+    def _extract_from_pdf(self, file_path: str) -> Iterator[str]:
+        """Extract text from PDF, one page at a time, OCRing only the pages the classifier selects"""
+        # Extractor libraries are imported on first use so that workers which never
+        # process an upload don't pay for them at boot
+        import fitz  # PyMuPDF
+        
         try:
             # Open PDF with PyMuPDF
             doc = fitz.open(file_path)
-            text = ""
+        except Exception as e:
+            logging.error(f"PDF extraction failed: {e}")
+            raise ValueError(f"Failed to extract text from PDF: {str(e)}")
+        
+        try:
+            found_text = False
             
             for page_num in range(len(doc)):
                 page = doc[page_num]
                 
-                # First try to extract text directly
-                page_text = page.get_text()
+                # Blank and separator pages are skipped; scans and garbled text layers are OCR'd
+                decision = self.page_classifier.classify(page)
+                PDF_PAGES.inc(decision['mode'])
+                if decision['mode'] == 'skip':
+                    continue
                 
-                # If very little text found, use OCR
-                if len(page_text.strip()) < 50:
-                    logging.info(f"Page {page_num + 1} has minimal text, using OCR")
-                    
-                    # Get page as image
-                    pix = page.get_pixmap()
-                    img_data = pix.tobytes("png")
-                    
-                    # Convert to PIL Image
-                    image = Image.open(io.BytesIO(img_data))
-                    
-                    # Use OCR to extract text
-                    ocr_text = pytesseract.image_to_string(image)
-                    text += f"\n--- Page {page_num + 1} (OCR) ---\n{ocr_text}\n"
+                if decision['mode'] == 'ocr':
+                    logging.info(f"Page {page_num + 1} needs OCR at {decision['dpi']} dpi")
+                    try:
+                        with span(UPLOAD_STAGES, 'ocr_page'):
+                            ocr_text = self._ocr_page(page, decision['dpi'])
+                        page_text = f"--- Page {page_num + 1} (OCR) ---\n{ocr_text}"
+                    except Exception as e:
+                        if not decision['chars']:
+                            raise
+                        logging.warning(f"OCR failed on page {page_num + 1}, keeping its text layer: {e}")
+                        page_text = f"--- Page {page_num + 1} ---\n{decision['text']}"
                 else:
-                    text += f"\n--- Page {page_num + 1} ---\n{page_text}\n"
-            
-            doc.close()
+                    page_text = f"--- Page {page_num + 1} ---\n{decision['text']}"
+                
+                found_text = True
+                yield page_text
             
-            if not text.strip():
+            if not found_text:
                 raise ValueError("No text could be extracted from PDF")
             
-            return text.strip()
-            
         except Exception as e:
             logging.error(f"PDF extraction failed: {e}")
             raise ValueError(f"Failed to extract text from PDF: {str(e)}")
+        finally:
+            doc.close()
+    
+    def _ocr_page(self, page, dpi: int) -> str:
+        """Render a page in grayscale at the given resolution and OCR it"""
+        import fitz
+        import pytesseract
+        from PIL import Image
+        
+        pix = page.get_pixmap(dpi=dpi, colorspace=fitz.csGRAY)
+        image = Image.frombytes("L", (pix.width, pix.height), pix.samples)
+        return pytesseract.image_to_string(image)
     
-    def _extract_from_docx(self, file_path: str) -> str:
-        """Extract text from DOCX file"""
+    def _extract_from_docx(self, file_path: str) -> Iterator[str]:
+        """Extract text from DOCX file, one paragraph or table row at a time, in document order"""
         try:
-            doc = DocxDocument(file_path)
-            text = ""
-            
-            for paragraph in doc.paragraphs:
-                if paragraph.text.strip():
-                    text += paragraph.text + "\n"
+            found_text = False
+            for segment in self._iter_docx_body(file_path):
+                found_text = True
+                yield segment
             
-            # Extract text from tables
-            for table in doc.tables:
-                for row in table.rows:
-                    for cell in row.cells:
-                        if cell.text.strip():
-                            text += cell.text + " "
-                    text += "\n"
-            
-            if not text.strip():
+            if not found_text:
                 raise ValueError("No text could be extracted from DOCX")
             
-            return text.strip()
-            
         except Exception as e:
             logging.error(f"DOCX extraction failed: {e}")
             raise ValueError(f"Failed to extract text from DOCX: {str(e)}")
     
-    def _extract_from_txt(self, file_path: str) -> str:
-        """Extract text from TXT file"""
+    def _iter_docx_body(self, file_path: str) -> Iterator[str]:
+        """Stream word/document.xml once, yielding non-empty paragraphs and table rows.
+
+        A row's cells are joined with spaces; a cell spanning several columns is
+        read once, and cells continuing a vertical merge are skipped, so merged
+        text is never repeated. Rows of nested tables come out as rows of their own.
+        """
+        from lxml import etree
+        
+        with zipfile.ZipFile(file_path) as archive, archive.open('word/document.xml') as xml:
+            paragraphs = []  # text pieces of each open paragraph (text boxes nest them)
+            cells = []  # paragraph texts of each open table cell
+            rows = []  # cell texts of each open table row
+            skipped = 0
+            
+            for event, element in etree.iterparse(xml, events=('start', 'end'), huge_tree=True):
+                tag = element.tag
+                if tag == _MC_FALLBACK:
+                    skipped += 1 if event == 'start' else -1
+                    continue
+                if skipped:
+                    continue
+                
+                if event == 'start':
+                    if tag == _DOCX_PARAGRAPH:
+                        paragraphs.append([])
+                    elif tag == _DOCX_CELL:
+                        cells.append([])
+                    elif tag == _DOCX_ROW:
+                        rows.append([])
+                    continue
+                
+                if tag == _DOCX_TEXT:
+                    if paragraphs:
+                        paragraphs[-1].append(element.text or "")
+                elif tag in _DOCX_SPECIAL_TEXT:
+                    if paragraphs:
+                        paragraphs[-1].append(_DOCX_SPECIAL_TEXT[tag])
+                elif tag == _DOCX_PARAGRAPH:
+                    text = "".join(paragraphs.pop())
+                    if cells:
+                        cells[-1].append(text)
+                    elif text.strip():
+                        yield text
+                elif tag == _DOCX_CELL:
+                    text = "\n".join(cells.pop())
+                    if rows and text.strip() and not self._continues_merge(element):
+                        rows[-1].append(text)
+                elif tag == _DOCX_ROW:
+                    row = rows.pop()
+                    if row:
+                        yield " ".join(row)
+                else:
+                    continue
+                
+                # Everything below a finished paragraph, cell or row has been read
+                element.clear()
+                parent = element.getparent()
+                if parent is not None and parent.tag == _DOCX_BODY:
+                    while element.getprevious() is not None:
+                        del parent[0]
+                elif tag == _DOCX_ROW and parent is not None and parent.tag == _DOCX_TABLE:
+                    while element.getprevious() is not None:
+                        del parent[0]
+    
+    def _continues_merge(self, cell) -> bool:
+        """Whether a table cell continues a merge started in the cell above (or, legacy, to the left)"""
+        properties = cell.find(_W + 'tcPr')
+        if properties is None:
+            return False
+        for merge_tag in ('vMerge', 'hMerge'):
+            merge = properties.find(_W + merge_tag)
+            if merge is not None and merge.get(_W + 'val', 'continue') == 'continue':
+                return True
+        return False
+    
+    def _extract_from_txt(self, file_path: str) -> Iterator[str]:
+        """Extract text from TXT file line by line"""
         try:
-            with open(file_path, 'r', encoding='utf-8') as file:
-                return file.read()
-        except UnicodeDecodeError:
-            # Try with different encoding
-            with open(file_path, 'r', encoding='latin-1') as file:
-                return file.read()
+            encoding = self._detect_encoding(file_path)
+            with open(file_path, 'r', encoding=encoding) as file:
+                for line in file:
+                    yield line.rstrip('\n')
         except Exception as e:
             logging.error(f"TXT processing error: {e}")
             raise
     
+    def _detect_encoding(self, file_path: str, block_size: int = 1 << 16) -> str:
+        """UTF-8 if the whole file decodes as UTF-8, otherwise latin-1, checked without loading the file"""
+        decoder = codecs.getincrementaldecoder('utf-8')()
+        try:
+            with open(file_path, 'rb') as file:
+                for block in iter(lambda: file.read(block_size), b''):
+                    decoder.decode(block)
+                decoder.decode(b'', final=True)
+            return 'utf-8'
+        except UnicodeDecodeError:
+            # Try with different encoding
+            return 'latin-1'
+    
     def create_chunks(self, text: str) -> List[str]:
         """Split text into chunks for embedding"""
         try:
-            # Clean and preprocess text
-            text = self._preprocess_text(text)
-            
-            # Split into chunks
-            chunks = self.text_splitter.split_text(text)
-            
-            # Filter out very short chunks
-            chunks = [chunk for chunk in chunks if len(chunk.strip()) > 50]
+            with span(UPLOAD_STAGES, 'chunk'):
+                # Clean and preprocess text
+                text = self._preprocess_text(text)
+                
+                # Split into chunks
+                chunks = self.text_splitter.split_text(text)
+                
+                # Filter out very short chunks
+                chunks = [chunk for chunk in chunks if len(chunk.strip()) > 50]
             
             logging.info(f"Created {len(chunks)} chunks from text")
             return chunks
@@ -177,6 +364,13 @@ class DocumentProcessor:
         
         return text
     
+    def _preprocess_segments(self, segments: Iterable[str]) -> Iterator[str]:
+        """Apply _preprocess_text to each segment, dropping the ones left empty"""
+        for segment in segments:
+            segment = self._preprocess_text(segment)
+            if segment:
+                yield segment
+    
     def get_document_info(self, file_path: str, file_type: str) -> dict:
         """Get basic information about the document"""
         info = {
@@ -186,10 +380,11 @@ class DocumentProcessor:
         }
         
         try:
-            # Extract text to count words and characters
-            text = self.extract_text(file_path, file_type)
-            info['word_count'] = len(text.split())
-            info['char_count'] = len(text)
+            # Stream the text to count words and characters
+            for segment in self.iter_text(file_path, file_type):
+                info['word_count'] += len(segment.split())
+                info['char_count'] += len(segment) + 1
+            info['char_count'] = max(info['char_count'] - 1, 0)
             
         except Exception as e:
             logging.error(f"Document info extraction error: {e}")
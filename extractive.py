@@ -0,0 +1,76 @@
+import re
+import math
+from typing import List, Dict, Any, Optional
+from utils import tokenize, STOPWORDS
+
+# Sentence ends, or line breaks between list items and headings
+_SENTENCE_BREAK = re.compile(r"(?<=[.!?])\s+|\n+")
+
+
+class ExtractiveAnswerer:
+    """Answers lookup questions with sentences copied from the retrieved chunks.
+
+    Each sentence of the top chunks is scored by the share of the question's
+    terms it contains, weighting rare terms more. When the best sentence
+    reaches `threshold` (0..1) it is returned with its source and the LLM is
+    never called; otherwise `extract` returns None.
+    """
+
+    def __init__(self, threshold: float = 0.8, max_chunks: int = 3, max_sentences: int = 2,
+                 max_sentence_chars: int = 400):
+        self.threshold = threshold
+        self.max_chunks = max_chunks
+        self.max_sentences = max_sentences
+        self.max_sentence_chars = max_sentence_chars
+
+    def extract(self, question: str, chunks: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        terms = {term for term in tokenize(question) if term not in STOPWORDS}
+        if not terms:
+            return None
+
+        # (sentence, tokens, chunk), skipping the copies that chunk overlap produces
+        sentences = []
+        seen = set()
+        for chunk in chunks[:self.max_chunks]:
+            for sentence in _SENTENCE_BREAK.split(chunk['content']):
+                sentence = sentence.strip()
+                key = " ".join(sentence.lower().split())
+                if not sentence or len(sentence) > self.max_sentence_chars or key in seen:
+                    continue
+                seen.add(key)
+                sentences.append((sentence, set(tokenize(sentence)), chunk))
+        if not sentences:
+            return None
+
+        # Terms found in fewer sentences say more about where the answer is
+        weights = {}
+        for term in terms:
+            frequency = sum(1 for _, tokens, _ in sentences if term in tokens)
+            weights[term] = math.log(1.0 + len(sentences) / (1.0 + frequency))
+        total = sum(weights.values())
+
+        scored = []
+        for rank, (sentence, tokens, chunk) in enumerate(sentences):
+            # A sentence that only restates the question (e.g. a heading) answers nothing
+            if not any(token not in terms and token not in STOPWORDS for token in tokens):
+                continue
+            confidence = sum(weights[term] for term in terms if term in tokens) / total
+            if confidence >= self.threshold:
+                scored.append((confidence, -rank, sentence, chunk))
+        if not scored:
+            return None
+
+        best = sorted(scored, reverse=True)[:self.max_sentences]
+        return {
+            'answer': self._format(best, terms),
+            'sources': [chunk for _, _, _, chunk in best],
+            'confidence': best[0][0],
+        }
+
+    def _format(self, best: List[tuple], terms: set) -> str:
+        pattern = re.compile(r"\b(" + "|".join(re.escape(term) for term in sorted(terms)) + r")\b", re.IGNORECASE)
+        lines = ["**Answer (extracted from your documents)**", ""]
+        for _, _, sentence, chunk in best:
+            highlighted = pattern.sub(r"**\1**", sentence)
+            lines.append(f"- {highlighted} *({chunk['document_name']})*")
+        return "\n".join(lines)
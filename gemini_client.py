@@ -1,64 +1,235 @@
 import os
+import time
+import asyncio
 import logging
+import threading
+from typing import Dict, Any, Optional, Iterator, AsyncIterator
 from google import genai
 from google.genai import types
+from generators import AnswerGenerator
+from prompts import get_prompt_template
 
-class GeminiClient:
-    """Client for Google Gemini AI integration"""
+class GeminiClient(AnswerGenerator):
+    """Client for Google Gemini AI integration.
+
+    The static system prompt of the selected prompt template is stored once
+    with the provider's context cache when it reaches GEMINI_CACHE_MIN_TOKENS
+    (1024 estimated tokens, Gemini's minimum for explicit caching), and
+    requests then only send the per-question prompt. The shipped v1 and v2
+    system prompts are far smaller; only one extended with standing
+    instructions (PROMPT_INSTRUCTIONS_FILE) qualifies. Otherwise requests send
+    the system prompt inline with a prebuilt config, which keeps the prefix
+    identical for the provider's implicit prefix caching.
+
+    Pass ``client`` to inject a stand-in for ``genai.Client`` in tests.
+    """
+    name = 'gemini'
+    
+    def __init__(self, client=None, model: Optional[str] = None, prompt_version: Optional[str] = None,
+                 instructions_file: Optional[str] = None):
+        if client is None:
+            api_key = os.environ.get("GEMINI_API_KEY")
+            if not api_key:
+                raise ValueError("GEMINI_API_KEY environment variable is required")
+            client = genai.Client(api_key=api_key)
+        
+        self.client = client
+        self.model = model or os.environ.get("GEMINI_MODEL", "gemini-2.5-flash")
+        self.prompt = get_prompt_template(prompt_version, instructions_file)
+        
+        # Built once; only the contents change between questions
+        self.answer_config = types.GenerateContentConfig(
+            system_instruction=self.prompt.system,
+            temperature=0.3,  # Lower temperature for more focused responses
+            max_output_tokens=2048
+        )
+        
+        # Explicit context caching of the system prompt
+        self.cache_enabled = os.environ.get("GEMINI_PROMPT_CACHE", "true").lower() in ("1", "true", "yes")
+        self.cache_min_tokens = int(os.environ.get("GEMINI_CACHE_MIN_TOKENS", "1024"))
+        self.cache_ttl = int(os.environ.get("GEMINI_CACHE_TTL", "3600"))
+        self._cache_name = None
+        self._cache_expires = 0.0
+        self._cache_lock = threading.Lock()
+        
+        self.last_usage: Dict[str, Any] = {}
     
-    def __init__(self):
-        api_key = os.environ.get("GEMINI_API_KEY")
-        if not api_key:
-            raise ValueError("GEMINI_API_KEY environment variable is required")
+    def _cached_config(self) -> Optional[types.GenerateContentConfig]:
+        """Config pointing at the cached system prompt, creating the cache when due"""
+        if not self.cache_enabled or self.prompt.system_tokens < self.cache_min_tokens:
+            return None
         
-        self.client = genai.Client(api_key=api_key)
-        self.model = "gemini-2.5-flash"
+        with self._cache_lock:
+            # Renew a minute early so requests never race the expiry
+            if self._cache_name is None or time.time() > self._cache_expires - 60:
+                try:
+                    cache = self.client.caches.create(
+                        model=self.model,
+                        config=types.CreateCachedContentConfig(
+                            display_name=f"askscribe-system-{self.prompt.version}",
+                            system_instruction=self.prompt.system,
+                            ttl=f"{self.cache_ttl}s"
+                        )
+                    )
+                    self._cache_name = cache.name
+                    self._cache_expires = time.time() + self.cache_ttl
+                    logging.info(f"Cached system prompt {self.prompt.version} as {cache.name}")
+                except Exception as e:
+                    logging.warning(f"Prompt caching unavailable, sending system prompt inline: {e}")
+                    self.cache_enabled = False
+                    return None
+            cache_name = self._cache_name
         
+        return types.GenerateContentConfig(
+            cached_content=cache_name,
+            temperature=self.answer_config.temperature,
+            max_output_tokens=self.answer_config.max_output_tokens
+        )
+    
+    def _drop_cache(self):
+        with self._cache_lock:
+            self._cache_name = None
+    
+    def prompt_stats(self, question: str, context: str) -> Dict[str, Any]:
+        """Locally estimated token cost of answering a question with the current template"""
+        stats = self.prompt.stats(question, context)
+        stats['version'] = self.prompt.version
+        return stats
+    
     def generate_answer(self, question: str, context: str) -> str:
         """Generate structured answer based on question and context"""
         try:
-            # Create structured prompt for better responses
-            system_prompt = """You are AskScribe, an intelligent document analysis assistant. Your task is to provide accurate, structured, and helpful answers based on the provided context from user documents.
-
-RESPONSE GUIDELINES:
-1. **Structure**: Use clear headings, bullet points, and numbered lists
-2. **Keywords**: Highlight important terms using **bold** formatting
-3. **Accuracy**: Only use information from the provided context
-4. **Clarity**: Provide point-wise, well-organized answers
-5. **Source**: Reference the document context when relevant
-
-If the context doesn't contain sufficient information to answer the question, respond with "**Answer not in context**" followed by a brief explanation.
-
-Format your response in a clear, professional manner suitable for document analysis."""
-
-            user_prompt = f"""**Question**: {question}
-
-**Context from Documents**:
-{context}
-
-**Instructions**: Based on the above context, provide a comprehensive, structured answer to the question. Use proper formatting with headings, bullet points, and **bold** keywords where appropriate."""
-
-            response = self.client.models.generate_content(
-                model=self.model,
-                contents=[
-                    types.Content(role="user", parts=[types.Part(text=user_prompt)])
-                ],
-                config=types.GenerateContentConfig(
-                    system_instruction=system_prompt,
-                    temperature=0.3,  # Lower temperature for more focused responses
-                    max_output_tokens=2048
+            contents = self._contents(question, context)
+            
+            config = self._cached_config()
+            if config is not None:
+                try:
+                    response = self.client.models.generate_content(model=self.model, contents=contents, config=config)
+                except Exception as e:
+                    # The cache may have been evicted early; retry once with the prompt inline
+                    logging.warning(f"Cached prompt request failed, retrying inline: {e}")
+                    self._drop_cache()
+                    config = None
+            if config is None:
+                response = self.client.models.generate_content(
+                    model=self.model,
+                    contents=contents,
+                    config=self.answer_config
                 )
-            )
             
-            if response.text:
-                return self._format_response(response.text)
-            else:
-                return "**Error**: Unable to generate response. Please try again."
+            return self._answer_text(question, context, response)
                 
         except Exception as e:
             logging.error(f"Gemini API error: {e}")
             return f"**Error**: Failed to generate response - {str(e)}"
     
+    async def agenerate_answer(self, question: str, context: str) -> str:
+        """`generate_answer` through the async client, so the wait for Gemini holds no thread"""
+        try:
+            contents = self._contents(question, context)
+            # Creating the cache is a rare blocking call; keep it off the event loop
+            config = await asyncio.to_thread(self._cached_config)
+            if config is not None:
+                try:
+                    response = await self.client.aio.models.generate_content(model=self.model, contents=contents,
+                                                                             config=config)
+                except Exception as e:
+                    logging.warning(f"Cached prompt request failed, retrying inline: {e}")
+                    self._drop_cache()
+                    config = None
+            if config is None:
+                response = await self.client.aio.models.generate_content(
+                    model=self.model,
+                    contents=contents,
+                    config=self.answer_config
+                )
+            
+            return self._answer_text(question, context, response)
+        
+        except Exception as e:
+            logging.error(f"Gemini API error: {e}")
+            return f"**Error**: Failed to generate response - {str(e)}"
+    
+    def _answer_text(self, question: str, context: str, response) -> str:
+        self._record_usage(question, context, response)
+        if response.text:
+            return self._format_response(response.text)
+        return "**Error**: Unable to generate response. Please try again."
+    
+    def stream_answer(self, question: str, context: str) -> Iterator[str]:
+        """Yield the answer text as Gemini produces it, without post-formatting"""
+        try:
+            contents = self._contents(question, context)
+            cached_config = self._cached_config()
+            last_chunk = None
+            for config in (cached_config, self.answer_config):
+                if config is None:
+                    continue
+                try:
+                    for chunk in self.client.models.generate_content_stream(model=self.model, contents=contents,
+                                                                            config=config):
+                        last_chunk = chunk
+                        if chunk.text:
+                            yield chunk.text
+                    break
+                except Exception as e:
+                    # Only a cache miss before any text was sent can be retried inline
+                    if config is not cached_config or last_chunk is not None:
+                        raise
+                    logging.warning(f"Cached prompt stream failed, retrying inline: {e}")
+                    self._drop_cache()
+            
+            if last_chunk is not None:
+                self._record_usage(question, context, last_chunk)
+                
+        except Exception as e:
+            logging.error(f"Gemini API error: {e}")
+            yield f"**Error**: Failed to generate response - {str(e)}"
+    
+    async def astream_answer(self, question: str, context: str) -> AsyncIterator[str]:
+        """`stream_answer` through the async client"""
+        try:
+            contents = self._contents(question, context)
+            cached_config = await asyncio.to_thread(self._cached_config)
+            last_chunk = None
+            for config in (cached_config, self.answer_config):
+                if config is None:
+                    continue
+                try:
+                    stream = await self.client.aio.models.generate_content_stream(model=self.model, contents=contents,
+                                                                                  config=config)
+                    async for chunk in stream:
+                        last_chunk = chunk
+                        if chunk.text:
+                            yield chunk.text
+                    break
+                except Exception as e:
+                    if config is not cached_config or last_chunk is not None:
+                        raise
+                    logging.warning(f"Cached prompt stream failed, retrying inline: {e}")
+                    self._drop_cache()
+            
+            if last_chunk is not None:
+                self._record_usage(question, context, last_chunk)
+        
+        except Exception as e:
+            logging.error(f"Gemini API error: {e}")
+            yield f"**Error**: Failed to generate response - {str(e)}"
+    
+    def _contents(self, question: str, context: str) -> list:
+        user_prompt = self.prompt.render(question, context)
+        return [types.Content(role="user", parts=[types.Part(text=user_prompt)])]
+    
+    def _record_usage(self, question: str, context: str, response):
+        """Keep the estimated and, when reported, actual token usage of the last call"""
+        usage = self.prompt_stats(question, context)
+        metadata = getattr(response, 'usage_metadata', None)
+        if metadata is not None:
+            usage['prompt_token_count'] = getattr(metadata, 'prompt_token_count', None)
+            usage['cached_content_token_count'] = getattr(metadata, 'cached_content_token_count', None)
+        self.last_usage = usage
+        logging.debug(f"Gemini prompt usage: {usage}")
+    
     def _format_response(self, text: str) -> str:
         """Post-process and format the response"""
         # Ensure proper spacing and formatting
@@ -0,0 +1,117 @@
+import os
+import re
+import time
+import asyncio
+from collections import Counter
+from typing import Iterator, AsyncIterator, Optional
+from utils import tokenize
+
+# Answer text is streamed in word-sized pieces, each keeping its trailing whitespace
+_TOKEN_PIECES = re.compile(r"\S+\s*")
+_SENTENCES = re.compile(r"[^.!?\n]+[.!?]?")
+
+
+class AnswerGenerator:
+    """Interface for the model that writes answers from retrieved context.
+
+    `generate_answer` returns the finished answer; `stream_answer` yields it in
+    pieces as they are produced. Generators without native streaming yield the
+    whole answer as a single piece.
+
+    `agenerate_answer` and `astream_answer` are the coroutine versions used by
+    the ASGI server. By default they run the blocking call on a worker thread;
+    generators with an async client override them so that waiting on the
+    model holds no thread.
+    """
+    name = 'base'
+
+    def generate_answer(self, question: str, context: str) -> str:
+        raise NotImplementedError
+
+    def stream_answer(self, question: str, context: str) -> Iterator[str]:
+        yield self.generate_answer(question, context)
+
+    async def agenerate_answer(self, question: str, context: str) -> str:
+        return await asyncio.to_thread(self.generate_answer, question, context)
+
+    async def astream_answer(self, question: str, context: str) -> AsyncIterator[str]:
+        yield await self.agenerate_answer(question, context)
+
+    def summarize_document(self, text: str, max_length: int = 500) -> str:
+        raise NotImplementedError
+
+    def extract_keywords(self, text: str, max_keywords: int = 10) -> list:
+        raise NotImplementedError
+
+
+class LocalGenerator(AnswerGenerator):
+    """Deterministic offline stand-in for the LLM.
+
+    Answers with the context sentences that share the most terms with the
+    question, so the same inputs always give the same answer. `latency` (seconds
+    before the first piece) and `tokens_per_second` simulate a remote model;
+    both default to LOCAL_LLM_LATENCY_MS and LOCAL_LLM_TOKENS_PER_SEC, and 0
+    means no delay.
+    """
+    name = 'local'
+
+    def __init__(self, latency: Optional[float] = None, tokens_per_second: Optional[float] = None,
+                 max_sentences: int = 3):
+        if latency is None:
+            latency = float(os.environ.get("LOCAL_LLM_LATENCY_MS", "0")) / 1000.0
+        if tokens_per_second is None:
+            tokens_per_second = float(os.environ.get("LOCAL_LLM_TOKENS_PER_SEC", "0"))
+        self.latency = latency
+        self.token_interval = 1.0 / tokens_per_second if tokens_per_second > 0 else 0.0
+        self.max_sentences = max_sentences
+
+    def _compose(self, question: str, context: str) -> str:
+        terms = set(tokenize(question))
+        sentences = [sentence.strip() for sentence in _SENTENCES.findall(context) if sentence.strip()]
+        scored = [(len(terms.intersection(tokenize(sentence))), -i, sentence) for i, sentence in enumerate(sentences)]
+        best = sorted((item for item in scored if item[0] > 0), reverse=True)[:self.max_sentences]
+        if not best:
+            return "**Answer not in context**\n\nThe retrieved context does not mention the terms of this question."
+        # Keep the chosen sentences in document order
+        lines = [f"- {sentence}" for _, _, sentence in sorted(best, key=lambda item: -item[1])]
+        return "**Answer**\n\n" + "\n".join(lines)
+
+    def stream_answer(self, question: str, context: str) -> Iterator[str]:
+        if self.latency:
+            time.sleep(self.latency)
+        for piece in _TOKEN_PIECES.findall(self._compose(question, context)):
+            if self.token_interval:
+                time.sleep(self.token_interval)
+            yield piece
+
+    def generate_answer(self, question: str, context: str) -> str:
+        return "".join(self.stream_answer(question, context))
+
+    async def astream_answer(self, question: str, context: str) -> AsyncIterator[str]:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        for piece in _TOKEN_PIECES.findall(self._compose(question, context)):
+            if self.token_interval:
+                await asyncio.sleep(self.token_interval)
+            yield piece
+
+    async def agenerate_answer(self, question: str, context: str) -> str:
+        return "".join([piece async for piece in self.astream_answer(question, context)])
+
+    def summarize_document(self, text: str, max_length: int = 500) -> str:
+        return " ".join(text.split()[:max_length])
+
+    def extract_keywords(self, text: str, max_keywords: int = 10) -> list:
+        return [term for term, _ in Counter(tokenize(text)).most_common(max_keywords)]
+
+
+def create_generator(name: Optional[str] = None) -> AnswerGenerator:
+    """Instantiate the answer generator selected by name or LLM_BACKEND"""
+    name = name or os.environ.get("LLM_BACKEND", "gemini")
+    if name == LocalGenerator.name:
+        return LocalGenerator()
+    if name == 'gemini':
+        # Imported here so offline setups don't need google-genai or an API key
+        from gemini_client import GeminiClient
+        return GeminiClient()
+    raise ValueError(f"Unknown LLM backend: {name}")
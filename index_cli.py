@@ -0,0 +1,345 @@
+"""Offline maintenance of the search index: stats, integrity check, compaction, rebuild and snapshots
+
+Usage:
+    python -m index_cli stats [--user ID] [--documents]
+    python -m index_cli check
+    python -m index_cli compact [--dry-run]
+    python -m index_cli rebuild [--document ID ...] [--from-check] [--workers N]
+    python -m index_cli snapshot [--name NAME]
+    python -m index_cli snapshots
+    python -m index_cli restore NAME_OR_PATH
+
+Works on the database in DATABASE_URL (SQLite by default) and the index in
+`--index` (vector_store/simple_index.json). The web app keeps its own copy of
+the index in memory and rewrites the file on its next upload or delete, so
+stop it before compact, rebuild or restore and start it again afterwards.
+Every command prints a JSON report; `check` exits with status 1 when it
+finds problems.
+"""
+import os
+import sys
+import json
+import shutil
+import hashlib
+import logging
+import argparse
+import itertools
+from datetime import datetime
+from typing import Dict, Any, List, Iterator, Optional
+
+from app import app, db
+from models import Document, DocumentChunk
+from generators import LocalGenerator
+from rag_engine import RAGEngine
+
+
+def open_engine(index_file: str) -> RAGEngine:
+    # Maintenance never answers questions, so no LLM client is needed
+    engine = RAGEngine(index_file=index_file, generator=LocalGenerator())
+    # The commands below read the index attributes directly
+    engine.load_index()
+    return engine
+
+
+def _stored_chunks(document_ids: Optional[set] = None) -> Iterator[tuple]:
+    """(document_id, [chunk text, ...]) in chunk order, streamed from DocumentChunk rows"""
+    query = db.session.query(DocumentChunk.document_id, DocumentChunk.content)
+    if document_ids is not None:
+        query = query.filter(DocumentChunk.document_id.in_(document_ids))
+    rows = query.order_by(DocumentChunk.document_id, DocumentChunk.chunk_index).yield_per(1000)
+    for document_id, group in itertools.groupby(rows, key=lambda row: row[0]):
+        yield document_id, [content for _, content in group]
+
+
+def check_index(engine: RAGEngine) -> Dict[str, Any]:
+    """Reconcile the index with the Document and DocumentChunk tables"""
+    owners = dict(db.session.query(Document.id, Document.user_id).all())
+    indexed = set(engine.document_chunks)
+
+    stale = []
+    unindexed = []
+    orphaned_rows = {}
+    for document_id, chunks in _stored_chunks():
+        if document_id not in owners:
+            orphaned_rows[document_id] = len(chunks)
+        elif document_id not in indexed:
+            unindexed.append(document_id)
+        elif chunks != engine.document_chunks[document_id]:
+            stale.append(document_id)
+
+    missing_vectors = []
+    for document_id, chunks in engine.document_chunks.items():
+        if engine.dense_index is not None:
+            stored = engine.dense_index.document_size(document_id)
+        else:
+            stored = len(engine.document_embeddings.get(document_id, ()))
+        if stored != len(chunks) or len(engine.chunk_hashes.get(document_id, ())) != len(chunks) \
+                or len(engine.chunk_signatures.get(document_id, ())) != len(chunks):
+            missing_vectors.append(document_id)
+
+    findings = {
+        # Index entries whose Document row is gone
+        'orphaned': sorted(indexed - set(owners)),
+        # Indexed under another user than the Document row's
+        'owner_mismatch': sorted(document_id for document_id in indexed & set(owners)
+                                 if engine.document_owners.get(document_id) != owners[document_id]),
+        # Chunk rows committed but never indexed, e.g. after a failed index save
+        'unindexed': sorted(unindexed),
+        # Indexed chunks that differ from the rows
+        'stale': sorted(stale),
+        # Chunks without a vector, content hash or MinHash signature each
+        'missing_vectors': sorted(missing_vectors),
+        # DocumentChunk rows of deleted documents
+        'orphaned_chunk_rows': orphaned_rows,
+    }
+    return {
+        'ok': not any(findings.values()),
+        'documents': len(owners),
+        'indexed_documents': len(indexed),
+        **findings,
+    }
+
+
+def compact_index(engine: RAGEngine, dry_run: bool = False) -> Dict[str, Any]:
+    """Drop index entries and chunk rows of deleted documents and rewrite the index without them"""
+    report = check_index(engine)
+    orphaned = report['orphaned']
+    orphaned_rows = list(report['orphaned_chunk_rows'])
+    before = engine.get_index_stats(detailed=True)['index_bytes']
+
+    # Leftovers of partially removed documents in the side tables
+    leftovers = (set(engine.document_embeddings) | set(engine.document_owners) | set(engine.chunk_hashes)
+                 | set(engine.chunk_signatures)) - set(engine.document_chunks)
+    dead_terms = _dead_terms(engine)
+
+    result = {
+        'dry_run': dry_run,
+        'removed_documents': orphaned,
+        'removed_leftovers': sorted(leftovers),
+        'removed_chunk_rows': sum(report['orphaned_chunk_rows'].values()),
+        'cleaned_terms': len(dead_terms),
+        'bytes_before': before,
+    }
+    if dry_run:
+        return result
+
+    for document_id in itertools.chain(orphaned, leftovers):
+        engine._forget_document(document_id)
+    for term in _dead_terms(engine):
+        postings = engine.postings.get(term)
+        if not postings:
+            engine.postings.pop(term, None)
+            engine.term_bounds.pop(term, None)
+        else:
+            engine.term_bounds[term] = {doc_id: bound for doc_id, bound in engine.term_bounds[term].items()
+                                        if doc_id in postings}
+    if orphaned_rows:
+        DocumentChunk.query.filter(DocumentChunk.document_id.in_(orphaned_rows)).delete(synchronize_session=False)
+        db.session.commit()
+    engine._save_index()
+    result['bytes_after'] = engine.get_index_stats(detailed=True)['index_bytes']
+    return result
+
+
+def _dead_terms(engine: RAGEngine) -> List[str]:
+    """Terms with an empty postings table, or with document bounds that have no postings behind them"""
+    return sorted(term for term in set(engine.postings) | set(engine.term_bounds)
+                  if not engine.postings.get(term)
+                  or not engine.term_bounds.get(term, {}).keys() <= engine.postings[term].keys())
+
+
+def rebuild_index(engine: RAGEngine, document_ids: Optional[List[int]] = None, workers: int = 4) -> Dict[str, Any]:
+    """Re-embed documents from their DocumentChunk rows; all documents when none are given.
+
+    A full rebuild starts from an empty index, so orphaned entries disappear too.
+    The index file is only replaced once every document is encoded.
+    """
+    owners = dict(db.session.query(Document.id, Document.user_id).all())
+    if document_ids is None:
+        for document_id in list(engine.document_chunks):
+            engine._forget_document(document_id)
+        wanted = None
+        removed = []
+    else:
+        wanted = set(document_ids)
+        # Requested documents whose Document row is gone are only dropped from the index
+        removed = sorted(wanted - set(owners))
+        for document_id in removed:
+            engine._forget_document(document_id)
+
+    documents = ((document_id, owners[document_id], chunks)
+                 for document_id, chunks in _stored_chunks(wanted)
+                 if document_id in owners)
+    results = list(engine.reindex_documents(documents, max_workers=workers))
+    rebuilt = sorted(result['document_id'] for result in results if 'chunks' in result)
+    if not rebuilt and (document_ids is None or removed):
+        # Nothing was re-indexed, so nothing saved: still persist the removals
+        engine._save_index()
+    return {
+        'rebuilt': rebuilt,
+        'removed': removed,
+        'chunks': sum(result.get('chunks', 0) for result in results),
+        'errors': {result['document_id']: result['error'] for result in results if 'error' in result},
+    }
+
+
+def _index_files(engine: RAGEngine) -> List[str]:
+    return [path for path in (engine.index_file, engine.dense_index_file) if os.path.exists(path)]
+
+
+def _sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def snapshot_dir(engine: RAGEngine) -> str:
+    return os.path.join(os.path.dirname(engine.index_file) or ".", "snapshots")
+
+
+def snapshot_index(engine: RAGEngine, name: Optional[str] = None) -> Dict[str, Any]:
+    """Copy the index files into a named snapshot with a checksummed manifest"""
+    name = name or datetime.utcnow().strftime("%Y%m%dT%H%M%S")
+    target = os.path.join(snapshot_dir(engine), name)
+    if os.path.exists(target):
+        raise ValueError(f"Snapshot already exists: {name}")
+    os.makedirs(target)
+
+    stats = engine.get_index_stats()
+    manifest = {
+        'name': name,
+        'created': datetime.utcnow().isoformat(),
+        'backend': engine.embedding_model.name,
+        'documents': stats['total_documents'],
+        'chunks': stats['total_chunks'],
+        'files': {},
+    }
+    for path in _index_files(engine):
+        shutil.copy2(path, os.path.join(target, os.path.basename(path)))
+        manifest['files'][os.path.basename(path)] = _sha256(path)
+    with open(os.path.join(target, "manifest.json"), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    manifest['path'] = target
+    return manifest
+
+
+def list_snapshots(engine: RAGEngine) -> List[Dict[str, Any]]:
+    snapshots = []
+    root = snapshot_dir(engine)
+    for name in sorted(os.listdir(root)) if os.path.isdir(root) else []:
+        manifest_path = os.path.join(root, name, "manifest.json")
+        if os.path.exists(manifest_path):
+            with open(manifest_path) as f:
+                manifest = json.load(f)
+            manifest.pop('files', None)
+            snapshots.append(manifest)
+    return snapshots
+
+
+def restore_index(engine: RAGEngine, source: str) -> Dict[str, Any]:
+    """Verify a snapshot and put its files in place, snapshotting the current index first"""
+    path = source if os.path.isdir(source) else os.path.join(snapshot_dir(engine), source)
+    manifest_path = os.path.join(path, "manifest.json")
+    if not os.path.exists(manifest_path):
+        raise ValueError(f"No snapshot manifest in {path}")
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    if manifest['backend'] != engine.embedding_model.name:
+        raise ValueError(f"Snapshot was built with the {manifest['backend']} backend, "
+                         f"not {engine.embedding_model.name}")
+    for filename, checksum in manifest['files'].items():
+        if _sha256(os.path.join(path, filename)) != checksum:
+            raise ValueError(f"Checksum mismatch for {filename} in snapshot {manifest['name']}")
+
+    backup = snapshot_index(engine, "pre-restore-" + datetime.utcnow().strftime("%Y%m%dT%H%M%S")) \
+        if _index_files(engine) else None
+
+    for current in (engine.index_file, engine.dense_index_file):
+        filename = os.path.basename(current)
+        if filename in manifest['files']:
+            # Copied next to the target and renamed, so a failed copy leaves the current file intact
+            shutil.copy2(os.path.join(path, filename), current + ".tmp")
+            os.replace(current + ".tmp", current)
+        elif os.path.exists(current):
+            os.remove(current)
+
+    restored = open_engine(engine.index_file)
+    return {
+        'restored': manifest['name'],
+        'backup': backup['name'] if backup else None,
+        'check': check_index(restored),
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Inspect and maintain the document search index")
+    parser.add_argument('--index', default=os.path.join(app.config['VECTOR_STORE_FOLDER'], "simple_index.json"),
+                        help="index file (default: %(default)s)")
+    parser.add_argument('--verbose', action='store_true', help="show the app's log output")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    stats = commands.add_parser('stats', help="index statistics per user and document")
+    stats.add_argument('--user', type=int, help="only this user's documents")
+    stats.add_argument('--documents', action='store_true', help="include the per-document breakdown")
+    commands.add_parser('check', help="reconcile the index with the database")
+    compact = commands.add_parser('compact', help="remove data of deleted documents")
+    compact.add_argument('--dry-run', action='store_true', help="report what would be removed")
+    rebuild = commands.add_parser('rebuild', help="re-embed documents from their stored chunks")
+    rebuild.add_argument('--document', type=int, action='append', help="document id, repeatable (default: all)")
+    rebuild.add_argument('--from-check', action='store_true',
+                         help="rebuild the documents `check` reports as unindexed, stale or missing vectors")
+    rebuild.add_argument('--workers', type=int, default=app.config['UPLOAD_WORKERS'])
+    snapshot = commands.add_parser('snapshot', help="copy the index into vector_store/snapshots")
+    snapshot.add_argument('--name', help="snapshot name (default: UTC timestamp)")
+    commands.add_parser('snapshots', help="list snapshots")
+    restore = commands.add_parser('restore', help="restore a snapshot by name or path")
+    restore.add_argument('source')
+    args = parser.parse_args(argv)
+
+    if not args.verbose:
+        logging.getLogger().setLevel(logging.WARNING)
+
+    status = 0
+    with app.app_context():
+        engine = open_engine(args.index)
+        try:
+            if args.command == 'stats':
+                result = engine.get_index_stats(detailed=True)
+                if args.user is not None:
+                    result['users'] = {args.user: result['users'].get(args.user, {})}
+                    result['documents'] = {doc_id: document for doc_id, document in result['documents'].items()
+                                           if document['user_id'] == args.user}
+                if not args.documents:
+                    result.pop('documents')
+            elif args.command == 'check':
+                result = check_index(engine)
+                status = 0 if result['ok'] else 1
+            elif args.command == 'compact':
+                result = compact_index(engine, dry_run=args.dry_run)
+            elif args.command == 'rebuild':
+                document_ids = args.document
+                if args.from_check:
+                    report = check_index(engine)
+                    flagged = report['unindexed'] + report['stale'] + report['missing_vectors'] + \
+                        report['owner_mismatch']
+                    document_ids = sorted(set(flagged) | set(document_ids or ()))
+                result = rebuild_index(engine, document_ids, workers=args.workers)
+                status = 1 if result['errors'] else 0
+            elif args.command == 'snapshot':
+                result = snapshot_index(engine, args.name)
+            elif args.command == 'snapshots':
+                result = list_snapshots(engine)
+            else:
+                result = restore_index(engine, args.source)
+        except ValueError as e:
+            print(f"error: {e}", file=sys.stderr)
+            return 2
+
+    print(json.dumps(result, indent=2, default=str))
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
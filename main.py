@@ -1,5 +1,6 @@
-from app import app
+from app import app, init_db
 import routes  # noqa: F401
 
 if __name__ == "__main__":
+    init_db()
     app.run(host="0.0.0.0", port=5000, debug=True)
@@ -0,0 +1,155 @@
+import time
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional, Tuple
+
+# Latency buckets in seconds, from sub-millisecond index work up to slow LLM calls
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Per-request timing collector, only set while a request asked for its timings
+_request_timings: contextvars.ContextVar = contextvars.ContextVar('request_timings', default=None)
+
+
+class Histogram:
+    """Cumulative latency histogram keyed by a single `stage` label"""
+
+    def __init__(self, name: str, help_text: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        self._series: Dict[str, list] = {}  # stage -> [bucket counts..., count, sum]
+
+    def observe(self, stage: str, seconds: float):
+        """Record one observation for a stage"""
+        with self._lock:
+            series = self._series.get(stage)
+            if series is None:
+                series = self._series[stage] = [0] * (len(self.buckets) + 1) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    series[i] += 1
+            series[-2] += 1
+            series[-1] += seconds
+
+    def render(self) -> str:
+        """Render in the Prometheus text exposition format"""
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series_items = sorted((stage, list(series)) for stage, series in self._series.items())
+        for stage, series in series_items:
+            for bound, count in zip(self.buckets, series):
+                lines.append(f'{self.name}_bucket{{stage="{stage}",le="{bound:g}"}} {count}')
+            lines.append(f'{self.name}_bucket{{stage="{stage}",le="+Inf"}} {series[-2]}')
+            lines.append(f'{self.name}_count{{stage="{stage}"}} {series[-2]}')
+            lines.append(f'{self.name}_sum{{stage="{stage}"}} {series[-1]:.6f}')
+        return "\n".join(lines)
+
+
+class Counter:
+    """Monotonic counter keyed by a single label"""
+
+    def __init__(self, name: str, help_text: str, label: str = 'stage'):
+        self.name = name
+        self.help_text = help_text
+        self.label = label
+        self._lock = threading.Lock()
+        self._values: Dict[str, float] = {}
+
+    def inc(self, value: str, amount: float = 1.0):
+        with self._lock:
+            self._values[value] = self._values.get(value, 0.0) + amount
+
+    def values(self) -> Dict[str, float]:
+        """Snapshot of the current count per label value"""
+        with self._lock:
+            return dict(self._values)
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        for value, count in sorted(self.values().items()):
+            lines.append(f'{self.name}{{{self.label}="{value}"}} {count:g}')
+        return "\n".join(lines)
+
+
+class MetricsRegistry:
+    """Process-wide collection of histograms and counters"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics: Dict[str, object] = {}
+
+    def histogram(self, name: str, help_text: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        """Get or create a histogram by name"""
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = Histogram(name, help_text, buckets)
+            return self._metrics[name]
+
+    def counter(self, name: str, help_text: str, label: str = 'stage') -> Counter:
+        """Get or create a counter by name"""
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = Counter(name, help_text, label)
+            return self._metrics[name]
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = [self._metrics[name] for name in sorted(self._metrics)]
+        return "\n".join(metric.render() for metric in metrics) + "\n"
+
+
+registry = MetricsRegistry()
+
+ASK_STAGES = registry.histogram(
+    'askscribe_ask_stage_seconds',
+    'Time spent in each stage of answering a question'
+)
+UPLOAD_STAGES = registry.histogram(
+    'askscribe_upload_stage_seconds',
+    'Time spent in each stage of processing an uploaded document'
+)
+PDF_PAGES = registry.counter(
+    'askscribe_pdf_pages_total',
+    'PDF pages by how their text was obtained (text, ocr, skip)',
+    label='mode'
+)
+ANSWER_SOURCES = registry.counter(
+    'askscribe_answers_total',
+    'Answers by how they were produced (llm, extractive, no_context, error)',
+    label='source'
+)
+
+
+@contextmanager
+def span(histogram: Histogram, stage: str) -> Iterator[None]:
+    """Time a block, record it in the histogram and in the current request's timings"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        histogram.observe(stage, elapsed)
+        timings = _request_timings.get()
+        if timings is not None:
+            timings[stage] = timings.get(stage, 0.0) + elapsed * 1000.0
+
+
+@contextmanager
+def collect_timings(enabled: bool = True) -> Iterator[Optional[Dict[str, float]]]:
+    """Collect per-stage milliseconds for spans run inside this block"""
+    if not enabled:
+        yield None
+        return
+    timings: Dict[str, float] = {}
+    token = _request_timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _request_timings.reset(token)
+
+
+def render_metrics() -> str:
+    return registry.render()
@@ -0,0 +1,122 @@
+import zlib
+import random
+from typing import List, Dict, Any, Optional, Iterator, Set
+from utils import tokenize
+
+
+class MinHasher:
+    """MinHash signatures of chunk text, for spotting near-duplicate chunks across documents.
+
+    A text is reduced to its set of `shingle_size`-word shingles; the signature
+    keeps, for each of `num_perm` random hash functions, the smallest hash of
+    any shingle. Two signatures agree at a position with probability equal to
+    the Jaccard similarity of the shingle sets. Hash functions come from a
+    fixed seed and shingles are hashed with CRC32, so signatures are stable
+    across processes and can be stored in the index.
+    """
+
+    def __init__(self, num_perm: int = 64, bands: int = 16, shingle_size: int = 3, seed: int = 1):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+        self.seed = seed
+        # Multiply-shift hashing: odd 64-bit multipliers, 64-bit offsets, top 32 bits kept
+        rng = random.Random(seed)
+        self.multipliers = [rng.getrandbits(64) | 1 for _ in range(num_perm)]
+        self.offsets = [rng.getrandbits(64) for _ in range(num_perm)]
+
+    @property
+    def params(self) -> Dict[str, int]:
+        """Settings stored with the signatures; signatures made with other settings are not comparable"""
+        return {'num_perm': self.num_perm, 'bands': self.bands,
+                'shingle_size': self.shingle_size, 'seed': self.seed}
+
+    def shingles(self, text: str) -> Set[int]:
+        tokens = tokenize(text)
+        size = min(self.shingle_size, len(tokens))
+        return {zlib.crc32(" ".join(tokens[i:i + size]).encode('utf-8'))
+                for i in range(len(tokens) - size + 1)} if tokens else set()
+
+    def signatures(self, texts: List[str]) -> List[Optional[bytes]]:
+        """One signature per text, `num_perm` little-endian uint32 values; None for texts without words"""
+        import numpy as np
+        multipliers = np.array(self.multipliers, dtype=np.uint64)[:, None]
+        offsets = np.array(self.offsets, dtype=np.uint64)[:, None]
+        signatures = []
+        for text in texts:
+            shingles = self.shingles(text)
+            if not shingles:
+                signatures.append(None)
+                continue
+            values = np.fromiter(shingles, dtype=np.uint64, count=len(shingles))
+            # uint64 arithmetic wraps around, which is the modulo 2**64 of multiply-shift
+            hashes = (multipliers * values + offsets) >> np.uint64(32)
+            signatures.append(hashes.min(axis=1).astype('<u4').tobytes())
+        return signatures
+
+    def similarity(self, signature1: bytes, signature2: bytes) -> float:
+        """Estimated Jaccard similarity: the share of positions where the signatures agree"""
+        agree = sum(signature1[i:i + 4] == signature2[i:i + 4] for i in range(0, len(signature1), 4))
+        return agree / self.num_perm
+
+    def band_keys(self, signature: bytes) -> Iterator[bytes]:
+        """LSH bucket keys: one per band of `rows` signature values, tagged with the band number"""
+        width = self.rows * 4
+        for band in range(self.bands):
+            yield bytes((band,)) + signature[band * width:(band + 1) * width]
+
+
+class LSHIndex:
+    """Buckets of (doc_id, chunk_id) chunk references keyed by MinHash band.
+
+    Chunks whose signatures agree on all rows of any band share a bucket, so
+    near-duplicates of a chunk are found by looking up its `bands` keys rather
+    than comparing it with every chunk. With 16 bands of 4 rows, chunks with
+    80% similar shingles are paired with probability above 0.999, while those
+    below 30% rarely are; candidates are then checked against `threshold`.
+    """
+
+    def __init__(self, hasher: MinHasher, threshold: float = 0.8):
+        self.hasher = hasher
+        self.threshold = threshold
+        self.buckets: Dict[bytes, List[tuple]] = {}
+
+    def add(self, doc_id: int, signatures: List[Optional[bytes]]):
+        for i, signature in enumerate(signatures):
+            if signature is None:
+                continue
+            for key in self.hasher.band_keys(signature):
+                self.buckets.setdefault(key, []).append((doc_id, i))
+
+    def remove(self, doc_id: int, signatures: List[Optional[bytes]]):
+        for signature in signatures:
+            if signature is None:
+                continue
+            for key in self.hasher.band_keys(signature):
+                bucket = self.buckets.get(key)
+                if bucket is None:
+                    continue
+                bucket[:] = [ref for ref in bucket if ref[0] != doc_id]
+                if not bucket:
+                    del self.buckets[key]
+
+    def clear(self):
+        self.buckets = {}
+
+    def near_duplicates(self, signature: bytes, signatures: Dict[int, List[Optional[bytes]]],
+                        allowed_doc_ids: Any) -> List[tuple]:
+        """(doc_id, chunk_id) of indexed chunks at least `threshold` similar to the signature.
+
+        Only documents in `allowed_doc_ids` are considered; `signatures` maps
+        doc ids to their chunk signatures for the similarity check.
+        """
+        candidates = set()
+        for key in self.hasher.band_keys(signature):
+            for ref in self.buckets.get(key, ()):
+                if ref[0] in allowed_doc_ids:
+                    candidates.add(ref)
+        return sorted(ref for ref in candidates
+                      if self.hasher.similarity(signature, signatures[ref[0]][ref[1]]) >= self.threshold)
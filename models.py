@@ -37,6 +37,10 @@ class Document(db.Model):
     chunk_count = db.Column(db.Integer, default=0)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     
+    __table_args__ = (
+        db.Index('ix_document_user_processed_uploaded', 'user_id', 'processed', 'upload_time'),
+    )
+    
     def __repr__(self):
         return f'<Document {self.original_filename}>'
 
@@ -50,6 +54,10 @@ class ChatSession(db.Model):
     # Relationships
     messages = db.relationship('ChatMessage', backref='session', lazy=True, cascade='all, delete-orphan')
     
+    __table_args__ = (
+        db.Index('ix_chat_session_user_updated', 'user_id', 'updated_at'),
+    )
+    
     def __repr__(self):
         return f'<ChatSession {self.session_name}>'
 
@@ -61,6 +69,10 @@ class ChatMessage(db.Model):
     context_used = db.Column(db.Text)  # JSON string of context documents used
     session_id = db.Column(db.Integer, db.ForeignKey('chat_session.id'), nullable=False)
     
+    __table_args__ = (
+        db.Index('ix_chat_message_session_timestamp', 'session_id', 'timestamp'),
+    )
+    
     def __repr__(self):
         return f'<ChatMessage {self.message_type}: {self.content[:50]}...>'
 
@@ -70,10 +82,16 @@ class DocumentChunk(db.Model):
     chunk_index = db.Column(db.Integer, nullable=False)
     start_char = db.Column(db.Integer)
     end_char = db.Column(db.Integer)
-    document_id = db.Column(db.Integer, db.ForeignKey('document.id'), nullable=False)
+    document_id = db.Column(db.Integer, db.ForeignKey('document.id'), nullable=False, index=True)
     
     # Relationship
     document = db.relationship('Document', backref='chunks')
     
     def __repr__(self):
         return f'<DocumentChunk {self.document_id}:{self.chunk_index}>'
+
+def create_missing_indexes():
+    """Create declared indexes that db.create_all() skips on tables that already exist"""
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=db.engine, checkfirst=True)
@@ -0,0 +1,112 @@
+import os
+import unicodedata
+from typing import Dict, Any, List, Optional
+
+# Unicode categories that never come from a sound text layer: controls, unassigned,
+# private use (unmapped font glyphs) and surrogates
+_INVALID_CATEGORIES = frozenset(('Cc', 'Cn', 'Co', 'Cs'))
+
+
+class PageClassifier:
+    """Decides per PDF page whether to skip it, use its text layer or OCR it.
+
+    Signals are the share of the page covered by images, the share covered
+    by text blocks and how much of the text layer is made of valid glyphs:
+
+    - a text layer made mostly of invalid glyphs or symbols is OCR'd;
+    - a page that is mostly image with (almost) no text area is a scan and OCR'd;
+    - anything else with text uses the text layer;
+    - a page without text is OCR'd if it has an image covering at least
+      `min_image_area` of it (a photographed page, a half-page scanned figure),
+      and skipped otherwise (blank pages, or only a logo or rule).
+
+    OCR resolution follows the native resolution of the page's largest image,
+    clamped to `min_dpi`..`max_dpi` and to `max_pixels` per page. Tesseract's
+    time grows with the pixel count, so by default pages render at 72 to
+    200 dpi and at most 4 megapixels (a Letter page at 200 dpi), enough for
+    body text; OCR_MIN_DPI, OCR_DEFAULT_DPI, OCR_MAX_DPI and OCR_MAX_PIXELS
+    override the range.
+    """
+
+    def __init__(self, scan_coverage: float = 0.6, min_text_area: float = 0.05, min_validity: float = 0.9,
+                 min_alnum_ratio: float = 0.5, min_judged_chars: int = 20, min_image_area: float = 0.05,
+                 default_dpi: Optional[int] = None, min_dpi: Optional[int] = None, max_dpi: Optional[int] = None,
+                 max_pixels: Optional[int] = None):
+        self.scan_coverage = scan_coverage
+        self.min_text_area = min_text_area
+        self.min_validity = min_validity
+        self.min_alnum_ratio = min_alnum_ratio
+        self.min_judged_chars = min_judged_chars
+        self.min_image_area = min_image_area
+        self.default_dpi = default_dpi or int(os.environ.get("OCR_DEFAULT_DPI", "150"))
+        self.min_dpi = min_dpi or int(os.environ.get("OCR_MIN_DPI", "72"))
+        self.max_dpi = max_dpi or int(os.environ.get("OCR_MAX_DPI", "200"))
+        self.max_pixels = max_pixels or int(os.environ.get("OCR_MAX_PIXELS", "4000000"))
+
+    def classify(self, page) -> Dict[str, Any]:
+        """Signals and decision for a PyMuPDF page: `mode` is 'skip', 'text' or 'ocr'.
+
+        The returned `text` is the page's text layer, so callers using it don't
+        extract it a second time.
+        """
+        page_area = max(page.rect.width * page.rect.height, 1.0)
+        blocks = page.get_text("blocks")
+        text = "".join(block[4] for block in blocks if block[6] == 0)
+        text_area = sum(self._area(block[:4], page.rect) for block in blocks if block[6] == 0) / page_area
+        images = page.get_image_info()
+        image_areas = [self._area(image['bbox'], page.rect) / page_area for image in images]
+        image_coverage = min(1.0, sum(image_areas))
+        validity, alnum_ratio, chars = self._glyph_stats(text)
+
+        if chars >= self.min_judged_chars and (validity < self.min_validity or alnum_ratio < self.min_alnum_ratio):
+            mode = 'ocr'
+        elif image_coverage >= self.scan_coverage and text_area < self.min_text_area:
+            mode = 'ocr'
+        elif chars:
+            mode = 'text'
+        elif image_areas and max(image_areas) >= self.min_image_area:
+            mode = 'ocr'
+        else:
+            mode = 'skip'
+
+        return {
+            'mode': mode,
+            'dpi': self._ocr_dpi(page, images) if mode == 'ocr' else None,
+            'text': text,
+            'chars': chars,
+            'text_area': text_area,
+            'image_coverage': image_coverage,
+            'glyph_validity': validity,
+            'alnum_ratio': alnum_ratio,
+        }
+
+    def _area(self, bbox, rect) -> float:
+        """Area of a bounding box clipped to the page"""
+        width = min(bbox[2], rect.x1) - max(bbox[0], rect.x0)
+        height = min(bbox[3], rect.y1) - max(bbox[1], rect.y0)
+        return width * height if width > 0 and height > 0 else 0.0
+
+    def _glyph_stats(self, text: str) -> tuple:
+        """Share of valid glyphs and of letters/digits among the non-space characters"""
+        glyphs = [char for char in text if not char.isspace()]
+        if not glyphs:
+            return 1.0, 1.0, 0
+        valid = sum(1 for char in glyphs
+                    if char != '\ufffd' and unicodedata.category(char) not in _INVALID_CATEGORIES)
+        alnum = sum(1 for char in glyphs if char.isalnum())
+        return valid / len(glyphs), alnum / len(glyphs), len(glyphs)
+
+    def _ocr_dpi(self, page, images: List[Dict[str, Any]]) -> int:
+        dpi = self.default_dpi
+        if images:
+            # Rendering above the scan's own resolution only costs time
+            largest = max(images, key=lambda image: self._area(image['bbox'], page.rect))
+            width_inches = (largest['bbox'][2] - largest['bbox'][0]) / 72.0
+            if width_inches > 0 and largest.get('width'):
+                dpi = largest['width'] / width_inches
+        dpi = min(max(dpi, self.min_dpi), self.max_dpi)
+
+        pixels_per_dpi2 = (page.rect.width / 72.0) * (page.rect.height / 72.0)
+        if pixels_per_dpi2 * dpi * dpi > self.max_pixels:
+            dpi = (self.max_pixels / pixels_per_dpi2) ** 0.5
+        return max(int(dpi), 72)
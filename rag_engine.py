@@ -1,25 +1,92 @@
 import os
+import re
+import asyncio
 import logging
 import pickle
 import json
 import hashlib
-from typing import List, Dict, Any, Optional
+import heapq
+import threading
+import time
+import functools
+import base64
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import List, Dict, Any, Optional, Iterator, AsyncIterator, Iterable
 from models import Document, DocumentChunk
 from app import db
-from gemini_client import GeminiClient
+from generators import AnswerGenerator, create_generator
+from metrics import span, ASK_STAGES, UPLOAD_STAGES, ANSWER_SOURCES
+from reranker import Reranker, create_reranker, rerank_candidates
+from extractive import ExtractiveAnswerer
+from minhash import MinHasher, LSHIndex
+from utils import tokenize, find_term_spans, make_snippet, STOPWORDS
+
+class EmbeddingBackend:
+    """Interface for turning chunk and query text into vectors.
+
+    Sparse backends return one ``{term: weight}`` dict per text and are scored
+    with `similarity`; dense backends return an ``(n, dimension)`` float32
+    array of unit vectors that the engine keeps in a `DenseVectorIndex`.
+    """
+    name = 'base'
+    dense = False
+    dimension = 0
+    
+    def encode(self, texts: List[str]):
+        """Encode document chunks"""
+        raise NotImplementedError
+    
+    def encode_queries(self, texts: List[str]):
+        """Encode search queries"""
+        raise NotImplementedError
+    
+    def batch_encoder(self, previous=None) -> 'BatchEncoder':
+        """Encoder for one document whose chunks arrive a batch at a time.
+
+        ``previous`` holds the embeddings of the document's stored version, so
+        unchanged chunks can be carried over with `BatchEncoder.keep`.
+        """
+        return BatchEncoder(self, previous)
+
+
+class BatchEncoder:
+    """Encodes a streamed document batch by batch and returns all its embeddings at the end"""
+    
+    def __init__(self, backend: EmbeddingBackend, previous=None):
+        self.backend = backend
+        self.previous = previous
+        self.parts = []
+    
+    def add(self, texts: List[str]):
+        self.parts.append(self.backend.encode(texts))
+    
+    def keep(self, indices: List[int]):
+        """Carry over the previous version's embeddings at these chunk positions"""
+        if self.backend.dense:
+            self.parts.append(self.previous[indices])
+        else:
+            self.parts.append([self.previous[i] for i in indices])
+    
+    def finish(self):
+        if not self.parts:
+            return self.backend.encode([])
+        if self.backend.dense:
+            import numpy as np
+            return np.concatenate(self.parts)
+        return [embedding for part in self.parts for embedding in part]
 
 # Simple text similarity using TF-IDF approach
-class SimpleEmbedding:
+class SimpleEmbedding(EmbeddingBackend):
+    name = 'tfidf'
+    
     def __init__(self):
         self.vocabulary = {}
         self.idf_scores = {}
     
     def _tokenize(self, text: str) -> List[str]:
         """Simple tokenization"""
-        import re
         # Convert to lowercase and split on non-alphanumeric characters
-        tokens = re.findall(r'\b\w+\b', text.lower())
-        return [token for token in tokens if len(token) > 2]
+        return tokenize(text)
     
     def _compute_tf(self, tokens: List[str]) -> Dict[str, float]:
         """Compute term frequency"""
@@ -34,39 +101,21 @@ class SimpleEmbedding:
     
     def encode(self, texts: List[str]) -> List[Dict[str, float]]:
         """Create simple TF-IDF-like embeddings"""
-        embeddings = []
-        all_tokens = []
-        
-        # Tokenize all texts and build vocabulary
-        for text in texts:
-            tokens = self._tokenize(text)
-            all_tokens.append(tokens)
-            for token in tokens:
-                if token not in self.vocabulary:
-                    self.vocabulary[token] = len(self.vocabulary)
-        
-        # Compute document frequency for IDF
-        doc_freq = {}
-        for tokens in all_tokens:
-            unique_tokens = set(tokens)
-            for token in unique_tokens:
-                doc_freq[token] = doc_freq.get(token, 0) + 1
-        
-        # Compute IDF scores
-        num_docs = len(texts)
-        for token in doc_freq:
-            self.idf_scores[token] = 1.0 + (num_docs / (1 + doc_freq[token]))
-        
-        # Create embeddings
-        for tokens in all_tokens:
-            tf = self._compute_tf(tokens)
-            embedding = {}
-            for token, tf_score in tf.items():
-                idf_score = self.idf_scores.get(token, 1.0)
-                embedding[token] = tf_score * idf_score
-            embeddings.append(embedding)
-        
-        return embeddings
+        encoder = self.batch_encoder()
+        encoder.add(texts)
+        return encoder.finish()
+    
+    def batch_encoder(self, previous=None) -> 'TfidfBatchEncoder':
+        return TfidfBatchEncoder(self, previous)
+    
+    def encode_queries(self, texts: List[str]) -> List[Dict[str, float]]:
+        """Encode queries as term-frequency vectors without touching corpus statistics.
+
+        A single query always gets a flat IDF, so plain TF ranks chunks exactly
+        like ``encode([query])`` while staying safe to call from several threads.
+        """
+        return [self._compute_tf(tokens) if tokens else {}
+                for tokens in (self._tokenize(text) for text in texts)]
     
     def similarity(self, embedding1: Dict[str, float], embedding2: Dict[str, float]) -> float:
         """Compute cosine similarity between two embeddings"""
@@ -94,18 +143,246 @@ class SimpleEmbedding:
         
         return dot_product / (mag1 ** 0.5 * mag2 ** 0.5)
 
+class TfidfBatchEncoder(BatchEncoder):
+    """Keeps term frequencies and document frequencies per batch; IDF is applied
+    once the whole document has been seen, so results match a single encode call"""
+    
+    def __init__(self, backend: SimpleEmbedding, previous: Optional[List[Dict[str, float]]] = None):
+        super().__init__(backend, previous)
+        self.term_frequencies = []
+        self.doc_freq = {}
+        self.previous_tf = self._recover_term_frequencies(previous) if previous else []
+    
+    def _recover_term_frequencies(self, embeddings: List[Dict[str, float]]) -> List[Dict[str, float]]:
+        """Undo the IDF weighting of a stored document, whose IDF came from its own chunk set"""
+        doc_freq = {}
+        for embedding in embeddings:
+            for token in embedding:
+                doc_freq[token] = doc_freq.get(token, 0) + 1
+        num_docs = len(embeddings)
+        return [{token: weight / (1.0 + num_docs / (1 + doc_freq[token])) for token, weight in embedding.items()}
+                for embedding in embeddings]
+    
+    def keep(self, indices: List[int]):
+        for i in indices:
+            tf = self.previous_tf[i]
+            for token in tf:
+                self.doc_freq[token] = self.doc_freq.get(token, 0) + 1
+            self.term_frequencies.append(tf)
+    
+    def add(self, texts: List[str]):
+        vocabulary = self.backend.vocabulary
+        for text in texts:
+            tokens = self.backend._tokenize(text)
+            for token in tokens:
+                if token not in vocabulary:
+                    vocabulary[token] = len(vocabulary)
+            
+            # Compute document frequency for IDF
+            for token in set(tokens):
+                self.doc_freq[token] = self.doc_freq.get(token, 0) + 1
+            self.term_frequencies.append(self.backend._compute_tf(tokens))
+    
+    def finish(self) -> List[Dict[str, float]]:
+        # Compute IDF scores locally, so documents encoded on other threads can't interfere
+        num_docs = len(self.term_frequencies)
+        idf_scores = {token: 1.0 + (num_docs / (1 + freq)) for token, freq in self.doc_freq.items()}
+        self.backend.idf_scores.update(idf_scores)
+        
+        # Create embeddings
+        embeddings = []
+        for tf in self.term_frequencies:
+            embedding = {}
+            for token, tf_score in tf.items():
+                idf_score = idf_scores.get(token, 1.0)
+                embedding[token] = tf_score * idf_score
+            embeddings.append(embedding)
+        
+        return embeddings
+
+
+class SentenceEmbedding(EmbeddingBackend):
+    """Local CPU sentence-transformer embeddings for semantic search"""
+    name = 'sentence'
+    dense = True
+    
+    def __init__(self, model_name: Optional[str] = None, batch_size: int = 32):
+        try:
+            from sentence_transformers import SentenceTransformer
+        except ImportError as e:
+            raise ImportError("The 'sentence' embedding backend requires the sentence-transformers package") from e
+        
+        self.model_name = model_name or os.environ.get("EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+        self.batch_size = batch_size
+        self.model = SentenceTransformer(self.model_name, device='cpu')
+        self.dimension = self.model.get_sentence_embedding_dimension()
+    
+    def encode(self, texts: List[str]):
+        """Encode texts in batches into unit-norm float32 vectors"""
+        import numpy as np
+        if not texts:
+            return np.zeros((0, self.dimension), dtype=np.float32)
+        return self.model.encode(texts, batch_size=self.batch_size, convert_to_numpy=True,
+                                 normalize_embeddings=True, show_progress_bar=False).astype(np.float32)
+    
+    def encode_queries(self, texts: List[str]):
+        return self.encode(texts)
+
+EMBEDDING_BACKENDS = {
+    SimpleEmbedding.name: SimpleEmbedding,
+    SentenceEmbedding.name: SentenceEmbedding,
+}
+
+def create_embedding_backend(name: Optional[str] = None) -> EmbeddingBackend:
+    """Instantiate the embedding backend selected by name or EMBEDDING_BACKEND"""
+    name = name or os.environ.get("EMBEDDING_BACKEND", SimpleEmbedding.name)
+    if name not in EMBEDDING_BACKENDS:
+        raise ValueError(f"Unknown embedding backend: {name}")
+    return EMBEDDING_BACKENDS[name]()
+
+class RateLimiter:
+    """Spaces out calls so that at most `rate` of them start per second"""
+    
+    def __init__(self, rate: Optional[float] = None):
+        self.interval = 1.0 / rate if rate and rate > 0 else 0.0
+        self._lock = threading.Lock()
+        self._next_slot = 0.0
+    
+    def reserve(self) -> float:
+        """Claim the next start slot and return the seconds until it"""
+        if not self.interval:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.interval
+        return slot - now
+    
+    def wait(self):
+        """Block until the caller is allowed to start its call"""
+        delay = self.reserve()
+        if delay > 0:
+            time.sleep(delay)
+    
+    async def await_slot(self):
+        """`wait` for coroutines: sleeps without holding a thread"""
+        delay = self.reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+# Page markers written by DocumentProcessor into PDF text
+PAGE_MARKER = re.compile(r"--- Page (\d+)(?: \(OCR\))? ---")
+
+def _uses_index(method):
+    """Load the engine's index from disk, if not yet loaded, before running the method"""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        self.load_index()
+        return method(self, *args, **kwargs)
+    return wrapper
+
 class RAGEngine:
-    """Retrieval-Augmented Generation engine using simple text similarity and Gemini"""
+    """Retrieval-Augmented Generation engine using simple text similarity and an LLM generator"""
     
-    def __init__(self):
-        self.embedding_model = SimpleEmbedding()
-        self.document_embeddings = {}  # Maps doc_id to list of chunk embeddings
+    def __init__(self, index_file: Optional[str] = None, generator: Optional[AnswerGenerator] = None,
+                 embedding_model: Optional[EmbeddingBackend] = None):
+        self.embedding_model = embedding_model or create_embedding_backend()
+        self.document_embeddings = {}  # Maps doc_id to list of chunk embeddings (sparse backends)
         self.document_chunks = {}  # Maps doc_id to list of chunk texts
-        self.gemini_client = GeminiClient()
-        self.index_file = "vector_store/simple_index.json"
+        self.document_owners = {}  # Maps doc_id to owning user_id
+        self.chunk_hashes = {}  # Maps doc_id to content hashes of its chunks, for incremental re-indexing
+        self.chunk_signatures = {}  # Maps doc_id to MinHash signatures of its chunks, for near-duplicate detection
+        self.postings = {}  # Maps term to {doc_id: [(chunk_id, normalized weight), ...]} for sparse backends
+        self.term_bounds = {}  # Maps term to {doc_id: largest normalized weight of the term in that document}
+        self.dense_index = None  # Per-user chunk vector matrices (dense backends)
+        self._generator = generator  # created on first use, see `generator`
+        self.index_file = index_file or "vector_store/simple_index.json"
+        self.dense_index_file = os.path.splitext(self.index_file)[0] + ".dense.npz"
+        
+        # Streamed uploads are embedded and inserted this many chunks at a time
+        self.embed_batch_size = int(os.environ.get("EMBED_BATCH_SIZE", "64"))
+        
+        # Two-stage retrieval: a cheap first pass keeps this many candidates for the reranker
+        self.candidate_k = int(os.environ.get("RETRIEVAL_CANDIDATES", "100"))
+        self._reranker = None  # created on first search, see `reranker`
+        self._reranker_created = False
+        self._lazy_lock = threading.Lock()
+        self.rerank_budget = float(os.environ.get("RERANK_BUDGET_MS", "50")) / 1000.0
+        
+        # Extractive fast path: lookups answered with a sentence from the chunks skip the LLM
+        self.extractive = os.environ.get("EXTRACTIVE_ANSWERS", "false").lower() in ("1", "true", "yes")
+        self.extractor = ExtractiveAnswerer(threshold=float(os.environ.get("EXTRACTIVE_THRESHOLD", "0.8")))
+        
+        # Length of the highlighted source preview shown with each citation
+        self.snippet_chars = int(os.environ.get("SNIPPET_CHARS", "240"))
+        
+        # Near-duplicate chunks, e.g. one paragraph in several versions of a report, fill a single
+        # result slot that cites every copy; the LSH buckets are rebuilt from signatures on load
+        self.collapse_duplicates = os.environ.get("COLLAPSE_DUPLICATES", "true").lower() in ("1", "true", "yes")
+        self.minhash = MinHasher()
+        self.lsh_index = LSHIndex(self.minhash, threshold=float(os.environ.get("DUPLICATE_THRESHOLD", "0.8")))
         
-        # Load existing index if available
-        self._load_index()
+        if self.embedding_model.dense:
+            from vector_index import DenseVectorIndex
+            self.dense_index = DenseVectorIndex(
+                self.embedding_model.dimension,
+                storage=os.environ.get("EMBEDDING_STORAGE", "float32"),
+                ann_threshold=int(os.environ.get("ANN_THRESHOLD", "20000")),
+                pq_subvectors=int(os.environ.get("PQ_SUBVECTORS", "8")),
+                rerank=int(os.environ.get("RERANK_CANDIDATES", "0")),
+                vector_source=self._encode_stored_chunks
+            )
+        
+        # The index is read on first use rather than when a worker boots; INDEX_PRELOAD
+        # reads it now, e.g. in a gunicorn --preload master so forked workers share it
+        self._index_lock = threading.Lock()
+        self._index_loaded = False
+        if os.environ.get("INDEX_PRELOAD", "false").lower() in ("1", "true", "yes"):
+            self.load_index()
+    
+    @property
+    def generator(self) -> AnswerGenerator:
+        """The answer generator, created on first use so that booting a worker doesn't import the LLM SDK"""
+        if self._generator is None:
+            with self._lazy_lock:
+                if self._generator is None:
+                    self._generator = create_generator()
+        return self._generator
+    
+    @generator.setter
+    def generator(self, generator: AnswerGenerator):
+        self._generator = generator
+    
+    @property
+    def reranker(self) -> Optional[Reranker]:
+        """The reranker, created on first search since a cross-encoder loads its model"""
+        if not self._reranker_created:
+            with self._lazy_lock:
+                if not self._reranker_created:
+                    self._reranker = create_reranker()
+                    self._reranker_created = True
+        return self._reranker
+    
+    @reranker.setter
+    def reranker(self, reranker: Optional[Reranker]):
+        self._reranker = reranker
+        self._reranker_created = True
+    
+    def load_index(self):
+        """Load the index from disk unless it already is; everything that reads or changes it calls this"""
+        if self._index_loaded:
+            return
+        with self._index_lock:
+            if not self._index_loaded:
+                self._load_index()
+                self._index_loaded = True
+    
+    def _encode_stored_chunks(self, refs: List[tuple]):
+        """Full-precision vectors for (doc_id, chunk_id) pairs, used to re-rank quantized matches.
+
+        Re-encoding the handful of candidates keeps float vectors out of memory entirely.
+        """
+        return self.embedding_model.encode([self.document_chunks[doc_id][i] for doc_id, i in refs])
     
     def _load_index(self):
         """Load existing index"""
@@ -115,73 +392,429 @@ class RAGEngine:
                     data = json.load(f)
                     self.document_embeddings = data.get('embeddings', {})
                     self.document_chunks = data.get('chunks', {})
+                    self.document_owners = data.get('owners', {})
+                    self.chunk_hashes = data.get('hashes', {})
+                    minhash = data.get('minhash', {})
+                    # Signatures made with other MinHash settings can't be compared, and are recomputed
+                    if minhash.get('params') == self.minhash.params:
+                        self.chunk_signatures = {
+                            int(k): [base64.b64decode(signature) if signature else None for signature in v]
+                            for k, v in minhash.get('signatures', {}).items()
+                        }
                     # Convert string keys back to int
                     self.document_embeddings = {int(k): v for k, v in self.document_embeddings.items()}
                     self.document_chunks = {int(k): v for k, v in self.document_chunks.items()}
-                logging.info(f"Loaded existing index with {len(self.document_embeddings)} documents")
+                    self.document_owners = {int(k): v for k, v in self.document_owners.items()}
+                    self.chunk_hashes = {int(k): v for k, v in self.chunk_hashes.items()}
+                if self.dense_index is not None:
+                    self._load_dense_index()
+                else:
+                    self._load_sparse_index()
+                self._load_signatures()
+                logging.info(f"Loaded existing index with {len(self.document_chunks)} documents")
             else:
                 self._create_new_index()
         except Exception as e:
             logging.error(f"Error loading index: {e}")
             self._create_new_index()
     
+    def _load_dense_index(self):
+        """Load stored chunk vectors, re-encoding chunks if they were built with other settings"""
+        if os.path.exists(self.dense_index_file) and self.dense_index.load(self.dense_index_file):
+            return
+        
+        logging.info(f"Re-encoding stored chunks with the {self.embedding_model.name} backend")
+        unknown = [doc_id for doc_id in self.document_chunks if doc_id not in self.document_owners]
+        if unknown:
+            self.document_owners.update(self._owners_from_db(unknown))
+        for doc_id, chunks in self.document_chunks.items():
+            user_id = self.document_owners.get(doc_id)
+            if user_id is None:
+                logging.warning(f"Skipping document {doc_id}: its Document row is gone")
+                continue
+            self.dense_index.add(user_id, doc_id, self.embedding_model.encode(chunks))
+        self._save_index()
+    
+    def _owners_from_db(self, doc_ids: List[int]) -> Dict[int, int]:
+        """Owners of indexed documents from their Document rows, for indexes written before owners were stored"""
+        from app import app
+        try:
+            # The index may load outside a request, e.g. with INDEX_PRELOAD at import
+            with app.app_context():
+                rows = db.session.query(Document.id, Document.user_id).filter(Document.id.in_(doc_ids)).all()
+            return {doc_id: user_id for doc_id, user_id in rows}
+        except Exception as e:
+            logging.error(f"Error looking up document owners: {e}")
+            return {}
+    
+    def _load_sparse_index(self):
+        """Re-encode chunks whose sparse embeddings are missing, e.g. after using a dense backend"""
+        missing = [doc_id for doc_id in self.document_chunks if doc_id not in self.document_embeddings]
+        if missing:
+            logging.info(f"Re-encoding {len(missing)} documents with the {self.embedding_model.name} backend")
+            for doc_id in missing:
+                self.document_embeddings[doc_id] = self.embedding_model.encode(self.document_chunks[doc_id])
+            self._save_index()
+        
+        for doc_id, embeddings in self.document_embeddings.items():
+            self._add_postings(doc_id, embeddings)
+    
+    def _load_signatures(self):
+        """Compute MinHash signatures missing from the index, then fill the LSH buckets"""
+        missing = [doc_id for doc_id, chunks in self.document_chunks.items()
+                   if len(self.chunk_signatures.get(doc_id, ())) != len(chunks)]
+        if missing:
+            logging.info(f"Computing MinHash signatures for {len(missing)} documents")
+            for doc_id in missing:
+                self.chunk_signatures[doc_id] = self.minhash.signatures(self.document_chunks[doc_id])
+            self._save_index()
+        
+        self.lsh_index.clear()
+        for doc_id, signatures in self.chunk_signatures.items():
+            self.lsh_index.add(doc_id, signatures)
+    
+    def _set_signatures(self, doc_id: int, signatures: List[Optional[bytes]]):
+        self.lsh_index.remove(doc_id, self.chunk_signatures.get(doc_id, []))
+        self.chunk_signatures[doc_id] = signatures
+        self.lsh_index.add(doc_id, signatures)
+    
+    def _add_postings(self, doc_id: int, embeddings: List[Dict[str, float]]):
+        """Index a document's chunk embeddings by term and document, with weights pre-divided by the chunk norm.
+
+        The largest weight of each term within the document bounds what any of
+        its chunks can score on that term, which lets searches skip documents.
+        """
+        for i, embedding in enumerate(embeddings):
+            norm = sum(w * w for w in embedding.values()) ** 0.5
+            if norm == 0.0:
+                continue
+            for term, weight in embedding.items():
+                weight /= norm
+                self.postings.setdefault(term, {}).setdefault(doc_id, []).append((i, weight))
+                bounds = self.term_bounds.setdefault(term, {})
+                if weight > bounds.get(doc_id, 0.0):
+                    bounds[doc_id] = weight
+    
+    def _remove_postings(self, doc_id: int):
+        terms = set()
+        for embedding in self.document_embeddings.get(doc_id, []):
+            terms.update(embedding)
+        for term in terms:
+            for index in (self.postings, self.term_bounds):
+                by_document = index.get(term)
+                if by_document is not None:
+                    by_document.pop(doc_id, None)
+                    if not by_document:
+                        del index[term]
+    
     def _create_new_index(self):
         """Create new index"""
         self.document_embeddings = {}
         self.document_chunks = {}
+        self.document_owners = {}
+        self.chunk_hashes = {}
+        self.chunk_signatures = {}
+        self.postings = {}
+        self.term_bounds = {}
+        self.lsh_index.clear()
         logging.info("Created new simple index")
     
     def _save_index(self):
         """Save index to disk"""
         try:
-            os.makedirs("vector_store", exist_ok=True)
+            os.makedirs(os.path.dirname(self.index_file) or ".", exist_ok=True)
             data = {
+                'backend': self.embedding_model.name,
                 'embeddings': self.document_embeddings,
-                'chunks': self.document_chunks
+                'chunks': self.document_chunks,
+                'owners': self.document_owners,
+                'hashes': self.chunk_hashes,
+                'minhash': {
+                    'params': self.minhash.params,
+                    'signatures': {
+                        doc_id: [base64.b64encode(signature).decode('ascii') if signature else None
+                                 for signature in signatures]
+                        for doc_id, signatures in self.chunk_signatures.items()
+                    }
+                }
             }
-            with open(self.index_file, 'w') as f:
+            # Written aside and renamed, so a failed save never leaves a truncated index
+            with open(self.index_file + ".tmp", 'w') as f:
                 json.dump(data, f)
+            if self.dense_index is not None:
+                self.dense_index.save(self.dense_index_file + ".tmp")
+                os.replace(self.dense_index_file + ".tmp", self.dense_index_file)
+            os.replace(self.index_file + ".tmp", self.index_file)
             logging.info("Saved index to disk")
         except Exception as e:
             logging.error(f"Error saving index: {e}")
     
-    def add_document(self, document_id: int, chunks: List[str]):
-        """Add document chunks to the vector store"""
+    @_uses_index
+    def add_document(self, document_id: int, chunks: Iterable[str], user_id: Optional[int] = None) -> int:
+        """Add document chunks to the vector store and return how many were stored.
+
+        ``chunks`` may be a generator straight from the document processor. It is
+        consumed in batches: each batch is embedded and its rows flushed to the
+        database before the next one is pulled, with a single commit at the end.
+        """
         try:
-            # Create embeddings for chunks
-            embeddings = self.embedding_model.encode(chunks)
+            if user_id is None:
+                user_id = db.session.get(Document, document_id).user_id
             
-            # Store embeddings and chunks
-            self.document_embeddings[document_id] = embeddings
-            self.document_chunks[document_id] = chunks
+            stored = []
+            encoder = self.embedding_model.batch_encoder()
+            for batch in self._batched(chunks):
+                # Create embeddings for chunks
+                with span(UPLOAD_STAGES, 'embed'):
+                    encoder.add(batch)
+                
+                # Store document chunks in database
+                with span(UPLOAD_STAGES, 'db_insert'):
+                    db.session.add_all([
+                        DocumentChunk(content=chunk, chunk_index=len(stored) + i, document_id=document_id)
+                        for i, chunk in enumerate(batch)
+                    ])
+                    db.session.flush()
+                stored.extend(batch)
             
-            # Store document chunks in database
-            for i, chunk in enumerate(chunks):
-                chunk_record = DocumentChunk(
-                    content=chunk,
-                    chunk_index=i,
-                    document_id=document_id
-                )
-                db.session.add(chunk_record)
+            with span(UPLOAD_STAGES, 'embed'):
+                embeddings = encoder.finish()
+            with span(UPLOAD_STAGES, 'db_insert'):
+                db.session.commit()
             
-            db.session.commit()
-            self._save_index()
+            self._index_document(document_id, user_id, stored, embeddings)
+            with span(UPLOAD_STAGES, 'index_save'):
+                self._save_index()
             
-            logging.info(f"Added {len(chunks)} chunks for document {document_id}")
+            logging.info(f"Added {len(stored)} chunks for document {document_id}")
+            return len(stored)
             
         except Exception as e:
             logging.error(f"Error adding document {document_id}: {e}")
             db.session.rollback()
             raise
     
+    @_uses_index
+    def add_documents(self, documents: Iterable[tuple], user_id: int,
+                      max_workers: int = 4) -> Iterator[Dict[str, Any]]:
+        """Add several documents at once, yielding a result per document once it is committed and searchable.
+
+        ``documents`` holds (document_id, chunks) pairs; ``chunks`` may be a
+        zero-argument callable returning the chunk iterable. Text extraction
+        runs on the calling thread one document at a time, as PyMuPDF and
+        Tesseract don't support several threads; embedding runs on
+        `max_workers` threads while the next documents are extracted. Each
+        document's rows are committed and its chunks indexed as soon as its
+        embeddings are ready, and the index file is written once at the end.
+        Results are ``{'document_id', 'chunks'}`` or ``{'document_id', 'error'}``.
+        """
+        def encode(stored: List[str]):
+            encoder = self.embedding_model.batch_encoder()
+            for batch in self._batched(stored):
+                with span(UPLOAD_STAGES, 'embed'):
+                    encoder.add(batch)
+            with span(UPLOAD_STAGES, 'embed'):
+                return encoder.finish()
+        
+        def store(future) -> Dict[str, Any]:
+            document_id, stored = pending.pop(future)
+            try:
+                embeddings = future.result()
+                with span(UPLOAD_STAGES, 'db_insert'):
+                    db.session.add_all([
+                        DocumentChunk(content=chunk, chunk_index=i, document_id=document_id)
+                        for i, chunk in enumerate(stored)
+                    ])
+                    db.session.commit()
+            except Exception as e:
+                logging.error(f"Error processing document {document_id}: {e}")
+                db.session.rollback()
+                return {'document_id': document_id, 'error': str(e)}
+            self._index_document(document_id, user_id, stored, embeddings)
+            indexed.append(len(stored))
+            return {'document_id': document_id, 'chunks': len(stored)}
+        
+        pending = {}  # embedding future -> (document_id, chunks)
+        indexed = []
+        executor = ThreadPoolExecutor(max_workers=max(1, max_workers))
+        try:
+            for document_id, chunks in documents:
+                try:
+                    stored = list(chunks() if callable(chunks) else chunks)
+                except Exception as e:
+                    logging.error(f"Error processing document {document_id}: {e}")
+                    yield {'document_id': document_id, 'error': str(e)}
+                    continue
+                pending[executor.submit(encode, stored)] = (document_id, stored)
+                
+                # Store the documents whose embeddings finished while this one was extracted
+                for future in [future for future in pending if future.done()]:
+                    yield store(future)
+            
+            for future in as_completed(list(pending)):
+                yield store(future)
+        except BaseException:
+            # Also covers a consumer that stops early; documents already stored stay stored
+            db.session.rollback()
+            raise
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+            if indexed:
+                with span(UPLOAD_STAGES, 'index_save'):
+                    self._save_index()
+                logging.info(f"Added {sum(indexed)} chunks for {len(indexed)} documents")
+    
+    def _index_document(self, document_id: int, user_id: int, stored: List[str], embeddings):
+        """Make committed chunks and their embeddings searchable"""
+        if self.dense_index is not None:
+            self.dense_index.add(user_id, document_id, embeddings)
+        else:
+            self._remove_postings(document_id)
+            self.document_embeddings[document_id] = embeddings
+            self._add_postings(document_id, embeddings)
+        self.document_chunks[document_id] = stored
+        self.document_owners[document_id] = user_id
+        self.chunk_hashes[document_id] = [self._chunk_hash(chunk) for chunk in stored]
+        with span(UPLOAD_STAGES, 'minhash'):
+            self._set_signatures(document_id, self.minhash.signatures(stored))
+    
+    def _batched(self, chunks: Iterable[str]) -> Iterator[List[str]]:
+        batch = []
+        for chunk in chunks:
+            batch.append(chunk)
+            if len(batch) == self.embed_batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+    
+    def _chunk_hash(self, chunk: str) -> str:
+        return hashlib.blake2b(chunk.encode('utf-8'), digest_size=16).hexdigest()
+    
+    @_uses_index
+    def replace_document(self, document_id: int, chunks: Iterable[str],
+                         user_id: Optional[int] = None) -> Dict[str, int]:
+        """Swap in a new version of a document, re-embedding only the chunks that changed.
+
+        New chunks are matched to the stored version by content hash. Matched
+        chunks keep their embeddings and database rows (renumbered if they
+        moved); only unmatched chunks are embedded and inserted, and rows of
+        chunks that disappeared are deleted. Returns counts of kept, embedded
+        and removed chunks. A document missing from the index (e.g. a stale
+        entry `index_cli check` reports) is stored from scratch, replacing any
+        chunk rows it still has.
+        """
+        if document_id not in self.document_chunks:
+            # Deleted in the same transaction add_document commits, or rolls back on failure
+            DocumentChunk.query.filter_by(document_id=document_id).delete(synchronize_session=False)
+            count = self.add_document(document_id, chunks, user_id=user_id)
+            return {'chunks': count, 'kept': 0, 'embedded': count, 'removed': 0}
+        
+        try:
+            if user_id is None:
+                user_id = self.document_owners.get(document_id) or db.session.get(Document, document_id).user_id
+            
+            old_hashes = self.chunk_hashes.get(document_id) or \
+                [self._chunk_hash(chunk) for chunk in self.document_chunks[document_id]]
+            available = {}
+            for i in reversed(range(len(old_hashes))):
+                available.setdefault(old_hashes[i], []).append(i)
+            
+            rows = {row.chunk_index: row for row in DocumentChunk.query.filter_by(document_id=document_id)}
+            if self.dense_index is not None:
+                previous = self.dense_index.document_vectors(document_id)
+            else:
+                previous = self.document_embeddings.get(document_id, [])
+            encoder = self.embedding_model.batch_encoder(previous)
+            
+            stored = []
+            hashes = []
+            kept = set()
+            for batch in self._batched(chunks):
+                # Match each chunk to an unused stored chunk with the same content
+                plan = []
+                for chunk in batch:
+                    chunk_hash = self._chunk_hash(chunk)
+                    matches = available.get(chunk_hash)
+                    old_index = matches.pop() if matches else None
+                    plan.append((len(stored), chunk, old_index))
+                    stored.append(chunk)
+                    hashes.append(chunk_hash)
+                
+                with span(UPLOAD_STAGES, 'embed'):
+                    self._encode_plan(encoder, plan)
+                
+                with span(UPLOAD_STAGES, 'db_insert'):
+                    for position, chunk, old_index in plan:
+                        row = rows.get(old_index) if old_index is not None else None
+                        if row is None:
+                            db.session.add(DocumentChunk(content=chunk, chunk_index=position, document_id=document_id))
+                        elif row.chunk_index != position:
+                            row.chunk_index = position
+                        if old_index is not None:
+                            kept.add(old_index)
+                    db.session.flush()
+            
+            with span(UPLOAD_STAGES, 'embed'):
+                embeddings = encoder.finish()
+            
+            removed = [i for i in range(len(old_hashes)) if i not in kept]
+            with span(UPLOAD_STAGES, 'db_insert'):
+                for i in removed:
+                    if i in rows:
+                        db.session.delete(rows[i])
+                db.session.commit()
+            
+            if self.dense_index is not None:
+                self.dense_index.add(user_id, document_id, embeddings)
+            else:
+                self._remove_postings(document_id)
+                self.document_embeddings[document_id] = embeddings
+                self._add_postings(document_id, embeddings)
+            self.document_chunks[document_id] = stored
+            self.document_owners[document_id] = user_id
+            self.chunk_hashes[document_id] = hashes
+            with span(UPLOAD_STAGES, 'minhash'):
+                self._set_signatures(document_id, self.minhash.signatures(stored))
+            
+            with span(UPLOAD_STAGES, 'index_save'):
+                self._save_index()
+            
+            changes = {'chunks': len(stored), 'kept': len(kept),
+                       'embedded': len(stored) - len(kept), 'removed': len(removed)}
+            logging.info(f"Replaced document {document_id}: {changes}")
+            return changes
+            
+        except Exception as e:
+            logging.error(f"Error replacing document {document_id}: {e}")
+            db.session.rollback()
+            raise
+    
+    def _encode_plan(self, encoder: BatchEncoder, plan: List[tuple]):
+        """Feed a batch to the encoder in order, as runs of kept and new chunks"""
+        new_run = []
+        kept_run = []
+        for _, chunk, old_index in plan:
+            if old_index is None:
+                if kept_run:
+                    encoder.keep(kept_run)
+                    kept_run = []
+                new_run.append(chunk)
+            else:
+                if new_run:
+                    encoder.add(new_run)
+                    new_run = []
+                kept_run.append(old_index)
+        if kept_run:
+            encoder.keep(kept_run)
+        if new_run:
+            encoder.add(new_run)
+    
+    @_uses_index
     def remove_document(self, document_id: int):
         """Remove document from vector store"""
         try:
-            # Remove from embeddings and chunks
-            if document_id in self.document_embeddings:
-                del self.document_embeddings[document_id]
-            if document_id in self.document_chunks:
-                del self.document_chunks[document_id]
+            self._forget_document(document_id)
             
             # Remove chunks from database
             DocumentChunk.query.filter_by(document_id=document_id).delete()
@@ -197,88 +830,595 @@ class RAGEngine:
             db.session.rollback()
             raise
     
+    def _forget_document(self, document_id: int):
+        """Drop a document from the in-memory index only"""
+        self._remove_postings(document_id)
+        self.document_embeddings.pop(document_id, None)
+        self.document_chunks.pop(document_id, None)
+        self.document_owners.pop(document_id, None)
+        self.chunk_hashes.pop(document_id, None)
+        self.lsh_index.remove(document_id, self.chunk_signatures.pop(document_id, []))
+        if self.dense_index is not None:
+            self.dense_index.remove(document_id)
+    
+    @_uses_index
+    def reindex_documents(self, documents: Iterable[tuple], max_workers: int = 4) -> Iterator[Dict[str, Any]]:
+        """Re-embed already stored chunks, yielding a result per document as it finishes.
+
+        ``documents`` yields (document_id, user_id, chunks) and is consumed on
+        the calling thread while earlier documents are encoded on `max_workers`
+        threads, so it can stream rows from the database. No rows are written;
+        the index is saved once at the end. Results are ``{'document_id',
+        'chunks'}`` or ``{'document_id', 'error'}``.
+        """
+        def encode(chunks: List[str]):
+            encoder = self.embedding_model.batch_encoder()
+            for batch in self._batched(chunks):
+                encoder.add(batch)
+            return encoder.finish()
+        
+        indexed = 0
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+            futures = {}
+            for document_id, user_id, chunks in documents:
+                futures[executor.submit(encode, chunks)] = (document_id, user_id, chunks)
+            for future in as_completed(futures):
+                document_id, user_id, chunks = futures[future]
+                try:
+                    embeddings = future.result()
+                except Exception as e:
+                    logging.error(f"Error re-indexing document {document_id}: {e}")
+                    yield {'document_id': document_id, 'error': str(e)}
+                    continue
+                self._index_document(document_id, user_id, chunks, embeddings)
+                indexed += 1
+                yield {'document_id': document_id, 'chunks': len(chunks)}
+        
+        if indexed:
+            self._save_index()
+    
+    @_uses_index
+    def _get_user_documents(self, user_id: int) -> Dict[int, str]:
+        """Map indexed document ids owned by the user to their display names"""
+        if not self.document_chunks:
+            return {}
+        rows = db.session.query(Document.id, Document.original_filename).filter(
+            Document.user_id == user_id,
+            Document.id.in_(list(self.document_chunks.keys()))
+        ).all()
+        return {doc_id: name for doc_id, name in rows}
+    
+    def _score_sparse(self, query_embeddings: List[Dict[str, float]], documents: Dict[int, str], k: int) -> List[list]:
+        """Top k cosine scores of sparse query embeddings, through the postings of their terms.
+
+        Only documents sharing a query term are considered. Each gets an upper
+        bound from the largest weight of every query term in it; documents are
+        scored chunk by chunk in decreasing bound order until no remaining bound
+        can beat the k-th best score, so weakly matching documents are skipped
+        without touching their chunks. When fewer than k chunks share a term,
+        the rest are filled with zero-score chunks, see `_pad_unmatched`.
+        """
+        scored = []
+        for query_embedding in query_embeddings:
+            query_norm = sum(w * w for w in query_embedding.values()) ** 0.5
+            if query_norm == 0.0:
+                scored.append(self._pad_unmatched([], documents, k))
+                continue
+            
+            terms = [(term, weight) for term, weight in query_embedding.items() if term in self.postings]
+            bounds = {}
+            for term, weight in terms:
+                for doc_id, max_weight in self.term_bounds[term].items():
+                    if doc_id in documents:
+                        bounds[doc_id] = bounds.get(doc_id, 0.0) + weight * max_weight
+            
+            top = []  # min-heap of (dot product, -doc_id, -chunk_id)
+            for doc_id in sorted(bounds, key=bounds.get, reverse=True):
+                # The tolerance absorbs rounding, so ties are still scored and break as before
+                if len(top) >= k and bounds[doc_id] < top[0][0] - 1e-12:
+                    break
+                accumulated = {}
+                for term, weight in terms:
+                    for i, chunk_weight in self.postings[term].get(doc_id, ()):
+                        accumulated[i] = accumulated.get(i, 0.0) + weight * chunk_weight
+                for i, dot_product in accumulated.items():
+                    entry = (dot_product, -doc_id, -i)
+                    if len(top) < k:
+                        heapq.heappush(top, entry)
+                    elif entry > top[0]:
+                        heapq.heapreplace(top, entry)
+            
+            scored.append(self._pad_unmatched(
+                [(dot_product / query_norm, neg_doc_id, neg_i) for dot_product, neg_doc_id, neg_i in top], documents, k))
+        return scored
+    
+    def _pad_unmatched(self, entries: List[tuple], documents: Dict[int, str], k: int) -> List[tuple]:
+        """Fill scored entries up to k with zero-score chunks in document and chunk order.
+
+        The exhaustive scan this replaced scored every chunk, so chunks sharing
+        no query term still filled the top k at score 0 in that order.
+        """
+        if len(entries) >= k:
+            return entries
+        taken = {(-neg_doc_id, -neg_i) for _, neg_doc_id, neg_i in entries}
+        entries = list(entries)
+        for doc_id in sorted(documents):
+            for i in range(len(self.document_chunks.get(doc_id, ()))):
+                if (doc_id, i) not in taken:
+                    entries.append((0.0, -doc_id, -i))
+                    if len(entries) >= k:
+                        return entries
+        return entries
+    
+    def _score_dense(self, query_vectors, user_id: int, documents: Dict[int, str], k: int) -> List[list]:
+        """Top k matches per query from the user's dense vector matrix"""
+        matches = self.dense_index.search(user_id, query_vectors, k, allowed_doc_ids=documents.keys())
+        return [[(score, -doc_id, -i) for score, doc_id, i in query_matches
+                 if i < len(self.document_chunks.get(doc_id, []))]
+                for query_matches in matches]
+    
     def search_similar_chunks(self, query: str, user_id: int, k: int = 5) -> List[Dict[str, Any]]:
         """Search for similar chunks in user's documents"""
+        return self.search_similar_chunks_batch([query], user_id, k=k)[0]
+    
+    @_uses_index
+    def search_similar_chunks_batch(self, queries: List[str], user_id: int, k: int = 5) -> List[List[Dict[str, Any]]]:
+        """Search for the top k chunks of several queries in one pass over the user's documents"""
         try:
-            if not self.document_embeddings:
-                return []
+            if not self.document_chunks or not queries:
+                return [[] for _ in queries]
             
-            # Create query embedding
-            query_embedding = self.embedding_model.encode([query])[0]
+            # Encode all queries at once and check ownership with a single query
+            with span(ASK_STAGES, 'encode'):
+                query_embeddings = self.embedding_model.encode_queries(queries)
             
-            # Find similar chunks across all user documents
-            results = []
+            with span(ASK_STAGES, 'ownership'):
+                documents = self._get_user_documents(user_id)
             
-            for doc_id, chunk_embeddings in self.document_embeddings.items():
-                # Check if document belongs to user
-                document = Document.query.filter_by(id=doc_id, user_id=user_id).first()
-                if not document:
-                    continue
-                
-                chunks = self.document_chunks.get(doc_id, [])
+            # First pass: cheap scoring keeps a bounded candidate set per query. Without
+            # a reranker, collapsing near-duplicates only needs a little room beyond k
+            rerank = self.reranker is not None
+            if rerank:
+                fetch = max(k, self.candidate_k)
+            elif self.collapse_duplicates:
+                fetch = 2 * k
+            else:
+                fetch = k
+            results = self._first_pass(query_embeddings, user_id, documents, fetch)
+            
+            if self.collapse_duplicates:
+                fetched = [len(candidates) for candidates in results]
+                with span(ASK_STAGES, 'dedupe'):
+                    results = [self._collapse_duplicates(candidates, documents) for candidates in results]
                 
-                for i, chunk_embedding in enumerate(chunk_embeddings):
-                    if i < len(chunks):
-                        similarity = self.embedding_model.similarity(query_embedding, chunk_embedding)
-                        
-                        results.append({
-                            'content': chunks[i],
-                            'score': similarity,
-                            'document_id': doc_id,
-                            'document_name': document.original_filename,
-                            'chunk_id': i
-                        })
-            
-            # Sort by similarity score and return top k
-            results.sort(key=lambda x: x['score'], reverse=True)
-            return results[:k]
+                # Queries left with fewer than k results fetch twice as many candidates
+                # again, until they have k or run out of chunks
+                short = [q for q in range(len(queries)) if len(results[q]) < k and fetched[q] >= fetch]
+                while short and not rerank:
+                    fetch *= 2
+                    more = self._first_pass([query_embeddings[q] for q in short], user_id, documents, fetch)
+                    with span(ASK_STAGES, 'dedupe'):
+                        for q, candidates in zip(short, more):
+                            fetched[q] = len(candidates)
+                            results[q] = self._collapse_duplicates(candidates, documents)
+                    short = [q for q in short if len(results[q]) < k and fetched[q] >= fetch]
+            
+            # Second pass: re-rank only the candidates, within the time budget
+            if rerank:
+                with span(ASK_STAGES, 'rerank'):
+                    results = [rerank_candidates(self.reranker, query, candidates, k, self.rerank_budget)
+                               for query, candidates in zip(queries, results)]
+            else:
+                results = [candidates[:k] for candidates in results]
+            
+            # Term positions of the final hits only, for highlighted source snippets
+            with span(ASK_STAGES, 'highlight'):
+                for query, candidates in zip(queries, results):
+                    terms = set(tokenize(query))
+                    terms = (terms - STOPWORDS) or terms
+                    for chunk in candidates:
+                        chunk['matches'] = find_term_spans(chunk['content'], terms)
+            return results
             
         except Exception as e:
             logging.error(f"Error searching chunks: {e}")
-            return []
+            return [[] for _ in queries]
     
-    def answer_question(self, question: str, user_id: int) -> Dict[str, Any]:
-        """Generate answer using RAG approach"""
-        try:
-            # Search for relevant chunks
-            relevant_chunks = self.search_similar_chunks(question, user_id, k=5)
-            
-            if not relevant_chunks:
-                return {
-                    'answer': "**Answer not in context**\n\nI couldn't find relevant information in your uploaded documents to answer this question. Please make sure you have uploaded documents that contain information related to your query.",
-                    'context_documents': []
-                }
-            
-            # Prepare context for Gemini
+    def _first_pass(self, query_embeddings, user_id: int, documents: Dict[int, str],
+                    fetch: int) -> List[List[Dict[str, Any]]]:
+        """The best `fetch` chunks per query, best first"""
+        with span(ASK_STAGES, 'score'):
+            if self.dense_index is not None:
+                scored = self._score_dense(query_embeddings, user_id, documents, fetch)
+            else:
+                scored = self._score_sparse(query_embeddings, documents, fetch)
+        
+        # Select the top candidates per query without sorting everything
+        results = []
+        with span(ASK_STAGES, 'sort'):
+            for entries in scored:
+                results.append([
+                    {
+                        'content': self.document_chunks[-neg_doc_id][-neg_i],
+                        'score': score,
+                        'document_id': -neg_doc_id,
+                        'document_name': documents[-neg_doc_id],
+                        'chunk_id': -neg_i
+                    }
+                    for score, neg_doc_id, neg_i in heapq.nlargest(fetch, entries)
+                ])
+        return results
+    
+    def _collapse_duplicates(self, candidates: List[Dict[str, Any]], documents: Dict[int, str]) -> List[Dict[str, Any]]:
+        """Keep the best-scoring chunk of each near-duplicate group, with the other copies as its `duplicates`.
+
+        Candidates arrive best first. The copies of each kept chunk among the
+        user's documents are looked up in its LSH buckets, whether retrieved or
+        not, and candidates among them are dropped.
+        """
+        kept = []
+        covered = set()
+        for candidate in candidates:
+            ref = (candidate['document_id'], candidate['chunk_id'])
+            if ref in covered:
+                continue
+            candidate['duplicates'] = []
+            signatures = self.chunk_signatures.get(ref[0]) or []
+            signature = signatures[ref[1]] if ref[1] < len(signatures) else None
+            if signature is not None:
+                for doc_id, i in self.lsh_index.near_duplicates(signature, self.chunk_signatures, documents):
+                    if (doc_id, i) != ref and (doc_id, i) not in covered:
+                        covered.add((doc_id, i))
+                        candidate['duplicates'].append({'document_id': doc_id, 'document_name': documents[doc_id],
+                                                        'chunk_id': i})
+            kept.append(candidate)
+        return kept
+    
+    def _no_context_answer(self) -> Dict[str, Any]:
+        ANSWER_SOURCES.inc('no_context')
+        return {
+            'answer': "**Answer not in context**\n\nI couldn't find relevant information in your uploaded documents to answer this question. Please make sure you have uploaded documents that contain information related to your query.",
+            'context_documents': [],
+            'source': 'no_context'
+        }
+    
+    def _error_answer(self) -> Dict[str, Any]:
+        ANSWER_SOURCES.inc('error')
+        return {
+            'answer': "**Error Processing Question**\n\nI encountered an error while processing your question. Please try again or contact support if the issue persists.",
+            'context_documents': [],
+            'source': 'error'
+        }
+    
+    def _extract_answer(self, question: str, relevant_chunks: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        """An extractive answer when one clears the confidence threshold, else None"""
+        with span(ASK_STAGES, 'extract'):
+            extracted = self.extractor.extract(question, relevant_chunks)
+        if extracted is not None:
+            ANSWER_SOURCES.inc('extractive')
+            extracted['source'] = 'extractive'
+            extracted['context_documents'] = [self._citation(chunk) for chunk in extracted.pop('sources')]
+        return extracted
+    
+    def _chunk_pages(self, document_id: int, chunk_id: int) -> Optional[List[int]]:
+        """PDF pages a chunk covers, from the page markers in it and before it; None for other documents"""
+        chunks = self.document_chunks.get(document_id) or []
+        if chunk_id >= len(chunks):
+            return None
+        pages = [int(page) for page in PAGE_MARKER.findall(chunks[chunk_id])]
+        if not PAGE_MARKER.match(chunks[chunk_id].lstrip()):
+            # The chunk starts mid-page: that page is the last one marked before it
+            for previous in range(chunk_id - 1, -1, -1):
+                earlier = PAGE_MARKER.findall(chunks[previous])
+                if earlier:
+                    pages.insert(0, int(earlier[-1]))
+                    break
+        return sorted(set(pages)) or None
+    
+    def _citation(self, chunk: Dict[str, Any]) -> Dict[str, Any]:
+        """A cited source: document, chunk, pages, a snippet with highlight offsets and near-duplicate copies"""
+        snippet, highlights = make_snippet(chunk['content'], chunk.get('matches') or [], self.snippet_chars)
+        return {
+            'name': chunk['document_name'],
+            'score': chunk['score'],
+            'chunk_id': chunk['chunk_id'],
+            'pages': self._chunk_pages(chunk['document_id'], chunk['chunk_id']),
+            'snippet': snippet,
+            'highlights': highlights,
+            'also_in': [{'name': copy['document_name'], 'chunk_id': copy['chunk_id'],
+                         'pages': self._chunk_pages(copy['document_id'], copy['chunk_id'])}
+                        for copy in chunk.get('duplicates', [])]
+        }
+    
+    def _build_context(self, relevant_chunks: List[Dict[str, Any]]) -> tuple:
+        """Prompt context text and the cited documents for retrieved chunks"""
+        with span(ASK_STAGES, 'prompt'):
             context = "\n\n".join([chunk['content'] for chunk in relevant_chunks])
-            context_docs = [
-                {
-                    'name': chunk['document_name'],
-                    'score': chunk['score']
-                }
-                for chunk in relevant_chunks
-            ]
-            
-            # Generate answer using Gemini
-            answer = self.gemini_client.generate_answer(question, context)
-            
-            return {
-                'answer': answer,
-                'context_documents': context_docs
-            }
+            context_docs = [self._citation(chunk) for chunk in relevant_chunks]
+        return context, context_docs
+    
+    def _answer_without_llm(self, question: str, relevant_chunks: List[Dict[str, Any]],
+                            extractive: bool) -> Optional[Dict[str, Any]]:
+        """The no-context or extractive answer when one applies, else None"""
+        if not relevant_chunks:
+            return self._no_context_answer()
+        if extractive:
+            return self._extract_answer(question, relevant_chunks)
+        return None
+    
+    def _generate_from_chunks(self, question: str, relevant_chunks: List[Dict[str, Any]],
+                              extractive: bool = False) -> Dict[str, Any]:
+        """Build the prompt context from retrieved chunks and ask the generator"""
+        result = self._answer_without_llm(question, relevant_chunks, extractive)
+        if result is not None:
+            return result
+        
+        context, context_docs = self._build_context(relevant_chunks)
+        
+        with span(ASK_STAGES, 'generate'):
+            answer = self.generator.generate_answer(question, context)
+        ANSWER_SOURCES.inc('llm')
+        
+        return {
+            'answer': answer,
+            'context_documents': context_docs,
+            'source': 'llm'
+        }
+    
+    def answer_question(self, question: str, user_id: int, retrieval_query: Optional[str] = None,
+                        extractive: Optional[bool] = None) -> Dict[str, Any]:
+        """Generate answer using RAG approach.
+
+        ``retrieval_query`` replaces the question for the search step only, e.g.
+        a follow-up condensed with the chat history; the generator still sees the question.
+        ``extractive`` overrides EXTRACTIVE_ANSWERS for this question.
+        """
+        if extractive is None:
+            extractive = self.extractive
+        try:
+            with span(ASK_STAGES, 'total'):
+                # Search for relevant chunks
+                relevant_chunks = self.search_similar_chunks(retrieval_query or question, user_id, k=5)
+                return self._generate_from_chunks(question, relevant_chunks, extractive=extractive)
             
         except Exception as e:
             logging.error(f"Error answering question: {e}")
-            return {
-                'answer': "**Error Processing Question**\n\nI encountered an error while processing your question. Please try again or contact support if the issue persists.",
-                'context_documents': []
+            return self._error_answer()
+    
+    def stream_answer(self, question: str, user_id: int, retrieval_query: Optional[str] = None,
+                      extractive: Optional[bool] = None) -> Iterator[Dict[str, Any]]:
+        """Answer a question as a stream of events.
+
+        The first event carries the `context_documents` and answer `source`;
+        every later one an answer text piece as `delta`, in order.
+        """
+        if extractive is None:
+            extractive = self.extractive
+        relevant_chunks = self.search_similar_chunks(retrieval_query or question, user_id, k=5)
+        
+        # Answers that need no LLM call arrive as a single piece
+        result = self._answer_without_llm(question, relevant_chunks, extractive)
+        if result is not None:
+            yield {'context_documents': result['context_documents'], 'source': result['source']}
+            yield {'delta': result['answer']}
+            return
+        
+        context, context_docs = self._build_context(relevant_chunks)
+        yield {'context_documents': context_docs, 'source': 'llm'}
+        
+        start = time.perf_counter()
+        for piece in self.generator.stream_answer(question, context):
+            yield {'delta': piece}
+        ASK_STAGES.observe('generate', time.perf_counter() - start)
+        ANSWER_SOURCES.inc('llm')
+    
+    def answer_questions(self, questions: List[str], user_id: int, k: int = 5,
+                         max_workers: int = 4, rate_limit: Optional[float] = None,
+                         extractive: Optional[bool] = None) -> Iterator[Dict[str, Any]]:
+        """Answer many questions, yielding each result as soon as its answer is ready.
+
+        Retrieval for the whole batch happens in one pass; the generator calls are
+        then dispatched concurrently, starting at most `rate_limit` per second.
+        Every yielded dict carries the `index` of its question in `questions`.
+        Extractive answers never wait for the rate limit.
+        """
+        if extractive is None:
+            extractive = self.extractive
+        try:
+            batch_chunks = self.search_similar_chunks_batch(questions, user_id, k=k)
+        except Exception as e:
+            logging.error(f"Error retrieving chunks for batch: {e}")
+            batch_chunks = [[] for _ in questions]
+        
+        limiter = RateLimiter(rate_limit)
+        
+        def answer_one(question: str, relevant_chunks: List[Dict[str, Any]]) -> Dict[str, Any]:
+            if relevant_chunks and extractive:
+                extracted = self._extract_answer(question, relevant_chunks)
+                if extracted is not None:
+                    return extracted
+            if relevant_chunks:
+                limiter.wait()
+            return self._generate_from_chunks(question, relevant_chunks)
+        
+        executor = ThreadPoolExecutor(max_workers=max(1, max_workers))
+        try:
+            futures = {
+                executor.submit(answer_one, question, relevant_chunks): index
+                for index, (question, relevant_chunks) in enumerate(zip(questions, batch_chunks))
             }
+            for future in as_completed(futures):
+                index = futures[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    logging.error(f"Error answering batch question {index}: {e}")
+                    result = self._error_answer()
+                result['index'] = index
+                result['question'] = questions[index]
+                yield result
+        finally:
+            # Don't keep calling the LLM for a consumer that went away
+            executor.shutdown(wait=False, cancel_futures=True)
     
-    def get_index_stats(self) -> Dict[str, int]:
-        """Get statistics about the index"""
-        total_chunks = sum(len(chunks) for chunks in self.document_chunks.values())
+    async def _search_async(self, queries: List[str], user_id: int, k: int) -> List[List[Dict[str, Any]]]:
+        """Search on a worker thread, then end the read transaction so the LLM wait holds no pooled connection"""
+        def search():
+            try:
+                return self.search_similar_chunks_batch(queries, user_id, k=k)
+            finally:
+                db.session.commit()
+        return await asyncio.to_thread(search)
+    
+    async def aanswer_question(self, question: str, user_id: int, retrieval_query: Optional[str] = None,
+                               extractive: Optional[bool] = None) -> Dict[str, Any]:
+        """`answer_question` for the async server.
+
+        Retrieval runs on a worker thread and the generator call is awaited, so
+        a question waiting on the LLM holds no thread.
+        """
+        if extractive is None:
+            extractive = self.extractive
+        try:
+            with span(ASK_STAGES, 'total'):
+                relevant_chunks = (await self._search_async([retrieval_query or question], user_id, 5))[0]
+                result = self._answer_without_llm(question, relevant_chunks, extractive)
+                if result is not None:
+                    return result
+                
+                context, context_docs = self._build_context(relevant_chunks)
+                with span(ASK_STAGES, 'generate'):
+                    answer = await self.generator.agenerate_answer(question, context)
+                ANSWER_SOURCES.inc('llm')
+                return {'answer': answer, 'context_documents': context_docs, 'source': 'llm'}
+        
+        except Exception as e:
+            logging.error(f"Error answering question: {e}")
+            return self._error_answer()
+    
+    async def astream_answer(self, question: str, user_id: int, retrieval_query: Optional[str] = None,
+                             extractive: Optional[bool] = None) -> AsyncIterator[Dict[str, Any]]:
+        """`stream_answer` for the async server, with the same events"""
+        if extractive is None:
+            extractive = self.extractive
+        relevant_chunks = (await self._search_async([retrieval_query or question], user_id, 5))[0]
+        
+        result = self._answer_without_llm(question, relevant_chunks, extractive)
+        if result is not None:
+            yield {'context_documents': result['context_documents'], 'source': result['source']}
+            yield {'delta': result['answer']}
+            return
+        
+        context, context_docs = self._build_context(relevant_chunks)
+        yield {'context_documents': context_docs, 'source': 'llm'}
+        
+        start = time.perf_counter()
+        async for piece in self.generator.astream_answer(question, context):
+            yield {'delta': piece}
+        ASK_STAGES.observe('generate', time.perf_counter() - start)
+        ANSWER_SOURCES.inc('llm')
+    
+    async def aanswer_questions(self, questions: List[str], user_id: int, k: int = 5,
+                                max_concurrency: int = 4, rate_limit: Optional[float] = None,
+                                extractive: Optional[bool] = None) -> AsyncIterator[Dict[str, Any]]:
+        """`answer_questions` for the async server.
+
+        Generator calls are coroutines, at most `max_concurrency` in flight, instead
+        of a thread each.
+        """
+        if extractive is None:
+            extractive = self.extractive
+        try:
+            batch_chunks = await self._search_async(questions, user_id, k)
+        except Exception as e:
+            logging.error(f"Error retrieving chunks for batch: {e}")
+            batch_chunks = [[] for _ in questions]
+        
+        limiter = RateLimiter(rate_limit)
+        semaphore = asyncio.Semaphore(max(1, max_concurrency))
+        
+        async def answer_one(index: int, question: str, relevant_chunks: List[Dict[str, Any]]) -> Dict[str, Any]:
+            try:
+                result = self._answer_without_llm(question, relevant_chunks, extractive)
+                if result is None:
+                    async with semaphore:
+                        await limiter.await_slot()
+                        context, context_docs = self._build_context(relevant_chunks)
+                        answer = await self.generator.agenerate_answer(question, context)
+                    ANSWER_SOURCES.inc('llm')
+                    result = {'answer': answer, 'context_documents': context_docs, 'source': 'llm'}
+            except Exception as e:
+                logging.error(f"Error answering batch question {index}: {e}")
+                result = self._error_answer()
+            result['index'] = index
+            result['question'] = question
+            return result
+        
+        tasks = [asyncio.create_task(answer_one(index, question, relevant_chunks))
+                 for index, (question, relevant_chunks) in enumerate(zip(questions, batch_chunks))]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            # Don't keep calling the LLM for a consumer that went away
+            for task in tasks:
+                task.cancel()
+    
+    def answer_stats(self) -> Dict[str, Any]:
+        """Answers given since startup by source, and the share served without an LLM call"""
+        counts = ANSWER_SOURCES.values()
+        total = sum(counts.values())
+        grounded = counts.get('extractive', 0) + counts.get('llm', 0)
         return {
+            'answers': counts,
+            'without_llm_fraction': (total - counts.get('llm', 0)) / total if total else 0.0,
+            'extractive_fraction': counts.get('extractive', 0) / grounded if grounded else 0.0
+        }
+    
+    @_uses_index
+    def get_index_stats(self, detailed: bool = False) -> Dict[str, Any]:
+        """Get statistics about the index; `detailed` adds per-user and per-document breakdowns"""
+        total_chunks = sum(len(chunks) for chunks in self.document_chunks.values())
+        stats = {
             'total_chunks': total_chunks,
-            'total_documents': len(self.document_embeddings),
-            'embedding_type': 'TF-IDF'
+            'total_documents': len(self.document_chunks),
+            'embedding_type': 'TF-IDF' if self.embedding_model.name == SimpleEmbedding.name else self.embedding_model.name
         }
+        if self.dense_index is not None:
+            stats.update({f"dense_{key}": value for key, value in self.dense_index.stats().items()})
+        if not detailed:
+            return stats
+        
+        stats['index_bytes'] = sum(os.path.getsize(path) for path in (self.index_file, self.dense_index_file)
+                                   if os.path.exists(path))
+        if self.dense_index is None:
+            stats['terms'] = len(self.postings)
+            stats['postings'] = sum(len(chunks) for by_document in self.postings.values()
+                                    for chunks in by_document.values())
+        stats['lsh_buckets'] = len(self.lsh_index.buckets)
+        
+        documents = {}
+        users = {}
+        for doc_id, chunks in self.document_chunks.items():
+            user_id = self.document_owners.get(doc_id)
+            document = {
+                'user_id': user_id,
+                'chunks': len(chunks),
+                'chars': sum(len(chunk) for chunk in chunks),
+                'distinct_chunks': len(set(self.chunk_hashes.get(doc_id, ()))),
+            }
+            if self.dense_index is None:
+                embeddings = self.document_embeddings.get(doc_id, [])
+                document['embeddings'] = len(embeddings)
+                document['terms'] = len(set().union(*embeddings)) if embeddings else 0
+            else:
+                document['vectors'] = self.dense_index.document_size(doc_id)
+            documents[doc_id] = document
+            
+            user = users.setdefault(user_id, {'documents': 0, 'chunks': 0, 'chars': 0})
+            user['documents'] += 1
+            user['chunks'] += document['chunks']
+            user['chars'] += document['chars']
+        stats['users'] = users
+        stats['documents'] = documents
+        return stats
@@ -0,0 +1,143 @@
+import os
+import time
+import logging
+from typing import List, Dict, Any, Optional
+from utils import tokenize
+
+
+class Reranker:
+    """Second-stage scorer applied only to first-pass retrieval candidates"""
+    name = 'base'
+    batch_size = 16
+
+    def score(self, query: str, candidates: List[Dict[str, Any]], top_score: float) -> List[float]:
+        """Relevance scores for a batch of candidate chunks, higher is better"""
+        raise NotImplementedError
+
+
+class ProximityReranker(Reranker):
+    """Rewards chunks that cover more query terms, contain query phrases and keep the terms close together"""
+    name = 'proximity'
+
+    def __init__(self, retrieval_weight: float = 0.5, coverage_weight: float = 0.25,
+                 phrase_weight: float = 0.15, proximity_weight: float = 0.1):
+        self.retrieval_weight = retrieval_weight
+        self.coverage_weight = coverage_weight
+        self.phrase_weight = phrase_weight
+        self.proximity_weight = proximity_weight
+
+    def score(self, query: str, candidates: List[Dict[str, Any]], top_score: float) -> List[float]:
+        query_terms = tokenize(query)
+        if not query_terms:
+            return [candidate['score'] for candidate in candidates]
+
+        unique_terms = set(query_terms)
+        query_bigrams = set(zip(query_terms, query_terms[1:]))
+        scores = []
+
+        for candidate in candidates:
+            tokens = tokenize(candidate['content'])
+            positions: Dict[str, List[int]] = {}
+            for position, token in enumerate(tokens):
+                if token in unique_terms:
+                    positions.setdefault(token, []).append(position)
+
+            coverage = len(positions) / len(unique_terms)
+            phrase = 0.0
+            if query_bigrams:
+                chunk_bigrams = set(zip(tokens, tokens[1:]))
+                phrase = len(query_bigrams & chunk_bigrams) / len(query_bigrams)
+            proximity = 0.0
+            if len(positions) > 1:
+                proximity = len(positions) / self._min_window(positions)
+
+            retrieval = candidate['score'] / top_score if top_score > 0 else 0.0
+            scores.append(self.retrieval_weight * retrieval +
+                          self.coverage_weight * coverage +
+                          self.phrase_weight * phrase +
+                          self.proximity_weight * proximity)
+        return scores
+
+    def _min_window(self, positions: Dict[str, List[int]]) -> int:
+        """Length of the shortest token window containing every matched term"""
+        events = sorted((position, term) for term, term_positions in positions.items()
+                        for position in term_positions)
+        counts: Dict[str, int] = {}
+        best = events[-1][0] - events[0][0] + 1
+        left = 0
+        for position, term in events:
+            counts[term] = counts.get(term, 0) + 1
+            while len(counts) == len(positions):
+                left_position, left_term = events[left]
+                best = min(best, position - left_position + 1)
+                counts[left_term] -= 1
+                if not counts[left_term]:
+                    del counts[left_term]
+                left += 1
+        return best
+
+
+class CrossEncoderReranker(Reranker):
+    """Local CPU cross-encoder that reads the query and chunk together"""
+    name = 'cross-encoder'
+
+    def __init__(self, model_name: Optional[str] = None):
+        try:
+            from sentence_transformers import CrossEncoder
+        except ImportError as e:
+            raise ImportError("The 'cross-encoder' reranker requires the sentence-transformers package") from e
+
+        self.model_name = model_name or os.environ.get("RERANKER_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+        self.model = CrossEncoder(self.model_name, device='cpu')
+
+    def score(self, query: str, candidates: List[Dict[str, Any]], top_score: float) -> List[float]:
+        pairs = [(query, candidate['content']) for candidate in candidates]
+        return [float(score) for score in self.model.predict(pairs, batch_size=self.batch_size,
+                                                             show_progress_bar=False)]
+
+
+RERANKERS = {
+    ProximityReranker.name: ProximityReranker,
+    CrossEncoderReranker.name: CrossEncoderReranker,
+}
+
+
+def create_reranker(name: Optional[str] = None) -> Optional[Reranker]:
+    """Instantiate the reranker selected by name or RERANKER; 'none', the default, disables re-ranking"""
+    name = name or os.environ.get("RERANKER", "none")
+    if name == 'none':
+        return None
+    if name not in RERANKERS:
+        raise ValueError(f"Unknown reranker: {name}")
+    return RERANKERS[name]()
+
+
+def rerank_candidates(reranker: Reranker, query: str, candidates: List[Dict[str, Any]],
+                      k: int, budget: float) -> List[Dict[str, Any]]:
+    """Re-order first-pass candidates and return the top k.
+
+    Candidates are scored in first-pass order, a batch at a time, until the
+    time budget (seconds) runs out. Anything left unscored keeps its first-pass
+    order behind the re-ranked ones, so a slow reranker degrades to plain
+    first-pass retrieval instead of failing the request.
+    """
+    if not candidates:
+        return candidates
+
+    deadline = time.perf_counter() + budget
+    top_score = candidates[0]['score']
+    scored = []
+
+    for start in range(0, len(candidates), reranker.batch_size):
+        if time.perf_counter() > deadline:
+            logging.info(f"Rerank budget exhausted after {start} of {len(candidates)} candidates")
+            break
+        batch = candidates[start:start + reranker.batch_size]
+        scored.extend(zip(reranker.score(query, batch, top_score), batch))
+
+    ranked = []
+    for score, candidate in sorted(scored, key=lambda item: item[0], reverse=True):
+        candidate['rerank_score'] = score
+        ranked.append(candidate)
+    ranked.extend(candidates[len(scored):])
+    return ranked[:k]
@@ -1,19 +1,34 @@
 import os
 import json
 import logging
-from flask import render_template, request, redirect, url_for, flash, jsonify, session, current_app
+from datetime import datetime
+from flask import render_template, request, redirect, url_for, flash, jsonify, session, current_app, Response, stream_with_context
 from flask_login import login_user, logout_user, login_required, current_user
 from werkzeug.utils import secure_filename
 from werkzeug.security import generate_password_hash
+from sqlalchemy import and_, or_
+from sqlalchemy.engine import Row
+from sqlalchemy.orm import load_only
 from app import app, db
 from models import User, Document, ChatSession, ChatMessage
 from document_processor import DocumentProcessor
 from rag_engine import RAGEngine
 from utils import allowed_file, get_file_type
+from metrics import span, collect_timings, render_metrics, ASK_STAGES
+from conversation import ConversationCache, build_state
 
 # Initialize processors
 document_processor = DocumentProcessor()
 rag_engine = RAGEngine()
+conversations = ConversationCache(app.config['CONVERSATION_CACHE_SIZE'])
+
+@app.template_filter('fromjson')
+def fromjson_filter(value):
+    """Parse a JSON column (e.g. ChatMessage.context_used) inside templates"""
+    try:
+        return json.loads(value) if value else []
+    except (TypeError, ValueError):
+        return []
 
 @app.route('/')
 def index():
@@ -107,111 +122,240 @@ def logout():
 @app.route('/chat')
 @login_required
 def chat():
-    # Get user's chat sessions
-    chat_sessions = ChatSession.query.filter_by(user_id=current_user.id).order_by(ChatSession.updated_at.desc()).all()
+    # Only the first page of each list is rendered; the rest is fetched by infinite scroll
+    chat_sessions, sessions_cursor = _keyset_page(
+        ChatSession.query.filter_by(user_id=current_user.id),
+        ChatSession.updated_at, ChatSession.id, None, current_app.config['CHAT_SESSIONS_PAGE'])
     
-    # Get current session or create new one
-    session_id = request.args.get('session_id')
+    # A new chat is only stored once its first question is asked
+    current_session = None
+    session_id = request.args.get('session_id', type=int)
     if session_id:
-        current_session = ChatSession.query.filter_by(id=session_id, user_id=current_user.id).first()
-        if not current_session:
-            current_session = ChatSession(user_id=current_user.id)
-            db.session.add(current_session)
-            db.session.commit()
-    else:
-        current_session = ChatSession(user_id=current_user.id)
-        db.session.add(current_session)
-        db.session.commit()
+        current_session = next((s for s in chat_sessions if s.id == session_id), None) or \
+            ChatSession.query.filter_by(id=session_id, user_id=current_user.id).first()
     
-    # Get messages for current session
-    messages = ChatMessage.query.filter_by(session_id=current_session.id).order_by(ChatMessage.timestamp.asc()).all()
+    # Get the latest page of messages for the current session, oldest first
+    messages, messages_cursor = [], None
+    if current_session:
+        messages, messages_cursor = _keyset_page(
+            ChatMessage.query.filter_by(session_id=current_session.id),
+            ChatMessage.timestamp, ChatMessage.id, None, current_app.config['CHAT_MESSAGES_PAGE'])
+        messages.reverse()
     
-    # Get user's documents
-    documents = Document.query.filter_by(user_id=current_user.id, processed=True).all()
+    # Get user's documents, without their text; the total comes with the page as a window count
+    rows, documents_cursor = _keyset_page(
+        _documents_query(current_user.id).add_columns(db.func.count().over().label('total')),
+        Document.upload_time, Document.id, None, current_app.config['DOCUMENTS_PAGE'])
+    documents = [document for document, _ in rows]
+    document_count = rows[0].total if rows else 0
     
     return render_template('chat.html', 
                          chat_sessions=chat_sessions,
+                         sessions_cursor=sessions_cursor,
                          current_session=current_session,
                          messages=messages,
-                         documents=documents)
+                         messages_cursor=messages_cursor,
+                         documents=documents,
+                         documents_cursor=documents_cursor,
+                         document_count=document_count)
+
+def _documents_query(user_id):
+    return Document.query.options(load_only(Document.id, Document.original_filename, Document.file_type,
+                                            Document.file_size, Document.upload_time)) \
+        .filter_by(user_id=user_id, processed=True)
+
+def _encode_cursor(timestamp, row_id):
+    return f"{timestamp.isoformat()}_{row_id}"
+
+def _decode_cursor(cursor):
+    """Parse a cursor from _encode_cursor; raises ValueError if it is malformed"""
+    timestamp, row_id = cursor.rsplit('_', 1)
+    return datetime.fromisoformat(timestamp), int(row_id)
+
+def _keyset_page(query, time_column, id_column, cursor, limit):
+    """Newest-first page of rows strictly older than the cursor, plus the cursor of the next page.
+
+    Rows are ordered by (time_column, id_column) so ties on the timestamp are
+    still paged exactly once, and each page is a single indexed range scan
+    however deep into the history it is.
+    """
+    if cursor:
+        timestamp, row_id = _decode_cursor(cursor)
+        query = query.filter(or_(time_column < timestamp,
+                                 and_(time_column == timestamp, id_column < row_id)))
+    rows = query.order_by(time_column.desc(), id_column.desc()).limit(limit + 1).all()
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    last = rows[-1]
+    if isinstance(last, Row):
+        # Pages with extra columns, like a window count, carry the entity first
+        last = last[0]
+    return rows, _encode_cursor(getattr(last, time_column.key), getattr(last, id_column.key))
+
+def _page_args():
+    """The cursor and clamped page size of a listing request"""
+    limit = request.args.get('limit', 50, type=int)
+    return request.args.get('cursor') or None, max(1, min(limit, 100))
+
+@app.route('/api/sessions')
+@login_required
+def list_sessions():
+    """Chat sessions by most recent activity, one keyset page at a time"""
+    cursor, limit = _page_args()
+    try:
+        sessions, next_cursor = _keyset_page(ChatSession.query.filter_by(user_id=current_user.id),
+                                             ChatSession.updated_at, ChatSession.id, cursor, limit)
+    except ValueError:
+        return jsonify({'error': 'Invalid cursor'}), 400
+    
+    return jsonify({
+        'sessions': [{
+            'id': s.id,
+            'name': s.session_name,
+            'updated_at': s.updated_at.isoformat()
+        } for s in sessions],
+        'next_cursor': next_cursor
+    })
+
+@app.route('/api/sessions/<int:session_id>/messages')
+@login_required
+def list_messages(session_id):
+    """A page of a session's messages, newest page first and oldest-first within the page"""
+    chat_session = ChatSession.query.filter_by(id=session_id, user_id=current_user.id).first()
+    if not chat_session:
+        return jsonify({'error': 'Session not found'}), 404
+    
+    cursor, limit = _page_args()
+    try:
+        messages, next_cursor = _keyset_page(ChatMessage.query.filter_by(session_id=session_id),
+                                             ChatMessage.timestamp, ChatMessage.id, cursor, limit)
+    except ValueError:
+        return jsonify({'error': 'Invalid cursor'}), 400
+    
+    context_docs = {m.id: fromjson_filter(m.context_used) for m in messages}
+    return jsonify({
+        'messages': [{
+            'id': m.id,
+            'type': m.message_type,
+            'content': m.content,
+            'timestamp': m.timestamp.isoformat(),
+            'context_count': len(context_docs[m.id]),
+            'context_documents': context_docs[m.id]
+        } for m in reversed(messages)],
+        'next_cursor': next_cursor
+    })
+
+@app.route('/api/documents')
+@login_required
+def list_documents():
+    """The user's processed documents, newest uploads first, one keyset page at a time"""
+    cursor, limit = _page_args()
+    try:
+        documents, next_cursor = _keyset_page(_documents_query(current_user.id),
+                                              Document.upload_time, Document.id, cursor, limit)
+    except ValueError:
+        return jsonify({'error': 'Invalid cursor'}), 400
+    
+    return jsonify({
+        'documents': [{
+            'id': d.id,
+            'filename': d.original_filename,
+            'file_type': d.file_type,
+            'size': d.file_size,
+            'upload_time': d.upload_time.isoformat()
+        } for d in documents],
+        'next_cursor': next_cursor
+    })
 
 @app.route('/upload', methods=['POST'])
 @login_required
 def upload_file():
+    """Save the uploaded files and index them in parallel, streaming one JSON line per file as it finishes"""
     try:
         if 'files' not in request.files:
             return jsonify({'error': 'No files selected'}), 400
         
-        files = request.files.getlist('files')
-        uploaded_files = []
+        files = [file for file in request.files.getlist('files') if file and file.filename != '']
+        for file in files:
+            if not allowed_file(file.filename):
+                return jsonify({'error': f'File type not allowed: {file.filename}'}), 400
         
+        documents = []
         for file in files:
-            if file.filename == '':
-                continue
+            filename = secure_filename(file.filename)
+            file_path = os.path.join(current_app.config['UPLOAD_FOLDER'], 
+                                   f"{current_user.id}_{filename}")
             
-            if file and allowed_file(file.filename):
-                filename = secure_filename(file.filename)
-                file_path = os.path.join(current_app.config['UPLOAD_FOLDER'], 
-                                       f"{current_user.id}_{filename}")
-                
-                # Save file
-                file.save(file_path)
-                file_size = os.path.getsize(file_path)
-                
-                # Create document record
-                document = Document(
-                    filename=f"{current_user.id}_{filename}",
-                    original_filename=filename,
-                    file_path=file_path,
-                    file_type=get_file_type(filename),
-                    file_size=file_size,
-                    user_id=current_user.id
-                )
-                
-                db.session.add(document)
-                db.session.commit()
-                
-                # Process document in background (simplified for demo)
-                try:
-                    text_content = document_processor.extract_text(file_path, document.file_type)
-                    document.text_content = text_content
-                    
-                    # Create chunks and embeddings
-                    chunks = document_processor.create_chunks(text_content)
-                    document.chunk_count = len(chunks)
-                    
-                    # Store in vector database
-                    rag_engine.add_document(document.id, chunks)
-                    
-                    document.processed = True
-                    db.session.commit()
-                    
-                    uploaded_files.append({
-                        'id': document.id,
-                        'filename': document.original_filename,
-                        'size': document.file_size,
-                        'processed': True
-                    })
-                    
-                except Exception as e:
-                    logging.error(f"Document processing error: {e}")
-                    document.processed = False
-                    db.session.commit()
-                    uploaded_files.append({
-                        'id': document.id,
-                        'filename': document.original_filename,
-                        'size': document.file_size,
-                        'processed': False,
-                        'error': str(e)
-                    })
-            else:
-                return jsonify({'error': f'File type not allowed: {file.filename}'}), 400
+            # Save file
+            file.save(file_path)
+            file_size = os.path.getsize(file_path)
+            
+            # Create document record
+            document = Document(
+                filename=f"{current_user.id}_{filename}",
+                original_filename=filename,
+                file_path=file_path,
+                file_type=get_file_type(filename),
+                file_size=file_size,
+                user_id=current_user.id
+            )
+            db.session.add(document)
+            documents.append(document)
+        db.session.commit()
         
-        return jsonify({'files': uploaded_files})
+        # Plain values, since the body is produced after this request's database session is closed
+        uploads = {document.id: (document.file_path, document.file_type, document.original_filename, document.file_size)
+                   for document in documents}
         
     except Exception as e:
         logging.error(f"Upload error: {e}")
         return jsonify({'error': 'Upload failed'}), 500
+    
+    user_id = current_user.id
+    max_workers = current_app.config['UPLOAD_WORKERS']
+    
+    def generate():
+        # Only a preview of each document is kept; the chunks hold the full text
+        previews = {doc_id: [] for doc_id in uploads}
+        
+        def chunk_source(doc_id):
+            file_path, file_type = uploads[doc_id][:2]
+            return lambda: document_processor.iter_chunks(file_path, file_type, preview=previews[doc_id])
+        
+        processed = 0
+        try:
+            documents = {document.id: document for document in Document.query.filter(Document.id.in_(list(uploads)))}
+            results = rag_engine.add_documents([(doc_id, chunk_source(doc_id)) for doc_id in uploads], user_id,
+                                               max_workers=max_workers)
+            for result in results:
+                doc_id = result['document_id']
+                _, _, filename, file_size = uploads[doc_id]
+                if 'error' not in result:
+                    # The chunks are committed by now; a file is reported processed only once its record is too
+                    document = documents[doc_id]
+                    document.chunk_count = result['chunks']
+                    document.text_content = "".join(previews[doc_id])
+                    document.processed = True
+                    try:
+                        db.session.commit()
+                    except Exception as e:
+                        logging.error(f"Error saving document {doc_id}: {e}")
+                        db.session.rollback()
+                        result = {'error': 'Failed to save document'}
+                line = {'id': doc_id, 'filename': filename, 'size': file_size, 'processed': 'error' not in result}
+                if 'error' in result:
+                    line['error'] = result['error']
+                else:
+                    processed += 1
+                yield json.dumps(line) + "\n"
+            
+            yield json.dumps({'done': True, 'files': len(uploads), 'processed': processed}) + "\n"
+        except Exception as e:
+            logging.error(f"Document processing error: {e}")
+            yield json.dumps({'error': 'Upload processing failed'}) + "\n"
+    
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
 
 @app.route('/ask', methods=['POST'])
 @login_required
@@ -224,27 +368,136 @@ def ask_question():
         if not question:
             return jsonify({'error': 'Question is required'}), 400
         
-        # Get or create chat session
-        chat_session = ChatSession.query.filter_by(id=session_id, user_id=current_user.id).first()
-        if not chat_session:
-            chat_session = ChatSession(user_id=current_user.id)
-            db.session.add(chat_session)
-            db.session.commit()
+        debug = bool(data.get('debug')) or current_app.config['DEBUG_TIMINGS']
+        conversational = bool(data.get('conversational'))
+        extractive = _extractive_flag(data)
         
-        # Save user message
-        user_message = ChatMessage(
-            content=question,
-            message_type='user',
-            session_id=chat_session.id
-        )
-        db.session.add(user_message)
+        with collect_timings(debug) as timings:
+            chat_session, state, retrieval_query = _start_turn(question, session_id, conversational)
+            # Save the question now so no write transaction stays open while the LLM answers
+            db.session.commit()
+
+            # Get answer from RAG engine
+            response_data = rag_engine.answer_question(question, current_user.id, retrieval_query=retrieval_query,
+                                                       extractive=extractive)
+            answer = response_data['answer']
+            context_docs = response_data.get('context_documents', [])
+            
+            assistant_message = _finish_turn(chat_session, state, question, answer, context_docs)
         
-        # Get answer from RAG engine
-        response_data = rag_engine.answer_question(question, current_user.id)
-        answer = response_data['answer']
-        context_docs = response_data.get('context_documents', [])
+        return jsonify(_ask_response(question, retrieval_query, response_data, assistant_message, timings))
         
-        # Save assistant message
+    except Exception as e:
+        logging.error(f"Question answering error: {e}")
+        return jsonify({'error': 'Failed to process question'}), 500
+
+@app.route('/ask/stream', methods=['POST'])
+@login_required
+def ask_stream():
+    """Answer a question as JSON lines: the context documents, answer text deltas, then the saved ids"""
+    data = request.get_json(silent=True) or {}
+    question = data.get('question')
+    if not question:
+        return jsonify({'error': 'Question is required'}), 400
+    
+    try:
+        chat_session, state, retrieval_query = _start_turn(question, data.get('session_id'),
+                                                           bool(data.get('conversational')))
+        # The body is produced after this request's database session is closed, so save the question now
+        db.session.commit()
+        session_id = chat_session.id
+    except Exception as e:
+        logging.error(f"Question answering error: {e}")
+        return jsonify({'error': 'Failed to process question'}), 500
+    
+    user_id = current_user.id
+    extractive = _extractive_flag(data)
+    
+    def generate():
+        pieces = []
+        context_docs = []
+        try:
+            for event in rag_engine.stream_answer(question, user_id, retrieval_query=retrieval_query,
+                                                  extractive=extractive):
+                if 'delta' in event:
+                    pieces.append(event['delta'])
+                else:
+                    context_docs = event['context_documents']
+                    if retrieval_query != question:
+                        event['retrieval_query'] = retrieval_query
+                yield json.dumps(event) + "\n"
+            
+            chat_session = db.session.get(ChatSession, session_id)
+            assistant_message = _finish_turn(chat_session, state, question, "".join(pieces), context_docs)
+            yield json.dumps({'done': True, 'message_id': assistant_message.id, 'session_id': session_id}) + "\n"
+        except Exception as e:
+            logging.error(f"Streaming answer error: {e}")
+            db.session.rollback()
+            yield json.dumps({'error': 'Failed to process question'}) + "\n"
+    
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+def _ask_response(question, retrieval_query, response_data, assistant_message, timings):
+    """The /ask JSON body for an answered and saved question"""
+    response = {
+        'answer': response_data['answer'],
+        'context_documents': response_data.get('context_documents', []),
+        'message_id': assistant_message.id,
+        'session_id': assistant_message.session_id,
+        'source': response_data.get('source')
+    }
+    if retrieval_query != question:
+        response['retrieval_query'] = retrieval_query
+    if timings is not None:
+        response['timings'] = {stage: round(ms, 3) for stage, ms in timings.items()}
+    return response
+
+def _extractive_flag(data):
+    """The request's `extractive` override, or None to use EXTRACTIVE_ANSWERS"""
+    extractive = data.get('extractive')
+    return None if extractive is None else bool(extractive)
+
+def _start_turn(question, session_id, conversational):
+    """Get or create the chat session, condense the question and stage the user message.
+
+    Returns the session, its conversation state (None unless conversational)
+    and the retrieval query.
+    """
+    with span(ASK_STAGES, 'session'):
+        chat_session = None
+        if session_id:
+            chat_session = ChatSession.query.filter_by(id=session_id, user_id=current_user.id).first()
+        is_new_session = not chat_session
+        if is_new_session:
+            chat_session = ChatSession(user_id=current_user.id)
+            db.session.add(chat_session)
+            db.session.commit()
+    
+    # Condense the follow-up with the cached conversation state
+    state = None
+    retrieval_query = question
+    if conversational:
+        with span(ASK_STAGES, 'condense'):
+            state = conversations.get(chat_session.id, chat_session.updated_at)
+            if state is None:
+                history = [] if is_new_session else _recent_messages(chat_session.id)
+                state = build_state(history,
+                                    turns=current_app.config['CONVERSATION_TURNS'],
+                                    token_budget=current_app.config['CONVERSATION_TOKEN_BUDGET'])
+            retrieval_query = state.condense(question)
+    
+    # Save user message
+    user_message = ChatMessage(
+        content=question,
+        message_type='user',
+        session_id=chat_session.id
+    )
+    db.session.add(user_message)
+    return chat_session, state, retrieval_query
+
+def _finish_turn(chat_session, state, question, answer, context_docs):
+    """Save the assistant message and move the session and its conversation state forward"""
+    with span(ASK_STAGES, 'save'):
         assistant_message = ChatMessage(
             content=answer,
             message_type='assistant',
@@ -254,18 +507,59 @@ def ask_question():
         db.session.add(assistant_message)
         
         # Update session timestamp
-        chat_session.updated_at = db.func.now()
+        updated_at = datetime.utcnow()
+        chat_session.updated_at = updated_at
         db.session.commit()
-        
-        return jsonify({
-            'answer': answer,
-            'context_documents': context_docs,
-            'message_id': assistant_message.id
-        })
-        
-    except Exception as e:
-        logging.error(f"Question answering error: {e}")
-        return jsonify({'error': 'Failed to process question'}), 500
+    
+    if state is not None:
+        state.add_turn(question)
+        conversations.put(chat_session.id, updated_at, state)
+    return assistant_message
+
+def _recent_messages(session_id):
+    """The session's last CONVERSATION_TURNS questions, oldest first"""
+    messages = ChatMessage.query.filter_by(session_id=session_id, message_type='user') \
+        .order_by(ChatMessage.id.desc()).limit(current_app.config['CONVERSATION_TURNS']).all()
+    return messages[::-1]
+
+def _batch_error(questions):
+    """Why a batch of questions is rejected, or None"""
+    if not isinstance(questions, list) or not questions:
+        return 'A non-empty list of questions is required'
+    if not all(isinstance(question, str) and question.strip() for question in questions):
+        return 'Every question must be a non-empty string'
+    max_questions = current_app.config['BATCH_MAX_QUESTIONS']
+    if len(questions) > max_questions:
+        return f'At most {max_questions} questions per batch'
+    return None
+
+@app.route('/ask_batch', methods=['POST'])
+@login_required
+def ask_batch():
+    """Answer a list of questions, streaming one JSON line per answer as it completes"""
+    data = request.get_json(silent=True) or {}
+    questions = data.get('questions')
+    error = _batch_error(questions)
+    if error:
+        return jsonify({'error': error}), 400
+    
+    user_id = current_user.id
+    max_workers = current_app.config['LLM_MAX_CONCURRENCY']
+    rate_limit = current_app.config['LLM_RATE_LIMIT']
+    extractive = _extractive_flag(data)
+    
+    def generate():
+        try:
+            for result in rag_engine.answer_questions(questions, user_id,
+                                                      max_workers=max_workers,
+                                                      rate_limit=rate_limit,
+                                                      extractive=extractive):
+                yield json.dumps(result) + "\n"
+        except Exception as e:
+            logging.error(f"Batch question answering error: {e}")
+            yield json.dumps({'error': 'Failed to process batch'}) + "\n"
+    
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
 
 @app.route('/new_session', methods=['POST'])
 @login_required
@@ -314,6 +608,70 @@ def delete_document(doc_id):
         logging.error(f"Delete document error: {e}")
         return jsonify({'error': 'Failed to delete document'}), 500
 
+@app.route('/replace_document/<int:doc_id>', methods=['POST'])
+@login_required
+def replace_document(doc_id):
+    """Upload a new version of a document, re-indexing only the chunks that changed"""
+    try:
+        document = Document.query.filter_by(id=doc_id, user_id=current_user.id).first()
+        if not document:
+            return jsonify({'error': 'Document not found'}), 404
+        
+        file = request.files.get('file')
+        if not file or file.filename == '':
+            return jsonify({'error': 'No file selected'}), 400
+        if not allowed_file(file.filename):
+            return jsonify({'error': f'File type not allowed: {file.filename}'}), 400
+        
+        filename = secure_filename(file.filename)
+        file_path = os.path.join(current_app.config['UPLOAD_FOLDER'], f"{current_user.id}_{filename}")
+        file_type = get_file_type(filename)
+        
+        # Process the new version before it overwrites anything
+        temp_path = os.path.join(current_app.config['UPLOAD_FOLDER'], f"{current_user.id}_{doc_id}_new_{filename}")
+        file.save(temp_path)
+        try:
+            preview = []
+            chunks = document_processor.iter_chunks(temp_path, file_type, preview=preview)
+            changes = rag_engine.replace_document(doc_id, chunks, user_id=current_user.id)
+        except Exception:
+            os.remove(temp_path)
+            raise
+        
+        if document.file_path != file_path and os.path.exists(document.file_path):
+            os.remove(document.file_path)
+        os.replace(temp_path, file_path)
+        
+        document.filename = f"{current_user.id}_{filename}"
+        document.original_filename = filename
+        document.file_path = file_path
+        document.file_type = file_type
+        document.file_size = os.path.getsize(file_path)
+        document.text_content = "".join(preview)
+        document.chunk_count = changes['chunks']
+        document.processed = True
+        db.session.commit()
+        
+        return jsonify({
+            'id': document.id,
+            'filename': document.original_filename,
+            'size': document.file_size,
+            'processed': True,
+            'changes': changes
+        })
+        
+    except Exception as e:
+        logging.error(f"Replace document error: {e}")
+        return jsonify({'error': 'Failed to replace document'}), 500
+
+@app.route('/metrics')
+def metrics():
+    """Expose stage latency histograms in the Prometheus text format"""
+    token = current_app.config['METRICS_TOKEN']
+    if token and request.headers.get('Authorization') != f"Bearer {token}":
+        return Response("Unauthorized\n", status=401, mimetype='text/plain')
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
 @app.errorhandler(404)
 def not_found(error):
     return render_template('404.html'), 404
@@ -50,11 +50,11 @@ function validateFileUpload(event) {
     const file = event.target.files[0];
     if (!file) return;
     
-    const maxSize = 16 * 1024 * 1024; // 16MB
+    const maxSize = Number(document.body.dataset.maxUploadBytes) || 16 * 1024 * 1024;
     const allowedTypes = ['application/pdf', 'application/vnd.openxmlformats-officedocument.wordprocessingml.document', 'text/plain'];
     
     if (file.size > maxSize) {
-        showAlert('File size must be less than 16MB', 'error');
+        showAlert(`File size must be less than ${Math.round(maxSize / (1024 * 1024))}MB`, 'error');
         event.target.value = '';
         return false;
     }
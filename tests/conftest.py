@@ -0,0 +1,106 @@
+"""Shared fixtures: a scratch working directory and SQLite database, set up before the app is imported"""
+import os
+import sys
+import uuid
+import tempfile
+
+import pytest
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+WORK_DIR = tempfile.mkdtemp(prefix="askscribe-tests-")
+os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(WORK_DIR, "test.db")
+os.environ["LLM_BACKEND"] = "local"
+os.environ.setdefault("SESSION_SECRET", "test-secret")
+
+from app import app, db, init_db  # noqa: E402
+
+init_db()
+
+
+@pytest.fixture
+def app_context():
+    """An app context around the whole test, for calling the engine directly.
+
+    Tests that make requests shouldn't use it: requests would share its `g`,
+    and with it Flask-Login's cached user.
+    """
+    with app.app_context():
+        yield app
+        db.session.rollback()
+
+
+def _stored(row):
+    """Commit a new row in its own app context and return it detached, with its columns loaded"""
+    with app.app_context():
+        db.session.add(row)
+        db.session.commit()
+        db.session.refresh(row)
+        db.session.expunge(row)
+    return row
+
+
+@pytest.fixture
+def make_user():
+    from models import User
+
+    def make(password: str = "password"):
+        name = f"user-{uuid.uuid4().hex[:12]}"
+        user = User(username=name, email=f"{name}@example.com")
+        user.set_password(password)
+        return _stored(user)
+    return make
+
+
+@pytest.fixture
+def make_document():
+    from models import Document
+
+    def make(user_id: int, name: str = "doc.txt"):
+        return _stored(Document(filename=name, original_filename=name, file_path=os.path.join(WORK_DIR, name),
+                                file_type=name.rsplit('.', 1)[-1], file_size=1, processed=True, user_id=user_id))
+    return make
+
+
+@pytest.fixture
+def make_engine(tmp_path):
+    from rag_engine import RAGEngine
+    from generators import LocalGenerator
+
+    def make(**kwargs):
+        kwargs.setdefault('index_file', str(tmp_path / "index.json"))
+        kwargs.setdefault('generator', LocalGenerator())
+        return RAGEngine(**kwargs)
+    return make
+
+
+@pytest.fixture
+def engine(make_engine, monkeypatch):
+    """A scratch engine serving the app's routes"""
+    import routes
+    engine = make_engine()
+    monkeypatch.setattr(routes, 'rag_engine', engine)
+    return engine
+
+
+@pytest.fixture
+def login():
+    import routes  # noqa: F401  registers the routes
+
+    def make_client(user):
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session['_user_id'] = str(user.id)
+        return client
+    return make_client
+
+
+@pytest.fixture
+def upload_folder(tmp_path, monkeypatch):
+    """A scratch upload folder for routes that save files"""
+    folder = tmp_path / "uploads"
+    folder.mkdir()
+    monkeypatch.setitem(app.config, 'UPLOAD_FOLDER', str(folder))
+    return folder
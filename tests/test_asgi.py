@@ -0,0 +1,166 @@
+"""Drives asgi.application directly with fake `receive` and `send` callables"""
+import json
+import time
+import asyncio
+
+from app import app, db
+from models import ChatMessage
+from generators import LocalGenerator
+from asgi import application
+
+BOUNDARY = "askscribe-test-boundary"
+
+
+def call(method, path, body=b"", headers=(), cookie=None, chunk_size=None, disconnect_after_first_line=False):
+    """Run one request through the ASGI app; returns (status, headers, body pieces)"""
+    async def main():
+        sent = []
+        first_line = asyncio.Event()
+        size = chunk_size or max(len(body), 1)
+        parts = [body[i:i + size] for i in range(0, len(body), size)] or [b""]
+        messages = [{'type': 'http.request', 'body': part, 'more_body': i < len(parts) - 1}
+                    for i, part in enumerate(parts)]
+
+        async def receive():
+            if messages:
+                return messages.pop(0)
+            if disconnect_after_first_line:
+                await first_line.wait()
+            else:
+                await asyncio.Event().wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            sent.append(message)
+            if message['type'] == 'http.response.body' and message.get('body'):
+                first_line.set()
+
+        request_headers = [(name.encode('latin-1'), value.encode('latin-1')) for name, value in headers]
+        if cookie:
+            request_headers.append((b'cookie', f"session={cookie}".encode('latin-1')))
+        scope = {'type': 'http', 'http_version': '1.1', 'method': method, 'scheme': 'http', 'path': path,
+                 'root_path': '', 'query_string': b'', 'headers': request_headers,
+                 'client': ('127.0.0.1', 50000), 'server': ('testserver', 80)}
+        await asyncio.wait_for(application(scope, receive, send), timeout=10)
+        return sent
+
+    sent = asyncio.run(main())
+    start = sent[0]
+    assert start['type'] == 'http.response.start'
+    assert all(message['type'] == 'http.response.body' for message in sent[1:])
+    if not disconnect_after_first_line:
+        # The last message closes the body
+        assert not sent[-1].get('more_body')
+    headers = {name.decode('latin-1'): value.decode('latin-1') for name, value in start['headers']}
+    return start['status'], headers, [message['body'] for message in sent[1:] if message.get('body')]
+
+
+def session_cookie(login, user):
+    return login(user).get_cookie('session').value
+
+
+def json_body(payload):
+    return json.dumps(payload).encode(), [('content-type', 'application/json')]
+
+
+def multipart(files):
+    lines = []
+    for name, content in files:
+        lines += [f"--{BOUNDARY}".encode(),
+                  f'Content-Disposition: form-data; name="files"; filename="{name}"'.encode(),
+                  b"Content-Type: text/plain", b"", content]
+    lines += [f"--{BOUNDARY}--".encode(), b""]
+    return b"\r\n".join(lines), [('content-type', f"multipart/form-data; boundary={BOUNDARY}")]
+
+
+def ndjson(pieces):
+    return [json.loads(line) for line in b"".join(pieces).decode().splitlines()]
+
+
+def indexed_user(make_user, make_document, engine):
+    user = make_user()
+    with app.app_context():
+        engine.add_document(make_document(user.id).id,
+                            ["Invoices are due within thirty days. Late payments accrue interest.",
+                             "The office moves to the harbour district in autumn."], user_id=user.id)
+    return user
+
+
+def test_get_page_runs_the_flask_app():
+    status, headers, body = call('GET', '/login')
+    assert status == 200
+    assert headers['content-type'].startswith('text/html')
+    assert int(headers['content-length']) == len(b"".join(body))
+    assert b"<form" in b"".join(body)
+
+
+def test_post_upload_body_streams_into_the_flask_app(make_user, login, engine, upload_folder):
+    user = make_user()
+    text = b"Quarterly revenue grew in every region.\n" * 200
+    body, headers = multipart([("first.txt", text), ("second.txt", text + b"Costs fell.\n")])
+
+    status, headers, pieces = call('POST', '/upload', body, headers + [('content-length', str(len(body)))],
+                                   cookie=session_cookie(login, user), chunk_size=1000)
+
+    assert status == 200 and headers['content-type'] == 'application/x-ndjson'
+    lines = ndjson(pieces)
+    assert sorted(line['filename'] for line in lines[:-1]) == ["first.txt", "second.txt"]
+    assert all(line['processed'] for line in lines[:-1])
+    assert lines[-1] == {'done': True, 'files': 2, 'processed': 2}
+    assert sorted(path.name for path in upload_folder.iterdir()) == [f"{user.id}_first.txt", f"{user.id}_second.txt"]
+
+
+def test_question_endpoints_require_login():
+    body, headers = json_body({'question': "when are invoices due"})
+    status, headers, _ = call('POST', '/ask', body, headers)
+    assert status == 302 and '/login' in headers['location']
+
+
+def test_ask_stream_sends_ndjson_events(make_user, make_document, login, engine):
+    user = indexed_user(make_user, make_document, engine)
+    body, headers = json_body({'question': "when are invoices due"})
+
+    status, headers, pieces = call('POST', '/ask/stream', body, headers, cookie=session_cookie(login, user))
+
+    assert status == 200 and headers['content-type'] == 'application/x-ndjson'
+    events = ndjson(pieces)
+    assert events[0]['source'] == 'llm' and events[0]['context_documents']
+    assert "".join(event['delta'] for event in events[1:-1]).startswith("**Answer**")
+    assert events[-1]['done'] is True
+    with app.app_context():
+        saved = db.session.get(ChatMessage, events[-1]['message_id'])
+        assert saved.message_type == 'assistant' and saved.content.startswith("**Answer**")
+
+
+def test_client_disconnect_cancels_the_stream(make_user, make_document, login, engine):
+    user = indexed_user(make_user, make_document, engine)
+    engine.generator = LocalGenerator(tokens_per_second=10)  # about 2 seconds for the whole answer
+    body, headers = json_body({'question': "when are invoices due"})
+    with app.app_context():
+        messages_before = ChatMessage.query.count()
+
+    start = time.perf_counter()
+    status, _, pieces = call('POST', '/ask/stream', body, headers, cookie=session_cookie(login, user),
+                             disconnect_after_first_line=True)
+
+    assert status == 200
+    assert time.perf_counter() - start < 1.0
+    assert not any(event.get('done') for event in ndjson(pieces))
+    with app.app_context():
+        # Only the question was saved; the unfinished answer was not
+        assert ChatMessage.query.count() == messages_before + 1
+
+
+def test_oversized_bodies_are_rejected(make_user, login, engine, monkeypatch):
+    monkeypatch.setitem(app.config, 'MAX_CONTENT_LENGTH', 1000)
+    cookie = session_cookie(login, make_user())
+
+    body, headers = json_body({'question': "invoices " * 200})
+    status, _, pieces = call('POST', '/ask', body, headers, cookie=cookie, chunk_size=300)
+    assert status == 413 and json.loads(b"".join(pieces)) == {'error': 'Request too large'}
+
+    # Flask enforces the limit on the other routes from the declared length, as a browser form sends it
+    body = b"username=" + b"x" * 2000 + b"&password=secret"
+    status, _, _ = call('POST', '/login', body, [('content-type', 'application/x-www-form-urlencoded'),
+                                                 ('content-length', str(len(body)))], chunk_size=300)
+    assert status == 413
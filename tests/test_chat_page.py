@@ -0,0 +1,52 @@
+from sqlalchemy import event
+
+from app import app, db
+from models import ChatSession, ChatMessage
+
+
+def count_statements(client, url):
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', record)
+    try:
+        response = client.get(url)
+    finally:
+        event.remove(engine, 'before_cursor_execute', record)
+    return response, statements
+
+
+def test_chat_page_runs_one_query_per_list(make_user, make_document, login, monkeypatch):
+    monkeypatch.setitem(app.config, 'DOCUMENTS_PAGE', 2)
+    user = make_user()
+    for i in range(3):
+        make_document(user.id, f"doc{i}.txt")
+    with app.app_context():
+        chat_session = ChatSession(user_id=user.id)
+        db.session.add(chat_session)
+        db.session.flush()
+        db.session.add(ChatMessage(content="hello", message_type='user', session_id=chat_session.id))
+        db.session.commit()
+        session_id = chat_session.id
+    client = login(user)
+
+    response, statements = count_statements(client, f"/chat?session_id={session_id}")
+    assert response.status_code == 200
+    # The user, then one page each of sessions, messages and documents with their total
+    assert len(statements) == 4, statements
+    assert "Documents (3)" in response.get_data(as_text=True)
+
+
+def test_deleted_user_is_logged_out_on_next_request(make_user, login):
+    user = make_user()
+    client = login(user)
+    assert client.get('/chat').status_code == 200
+
+    with app.app_context():
+        db.session.delete(db.session.merge(user))
+        db.session.commit()
+    assert client.get('/chat').status_code == 302
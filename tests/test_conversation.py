@@ -0,0 +1,32 @@
+import pytest
+
+import routes
+from app import app
+from utils import tokenize
+
+
+@pytest.mark.parametrize('extractive', [False, True])
+@pytest.mark.parametrize('cached', [True, False])
+def test_follow_up_query_holds_no_answer_words(make_user, make_document, engine, login, extractive, cached):
+    user = make_user()
+    document = make_document(user.id)
+    with app.app_context():
+        engine.add_document(document.id, [
+            "The invoice number is INV 12345 issued in March.",
+            "Annual revenue grew to 4 million euros.",
+        ], user_id=user.id)
+    client = login(user)
+
+    first = client.post('/ask', json={'question': "What is the invoice number?", 'conversational': True,
+                                      'extractive': extractive}).json
+    assert first['context_documents']
+    if not cached:
+        # Rebuilt from the stored messages instead
+        routes.conversations.discard(first['session_id'])
+
+    follow_up = client.post('/ask', json={'question': "and revenue?", 'conversational': True,
+                                          'session_id': first['session_id'], 'extractive': extractive}).json
+    query_terms = set(tokenize(follow_up['retrieval_query']))
+    assert {'invoice', 'number', 'revenue'} <= query_terms
+    assert query_terms <= set(tokenize("What is the invoice number? and revenue?"))
+    assert not query_terms & {'answer', 'extracted', 'documents', 'inv', '12345', 'issued'}
@@ -0,0 +1,56 @@
+import zipfile
+
+from document_processor import DocumentProcessor
+
+_DOCUMENT = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"
+            xmlns:mc="http://schemas.openxmlformats.org/markup-compatibility/2006">
+<w:body>
+  <w:p><w:r><w:t>Quarterly report</w:t></w:r></w:p>
+  <w:p><w:r><w:t xml:space="preserve">Revenue </w:t></w:r><w:r><w:tab/><w:t>grew</w:t><w:br/><w:t>again</w:t></w:r></w:p>
+  <w:p/>
+  <w:tbl>
+    <w:tr>
+      <w:tc><w:tcPr><w:gridSpan w:val="2"/></w:tcPr><w:p><w:r><w:t>Region totals</w:t></w:r></w:p></w:tc>
+      <w:tc><w:tcPr><w:vMerge w:val="restart"/></w:tcPr><w:p><w:r><w:t>Audited</w:t></w:r></w:p></w:tc>
+    </w:tr>
+    <w:tr>
+      <w:tc><w:p><w:r><w:t>North</w:t></w:r></w:p></w:tc>
+      <w:tc><w:p><w:r><w:t>120</w:t></w:r></w:p><w:p><w:r><w:t>units</w:t></w:r></w:p></w:tc>
+      <w:tc><w:tcPr><w:vMerge/></w:tcPr><w:p/></w:tc>
+    </w:tr>
+    <w:tr>
+      <w:tc><w:p><w:r><w:t>South</w:t></w:r></w:p></w:tc>
+      <w:tc><w:p/></w:tc>
+      <w:tc><w:tcPr><w:vMerge w:val="continue"/></w:tcPr><w:p><w:r><w:t>Audited</w:t></w:r></w:p></w:tc>
+    </w:tr>
+  </w:tbl>
+  <w:p>
+    <w:r>
+      <mc:AlternateContent>
+        <mc:Choice Requires="wps"><w:t>Text box</w:t></mc:Choice>
+        <mc:Fallback><w:t>Text box copy</w:t></mc:Fallback>
+      </mc:AlternateContent>
+    </w:r>
+  </w:p>
+  <w:p><w:r><w:t>Closing note</w:t></w:r></w:p>
+</w:body>
+</w:document>"""
+
+
+def test_docx_extraction_keeps_document_order_and_skips_repeats(tmp_path):
+    path = tmp_path / "report.docx"
+    with zipfile.ZipFile(path, 'w') as archive:
+        archive.writestr('word/document.xml', _DOCUMENT)
+
+    segments = list(DocumentProcessor().iter_text(str(path), 'docx'))
+
+    assert segments == [
+        "Quarterly report",
+        "Revenue \tgrew\nagain",
+        "Region totals Audited",
+        "North 120\nunits",
+        "South",
+        "Text box",
+        "Closing note",
+    ]
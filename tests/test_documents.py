@@ -0,0 +1,116 @@
+import io
+import json
+
+from app import app, db
+from models import Document, DocumentChunk
+from document_processor import DocumentProcessor
+
+REPORT = "\n\n".join(
+    f"Section {n}. " + " ".join(f"paragraph{n} covers topic{n} item{i} in detail." for i in range(25))
+    for n in range(4)
+)
+
+
+def test_replace_document_route_updates_rows_index_and_record(make_user, make_document, login, engine,
+                                                              upload_folder, tmp_path):
+    user = make_user()
+    document = make_document(user.id, "report.txt")
+    with app.app_context():
+        engine.add_document(document.id, txt_chunks(tmp_path, REPORT), user_id=user.id)
+    client = login(user)
+
+    revised = REPORT.replace("Section 2.", "Section 2 (revised).")
+    response = client.post(f"/replace_document/{document.id}",
+                           data={'file': (io.BytesIO(revised.encode()), "report.txt")},
+                           content_type='multipart/form-data')
+
+    assert response.status_code == 200
+    changes = response.get_json()['changes']
+    assert changes['chunks'] == len(txt_chunks(tmp_path, revised))
+    assert 0 < changes['embedded'] < changes['chunks'] and changes['kept'] == changes['chunks'] - changes['embedded']
+    with app.app_context():
+        record = db.session.get(Document, document.id)
+        rows = DocumentChunk.query.filter_by(document_id=document.id).order_by(DocumentChunk.chunk_index).all()
+        assert record.chunk_count == changes['chunks'] and record.processed
+        assert [row.content for row in rows] == engine.document_chunks[document.id] == txt_chunks(tmp_path, revised)
+        assert [row.chunk_index for row in rows] == list(range(len(rows)))
+    assert sorted(path.name for path in upload_folder.iterdir()) == [f"{user.id}_report.txt"]
+
+
+def txt_chunks(tmp_path, text):
+    """The chunks the upload path makes of a text file"""
+    path = tmp_path / "chunks.txt"
+    path.write_text(text)
+    return list(DocumentProcessor().iter_chunks(str(path), 'txt'))
+
+
+def test_add_documents_extracts_on_the_calling_thread_and_commits_each_document(app_context, make_user,
+                                                                                 make_document, make_engine):
+    import threading
+    user = make_user()
+    engine = make_engine()
+    documents = [make_document(user.id) for _ in range(3)]
+    extracted_on = []
+
+    def source(text):
+        def chunks():
+            extracted_on.append(threading.get_ident())
+            return [text, text + " again"]
+        return chunks
+
+    def broken():
+        raise ValueError("Failed to extract text from PDF: broken file")
+
+    pending = [(documents[0].id, source("invoice total due")), (documents[1].id, broken),
+               (documents[2].id, source("payment terms"))]
+    results = {}
+    with db.engine.connect() as connection:
+        for result in engine.add_documents(pending, user.id, max_workers=2):
+            results[result['document_id']] = result
+            if 'chunks' in result:
+                # Visible outside this session as soon as it is reported
+                count = connection.exec_driver_sql("SELECT COUNT(*) FROM document_chunk WHERE document_id = ?",
+                                                   (result['document_id'],)).scalar()
+                assert count == result['chunks'] == 2
+                assert result['document_id'] in engine.document_chunks
+
+    assert extracted_on == [threading.get_ident()] * 2
+    assert results[documents[1].id] == {'document_id': documents[1].id,
+                                        'error': "Failed to extract text from PDF: broken file"}
+    assert DocumentChunk.query.filter_by(document_id=documents[1].id).count() == 0
+    reloaded = make_engine()
+    reloaded.load_index()
+    assert set(reloaded.document_chunks) == {documents[0].id, documents[2].id}
+
+
+def _upload(client, files):
+    response = client.post("/upload", data={'files': [(io.BytesIO(content), name) for name, content in files]},
+                           content_type='multipart/form-data')
+    assert response.status_code == 200
+    return [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+
+def test_upload_reports_files_processed_only_once_committed(make_user, login, engine, upload_folder, monkeypatch):
+    user = make_user()
+    client = login(user)
+
+    lines = _upload(client, [("notes.txt", REPORT.encode()), ("broken.pdf", b"not a pdf")])
+    by_name = {line['filename']: line for line in lines if 'filename' in line}
+    assert by_name['notes.txt']['processed'] is True
+    assert by_name['broken.pdf']['processed'] is False and by_name['broken.pdf']['error']
+    assert lines[-1] == {'done': True, 'files': 2, 'processed': 1}
+    with app.app_context():
+        record = db.session.get(Document, by_name['notes.txt']['id'])
+        assert record.processed and record.chunk_count == len(engine.document_chunks[record.id])
+
+    # A record that fails to commit is reported as failed, not processed
+    commit = db.session.commit
+
+    def failing_commit():
+        if any(isinstance(row, Document) and row.processed for row in db.session.dirty):
+            raise RuntimeError("database is locked")
+        commit()
+    monkeypatch.setattr(db.session, 'commit', failing_commit)
+    lines = _upload(client, [("other.txt", REPORT.encode())])
+    assert lines[0]['processed'] is False and lines[0]['error'] == 'Failed to save document'
+    assert lines[-1] == {'done': True, 'files': 1, 'processed': 0}
@@ -0,0 +1,56 @@
+from types import SimpleNamespace
+
+import pytest
+
+from gemini_client import GeminiClient
+from prompts import PROMPT_TEMPLATES, PROMPT_V1
+
+
+class FakeGenai:
+    """Records cache creations and the config of each generate call"""
+
+    def __init__(self):
+        self.created = []
+        self.configs = []
+        self.caches = SimpleNamespace(create=self._create)
+        self.models = SimpleNamespace(generate_content=self._generate)
+
+    def _create(self, model, config):
+        self.created.append(config)
+        return SimpleNamespace(name=f"cachedContents/{len(self.created)}")
+
+    def _generate(self, model, contents, config):
+        self.configs.append(config)
+        return SimpleNamespace(text="An answer.", usage_metadata=None)
+
+
+@pytest.fixture(autouse=True)
+def default_environment(monkeypatch):
+    for name in ('PROMPT_VERSION', 'PROMPT_INSTRUCTIONS_FILE', 'GEMINI_PROMPT_CACHE', 'GEMINI_CACHE_MIN_TOKENS'):
+        monkeypatch.delenv(name, raising=False)
+
+
+def test_default_prompt_is_v1_and_shipped_prompts_stay_inline():
+    fake = FakeGenai()
+    client = GeminiClient(client=fake)
+    assert client.prompt is PROMPT_V1
+    assert all(template.system_tokens < client.cache_min_tokens for template in PROMPT_TEMPLATES.values())
+
+    client.generate_answer("What is the total?", "The total is 300 euros.")
+    assert fake.created == []
+    assert fake.configs[0].system_instruction == PROMPT_V1.system
+
+
+def test_large_system_prompt_is_cached_once(tmp_path):
+    instructions = tmp_path / "instructions.txt"
+    instructions.write_text("\n".join(f"- Term {i}: defined as house glossary entry number {i}." for i in range(200)))
+    fake = FakeGenai()
+    client = GeminiClient(client=fake, instructions_file=str(instructions))
+    assert client.prompt.system_tokens >= client.cache_min_tokens
+
+    client.generate_answer("What is the total?", "The total is 300 euros.")
+    client.generate_answer("Who issued it?", "Issued by Acme.")
+    assert len(fake.created) == 1
+    assert fake.created[0].system_instruction == client.prompt.system
+    assert [config.cached_content for config in fake.configs] == ["cachedContents/1"] * 2
+    assert all(config.system_instruction is None for config in fake.configs)
@@ -0,0 +1,46 @@
+from app import db
+from models import Document
+from index_cli import compact_index, rebuild_index
+
+
+def test_compact_cleans_postings_and_term_bounds(app_context, make_user, make_document, make_engine):
+    user = make_user()
+    kept = make_document(user.id)
+    deleted = make_document(user.id)
+    engine = make_engine()
+    engine.add_document(kept.id, ["invoice total due", "payment terms"], user_id=user.id)
+    engine.add_document(deleted.id, ["invoice number issued"], user_id=user.id)
+
+    # A deleted Document row, plus dead entries left by an earlier partial removal
+    Document.query.filter_by(id=deleted.id).delete()
+    db.session.commit()
+    engine.postings['ghost'] = {}
+    engine.term_bounds['ghost'] = {kept.id: 0.5}
+    engine.term_bounds['payment'][deleted.id] = 0.9
+
+    dry_run = compact_index(engine, dry_run=True)
+    assert dry_run['removed_documents'] == [deleted.id]
+    assert dry_run['cleaned_terms'] == 2
+
+    result = compact_index(engine)
+    assert result['removed_documents'] == [deleted.id]
+    assert 'ghost' not in engine.postings and 'ghost' not in engine.term_bounds
+    assert set(engine.term_bounds) == set(engine.postings)
+    for term, postings in engine.postings.items():
+        assert postings and set(engine.term_bounds[term]) == set(postings)
+    assert 'issued' not in engine.postings and 'issued' not in engine.term_bounds
+    assert [chunk['document_id'] for chunk in engine.search_similar_chunks("invoice", user.id, k=1)] == [kept.id]
+
+
+def test_rebuild_of_a_deleted_document_saves_its_removal(app_context, make_user, make_document, make_engine):
+    user = make_user()
+    deleted = make_document(user.id)
+    engine = make_engine()
+    engine.add_document(deleted.id, ["invoice number issued"], user_id=user.id)
+    Document.query.filter_by(id=deleted.id).delete()
+    db.session.commit()
+
+    result = rebuild_index(engine, [deleted.id], workers=1)
+
+    assert result['rebuilt'] == [] and result['removed'] == [deleted.id]
+    assert deleted.id not in make_engine().document_chunks
@@ -0,0 +1,67 @@
+import pytest
+
+fitz = pytest.importorskip("fitz")
+
+from page_classifier import PageClassifier  # noqa: E402
+
+
+def _scan(text: str, dpi: int):
+    """A bitmap of rendered text, as a scanner would produce it"""
+    source = fitz.open()
+    page = source.new_page()
+    page.insert_textbox(page.rect + (72, 72, -72, -72), text, fontsize=11)
+    pixmap = page.get_pixmap(dpi=dpi, colorspace=fitz.csGRAY)
+    source.close()
+    return pixmap
+
+
+def _blank_image(width: int, height: int):
+    image = fitz.Pixmap(fitz.csRGB, fitz.IRect(0, 0, width, height))
+    image.clear_with(200)
+    return image
+
+
+@pytest.fixture
+def doc():
+    document = fitz.open()
+    yield document
+    document.close()
+
+
+def test_pages_without_text_are_ocrd_when_they_hold_a_sizeable_image(doc):
+    classifier = PageClassifier(min_dpi=72, default_dpi=150, max_dpi=200, max_pixels=4_000_000)
+    text = "Quarterly revenue grew in every region. " * 20
+
+    doc.new_page()  # blank
+    logo_only = doc.new_page()
+    logo_only.insert_image(fitz.Rect(20, 20, 60, 60), pixmap=_blank_image(40, 40))
+    half_scan = doc.new_page()
+    half_scan.insert_image(fitz.Rect(90, 200, 520, 560), pixmap=_scan(text, 150))
+    full_scan = doc.new_page()
+    full_scan.insert_image(full_scan.rect, pixmap=_scan(text, 150))
+    prose = doc.new_page()
+    prose.insert_textbox(prose.rect + (72, 72, -72, -72), text, fontsize=11)
+
+    # Page objects go stale as pages are added; classify fresh ones
+    modes = [classifier.classify(doc[i])['mode'] for i in range(len(doc))]
+    assert modes == ['skip', 'skip', 'ocr', 'ocr', 'text']
+
+
+def test_ocr_resolution_follows_the_scan_within_the_configured_range(doc, monkeypatch):
+    text = "Payment terms are net thirty days. " * 20
+    for dpi in (50, 120, 600):
+        page = doc.new_page()
+        page.insert_image(page.rect, pixmap=_scan(text, dpi))
+
+    for name in ("OCR_MIN_DPI", "OCR_DEFAULT_DPI", "OCR_MAX_DPI", "OCR_MAX_PIXELS"):
+        monkeypatch.delenv(name, raising=False)
+    classifier = PageClassifier()
+    assert [classifier.classify(doc[i])['dpi'] for i in range(3)] == [72, 120, 200]
+
+    # An A4 page at 300 dpi is about 8.7 megapixels, over the cap
+    monkeypatch.setenv("OCR_MAX_DPI", "300")
+    monkeypatch.setenv("OCR_MAX_PIXELS", "6000000")
+    capped = PageClassifier().classify(doc[2])['dpi']
+    assert capped < 300
+    width, height = doc[2].rect.width / 72.0, doc[2].rect.height / 72.0
+    assert width * height * capped * capped <= 6_000_000
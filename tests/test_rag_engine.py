@@ -0,0 +1,255 @@
+import os
+import json
+import zlib
+
+import pytest
+
+from rag_engine import EmbeddingBackend, SimpleEmbedding
+from generators import LocalGenerator
+from utils import tokenize
+
+
+class HashingEmbedding(EmbeddingBackend):
+    """Tiny dense backend: hashed bag of words, unit length"""
+    name = 'hashing'
+    dense = True
+    dimension = 32
+
+    def encode(self, texts):
+        import numpy as np
+        vectors = np.zeros((len(texts), self.dimension), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for token in tokenize(text):
+                vectors[row, zlib.crc32(token.encode('utf-8')) % self.dimension] += 1.0
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.where(norms == 0, 1.0, norms)
+
+    def encode_queries(self, texts):
+        return self.encode(texts)
+
+
+def test_dense_reencode_recovers_owners_missing_from_old_index(app_context, make_user, make_document, make_engine):
+    user = make_user()
+    document = make_document(user.id)
+    engine = make_engine(embedding_model=HashingEmbedding())
+    engine.add_document(document.id, ["quarterly revenue grew", "the office moved"], user_id=user.id)
+
+    # An index written before owners were stored, without dense vectors yet
+    with open(engine.index_file) as f:
+        data = json.load(f)
+    data.pop('owners')
+    with open(engine.index_file, 'w') as f:
+        json.dump(data, f)
+    os.remove(engine.dense_index_file)
+
+    reloaded = make_engine(embedding_model=HashingEmbedding())
+    results = reloaded.search_similar_chunks("quarterly revenue", user.id, k=1)
+    assert [(chunk['document_id'], chunk['chunk_id']) for chunk in results] == [(document.id, 0)]
+    assert reloaded.document_owners == {document.id: user.id}
+
+
+def test_first_pass_ranks_like_exhaustive_scan_without_reranker(app_context, make_user, make_document, make_engine,
+                                                                monkeypatch):
+    monkeypatch.delenv('RERANKER', raising=False)
+    user = make_user()
+    chunk_sets = [
+        ["invoice total due in march", "payment terms are net thirty days", "the weather was sunny"],
+        ["invoice number issued on request", "office relocation plans"],
+    ]
+    engine = make_engine()
+    assert engine.reranker is None
+    document_ids = []
+    for chunks in chunk_sets:
+        document = make_document(user.id)
+        engine.add_document(document.id, chunks, user_id=user.id)
+        document_ids.append(document.id)
+
+    query = engine.embedding_model.encode_queries(["invoice payment"])[0]
+    exhaustive = sorted(
+        ((engine.embedding_model.similarity(query, embedding), doc_id, i)
+         for doc_id in document_ids for i, embedding in enumerate(engine.document_embeddings[doc_id])),
+        key=lambda entry: (-round(entry[0], 9), entry[1], entry[2]))
+    results = engine.search_similar_chunks("invoice payment", user.id, k=4)
+
+    assert [(chunk['document_id'], chunk['chunk_id']) for chunk in results] == \
+        [(doc_id, i) for _, doc_id, i in exhaustive[:4]]
+    # Chunks sharing no query term still fill the top k, at score 0 in document order
+    assert [chunk['score'] for chunk in results[3:]] == [0.0]
+    assert (results[3]['document_id'], results[3]['chunk_id']) == (document_ids[0], 2)
+
+
+def test_collapsing_fetches_a_small_multiple_of_k_and_tops_up(app_context, make_user, make_document, make_engine,
+                                                               monkeypatch):
+    monkeypatch.delenv('RERANKER', raising=False)
+    monkeypatch.setenv('COLLAPSE_DUPLICATES', 'true')
+    user = make_user()
+    # Four versions of one report; later paragraphs match "invoice" less and less
+    paragraphs = [" ".join(["invoice"] + [f"filler{p}word{w}" for w in range(4 + 3 * p)]) for p in range(5)]
+    engine = make_engine()
+    for _ in range(4):
+        engine.add_document(make_document(user.id).id, paragraphs, user_id=user.id)
+
+    fetches = []
+    score_sparse = engine._score_sparse
+
+    def spy(query_embeddings, documents, k):
+        fetches.append(k)
+        return score_sparse(query_embeddings, documents, k)
+    monkeypatch.setattr(engine, '_score_sparse', spy)
+
+    results = engine.search_similar_chunks("invoice", user.id, k=3)
+    # 2k candidates hold copies of two paragraphs only, so one top-up of 4k follows
+    assert fetches == [6, 12]
+    assert [chunk['content'] for chunk in results] == paragraphs[:3]
+    assert all(len(chunk['duplicates']) == 3 for chunk in results)
+
+    fetches.clear()
+    results = engine.search_similar_chunks("invoice", user.id, k=1)
+    assert fetches == [2]
+    assert [chunk['content'] for chunk in results] == paragraphs[:1]
+
+
+_PARAGRAPHS = [
+    "invoice total due in march for the consulting work",
+    "payment terms are net thirty days from the invoice date",
+    "late payments accrue interest at two percent per month",
+    "the office relocation is planned for the autumn",
+    "quarterly revenue grew across every region this year",
+]
+A, B, C, D, E = _PARAGRAPHS
+
+
+def _rounded(value):
+    if isinstance(value, float):
+        return round(value, 9)
+    if isinstance(value, dict):
+        return {key: _rounded(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_rounded(item) for item in value]
+    return value
+
+
+def _document_state(engine, document_id):
+    """Everything the index and the database hold for one document"""
+    from models import DocumentChunk
+    rows = DocumentChunk.query.filter_by(document_id=document_id).order_by(DocumentChunk.chunk_index).all()
+    if engine.dense_index is not None:
+        embeddings = engine.dense_index.document_vectors(document_id).tolist()
+    else:
+        embeddings = engine.document_embeddings[document_id]
+    return _rounded({
+        'rows': [(row.chunk_index, row.content) for row in rows],
+        'chunks': engine.document_chunks[document_id],
+        'hashes': engine.chunk_hashes[document_id],
+        'signatures': engine.chunk_signatures[document_id],
+        'embeddings': embeddings,
+        'postings': {term: by_document[document_id] for term, by_document in engine.postings.items()
+                     if document_id in by_document},
+        'bounds': {term: by_document[document_id] for term, by_document in engine.term_bounds.items()
+                   if document_id in by_document},
+    })
+
+
+@pytest.mark.parametrize('dense', [False, True], ids=['sparse', 'dense'])
+@pytest.mark.parametrize('old, new, changes', [
+    ([A, B, C, D], [A, E, C, D], {'kept': 3, 'embedded': 1, 'removed': 1}),
+    ([A, B, C, D], [C, A, D, B], {'kept': 4, 'embedded': 0, 'removed': 0}),
+    ([A, A, B], [A, B, A, A, C], {'kept': 3, 'embedded': 2, 'removed': 0}),
+    ([A, B, B, C], [B, C], {'kept': 2, 'embedded': 0, 'removed': 2}),
+], ids=['edit', 'reorder', 'duplicates', 'shrink'])
+def test_replace_document_matches_a_fresh_add(app_context, make_user, make_document, make_engine, tmp_path,
+                                              dense, old, new, changes):
+    user = make_user()
+    backend = HashingEmbedding if dense else SimpleEmbedding
+    replaced = make_document(user.id)
+    engine = make_engine(embedding_model=backend())
+    engine.add_document(replaced.id, old, user_id=user.id)
+    result = engine.replace_document(replaced.id, iter(new), user_id=user.id)
+
+    fresh = make_document(user.id)
+    reference = make_engine(index_file=str(tmp_path / "fresh.json"), embedding_model=backend())
+    reference.add_document(fresh.id, new, user_id=user.id)
+
+    assert result == dict(changes, chunks=len(new))
+    assert _document_state(engine, replaced.id) == _document_state(reference, fresh.id)
+    reloaded = make_engine(embedding_model=backend())
+    reloaded.load_index()
+    assert _document_state(reloaded, replaced.id) == _document_state(reference, fresh.id)
+
+
+def test_replace_document_not_in_index_replaces_its_rows(app_context, make_user, make_document, make_engine,
+                                                         tmp_path):
+    user = make_user()
+    stale = make_document(user.id)
+    engine = make_engine()
+    engine.add_document(stale.id, [A, B, C], user_id=user.id)
+    # An entry `index_cli check` reports as unindexed: rows without index entries
+    engine._forget_document(stale.id)
+
+    result = engine.replace_document(stale.id, iter([D, A]), user_id=user.id)
+
+    fresh = make_document(user.id)
+    reference = make_engine(index_file=str(tmp_path / "fresh.json"))
+    reference.add_document(fresh.id, [D, A], user_id=user.id)
+    assert result == {'chunks': 2, 'kept': 0, 'embedded': 2, 'removed': 0}
+    assert _document_state(engine, stale.id) == _document_state(reference, fresh.id)
+
+
+class FailingGenerator(LocalGenerator):
+    """The local generator, except for questions that mention "explode" """
+
+    def generate_answer(self, question, context):
+        if "explode" in question:
+            raise RuntimeError("model unavailable")
+        return super().generate_answer(question, context)
+
+
+def test_answer_questions_encodes_once_and_isolates_failures(app_context, make_user, make_document, make_engine,
+                                                             monkeypatch):
+    user = make_user()
+    engine = make_engine(generator=FailingGenerator())
+    engine.add_document(make_document(user.id).id, _PARAGRAPHS, user_id=user.id)
+    questions = ["when is the invoice due", "what are the payment terms", "why did revenue explode",
+                 "where is the office moving"]
+
+    encoded = []
+    encode_queries = engine.embedding_model.encode_queries
+
+    def spy(texts):
+        encoded.append(list(texts))
+        return encode_queries(texts)
+    monkeypatch.setattr(engine.embedding_model, 'encode_queries', spy)
+    results = sorted(engine.answer_questions(questions, user.id, max_workers=2), key=lambda result: result['index'])
+    assert encoded == [questions]
+
+    assert [(result['index'], result['question']) for result in results] == list(enumerate(questions))
+    assert results[2]['source'] == 'error'
+    for index in (0, 1, 3):
+        single = engine.answer_question(questions[index], user.id)
+        assert results[index]['source'] == 'llm'
+        assert (results[index]['answer'], results[index]['context_documents']) == \
+            (single['answer'], single['context_documents'])
+
+
+def test_ask_batch_validates_and_streams_one_line_per_question(make_user, make_document, login, engine,
+                                                               monkeypatch):
+    from app import app
+    monkeypatch.setitem(app.config, 'BATCH_MAX_QUESTIONS', 3)
+    monkeypatch.setitem(app.config, 'LLM_RATE_LIMIT', 0)
+    user = make_user()
+    with app.app_context():
+        engine.add_document(make_document(user.id).id, _PARAGRAPHS, user_id=user.id)
+    client = login(user)
+
+    for payload, error in [({}, 'A non-empty list of questions is required'),
+                           ({'questions': "invoice"}, 'A non-empty list of questions is required'),
+                           ({'questions': ["invoice", "  "]}, 'Every question must be a non-empty string'),
+                           ({'questions': ["a question"] * 4}, 'At most 3 questions per batch')]:
+        response = client.post("/ask_batch", json=payload)
+        assert (response.status_code, response.get_json()) == (400, {'error': error})
+
+    response = client.post("/ask_batch", json={'questions': ["when is the invoice due", "payment terms"]})
+    assert response.status_code == 200 and response.mimetype == 'application/x-ndjson'
+    lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert sorted(line['index'] for line in lines) == [0, 1]
+    assert all(line['source'] == 'llm' and line['context_documents'] for line in lines)
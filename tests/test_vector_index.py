@@ -0,0 +1,86 @@
+import numpy as np
+import pytest
+
+from vector_index import DenseVectorIndex, PQ_MIN_TRAIN_ROWS
+
+DIMENSION = 32
+DOCUMENTS = 3
+ROWS_PER_DOCUMENT = PQ_MIN_TRAIN_ROWS // 2  # enough rows in total to train a PQ codebook
+
+
+def _unit_vectors(rng, rows):
+    vectors = rng.standard_normal((rows, DIMENSION)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def _build(storage, vectors, rerank=0, requested=None):
+    def vector_source(refs):
+        if requested is not None:
+            requested.append(list(refs))
+        return np.stack([vectors[doc_id][chunk_id] for doc_id, chunk_id in refs])
+
+    index = DenseVectorIndex(DIMENSION, storage=storage, rerank=rerank, vector_source=vector_source)
+    for doc_id, document in vectors.items():
+        index.add(user_id=1, doc_id=doc_id, vectors=document)
+    return index
+
+
+@pytest.fixture
+def vectors():
+    rng = np.random.default_rng(7)
+    return {doc_id: _unit_vectors(rng, ROWS_PER_DOCUMENT) for doc_id in range(1, DOCUMENTS + 1)}
+
+
+def _planted_query(vectors, doc_id, chunk_id):
+    """A query closest to one stored vector, with a little noise"""
+    noise = np.random.default_rng(3).standard_normal(DIMENSION).astype(np.float32) * 0.05
+    query = vectors[doc_id][chunk_id] + noise
+    return query / np.linalg.norm(query)
+
+
+def _exact_top(vectors, query, k):
+    scores = [(float(vector @ query), doc_id, chunk_id)
+              for doc_id, document in vectors.items() for chunk_id, vector in enumerate(document)]
+    return sorted(scores, reverse=True)[:k]
+
+
+@pytest.mark.parametrize('storage, rerank', [('int8', 0), ('int8', 20), ('pq', 20)])
+def test_quantized_search_finds_the_planted_vector(vectors, storage, rerank):
+    requested = []
+    index = _build(storage, vectors, rerank=rerank, requested=requested)
+    assert index.stats()['pq_users'] == (1 if storage == 'pq' else 0)
+
+    query = _planted_query(vectors, 2, 17)
+    [[(score, doc_id, chunk_id)]] = index.search(1, query[None, :], k=1)
+    exact_score, exact_doc, exact_chunk = _exact_top(vectors, query, 1)[0]
+
+    assert (doc_id, chunk_id) == (exact_doc, exact_chunk) == (2, 17)
+    if rerank:
+        # Candidates are re-scored with the full-precision vectors
+        assert len(requested) == 1 and len(requested[0]) == rerank
+        assert score == pytest.approx(exact_score, abs=1e-6)
+    else:
+        assert not requested
+        assert score == pytest.approx(exact_score, abs=0.02)
+
+
+@pytest.mark.parametrize('storage', ['int8', 'pq'])
+def test_save_and_load_round_trip_the_codes(vectors, storage, tmp_path):
+    index = _build(storage, vectors)
+    path = str(tmp_path / "dense.npz")
+    index.save(path)
+
+    loaded = DenseVectorIndex(DIMENSION, storage=storage)
+    assert loaded.load(path)
+    before, after = index.users[1], loaded.users[1]
+    assert after.vectors.dtype == before.vectors.dtype != np.float32
+    np.testing.assert_array_equal(after.vectors, before.vectors)
+    np.testing.assert_array_equal(after.scales, before.scales)
+    np.testing.assert_array_equal(after.doc_ids, before.doc_ids)
+    np.testing.assert_array_equal(after.chunk_ids, before.chunk_ids)
+    if storage == 'pq':
+        np.testing.assert_array_equal(after.pq.codebooks, before.pq.codebooks)
+
+    query = _planted_query(vectors, 3, 5)[None, :]
+    assert loaded.search(1, query, k=5) == index.search(1, query, k=5)
+    assert DenseVectorIndex(DIMENSION, storage='float32').load(path) is False
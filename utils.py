@@ -1,9 +1,10 @@
 import os
+import re
 import mimetypes
 from werkzeug.utils import secure_filename
 
 ALLOWED_EXTENSIONS = {'pdf', 'docx', 'txt'}
-MAX_FILE_SIZE = 16 * 1024 * 1024  # 16MB
+MAX_FILE_SIZE = int(os.environ.get("MAX_UPLOAD_MB", "16")) * 1024 * 1024
 
 def allowed_file(filename):
     """Check if file extension is allowed"""
@@ -64,20 +65,66 @@ def truncate_text(text, max_length=100):
         return text
     return text[:max_length - 3] + "..."
 
-def highlight_keywords(text, keywords):
-    """Highlight keywords in text (simple version)"""
-    if not keywords:
-        return text
-    
-    highlighted = text
-    for keyword in keywords:
-        if keyword.lower() in text.lower():
-            # Simple replacement (case-insensitive)
-            import re
-            pattern = re.compile(re.escape(keyword), re.IGNORECASE)
-            highlighted = pattern.sub(f"**{keyword}**", highlighted)
+TOKEN_PATTERN = re.compile(r'\b\w+\b')
+
+# Words that carry no retrieval signal on their own (tokenize already drops anything under 3 chars)
+STOPWORDS = frozenset("""
+    the and for are but not you your yours with this that these those what which who whom whose when where
+    why how does did done was were has have had been being can could would should will shall may might must
+    about above after again also any because before between both each few from further here into its more
+    most other over own same some such than then there their them they through too under until very while
+    tell explain describe give show please one ones thing things much many just like know mean
+""".split())
+
+def tokenize(text):
+    """Lowercase word tokens longer than two characters, as used for retrieval"""
+    return [token for token in TOKEN_PATTERN.findall(text.lower()) if len(token) > 2]
+
+def find_term_spans(text, terms):
+    """(start, end) offsets of the retrieval tokens of `text` that are in `terms`, in one pass"""
+    if not terms:
+        return []
+    return [list(match.span()) for match in TOKEN_PATTERN.finditer(text)
+            if len(match.group()) > 2 and match.group().lower() in terms]
+
+def make_snippet(text, spans, width=240):
+    """A window of about `width` characters around the densest run of matches.
+
+    Returns the snippet and the spans that fall inside it, shifted to snippet
+    offsets. Work is bounded by the number of matches, not the text length.
+    """
+    if len(text) <= width:
+        return text, spans
     
-    return highlighted
+    start = 0
+    if spans:
+        # Two pointers over the sorted spans find the window holding the most matches
+        best, best_count, j = 0, 0, 0
+        for i in range(len(spans)):
+            j = max(j, i)
+            while j < len(spans) and (j == i or spans[j][1] - spans[i][0] <= width):
+                j += 1
+            if j - i > best_count:
+                best, best_count = i, j - i
+        cluster = spans[best + best_count - 1][1] - spans[best][0]
+        start = max(0, min(spans[best][0] - (width - cluster) // 2, len(text) - width))
+        if start > 0 and not text[start - 1].isspace():
+            space = text.find(" ", start, spans[best][0])
+            if space != -1:
+                start = space + 1
+    
+    end = min(len(text), start + width)
+    if end < len(text):
+        space = text.rfind(" ", start + width // 2, end)
+        if space != -1:
+            end = space
+    
+    prefix = "… " if start > 0 else ""
+    suffix = " …" if end < len(text) else ""
+    shift = len(prefix) - start
+    inside = [[span_start + shift, span_end + shift] for span_start, span_end in spans
+              if span_start >= start and span_end <= end]
+    return prefix + text[start:end] + suffix, inside
 
 def clean_text(text):
     """Clean and normalize text"""
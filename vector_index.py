@@ -0,0 +1,400 @@
+import logging
+from typing import List, Dict, Optional, Iterable, Tuple, Callable
+import numpy as np
+
+# float32 keeps exact vectors, int8 is per-row scalar quantization, pq is product quantization
+STORAGE_TYPES = ('float32', 'int8', 'pq')
+
+# Rows a user needs before a PQ codebook is trained; fewer are kept as float32
+PQ_MIN_TRAIN_ROWS = 1024
+
+
+def _kmeans(vectors: np.ndarray, num_clusters: int, iterations: int = 10, seed: int = 0,
+            spherical: bool = True) -> np.ndarray:
+    """Lloyd's k-means; spherical mode clusters by cosine and returns unit-norm centroids"""
+    rng = np.random.default_rng(seed)
+    sample_size = min(len(vectors), num_clusters * 256)
+    sample = vectors[rng.choice(len(vectors), size=sample_size, replace=False)]
+    centroids = sample[rng.choice(len(sample), size=num_clusters, replace=False)].copy()
+
+    for _ in range(iterations):
+        if spherical:
+            assignments = np.argmax(sample @ centroids.T, axis=1)
+        else:
+            # argmin ||x - c||^2 == argmax (x.c - ||c||^2 / 2)
+            assignments = np.argmax(sample @ centroids.T - 0.5 * (centroids ** 2).sum(axis=1), axis=1)
+        for c in range(num_clusters):
+            members = sample[assignments == c]
+            if len(members):
+                centroids[c] = members.sum(axis=0) if spherical else members.mean(axis=0)
+            else:
+                # Re-seed empty clusters so every list stays useful
+                centroids[c] = sample[rng.integers(len(sample))]
+        if spherical:
+            norms = np.linalg.norm(centroids, axis=1, keepdims=True)
+            centroids /= np.maximum(norms, 1e-12)
+
+    return centroids.astype(np.float32)
+
+
+class ProductQuantizer:
+    """Splits vectors into `num_subvectors` slices, each coded as one of 256 centroids.
+
+    Scores are computed with asymmetric distance computation: the float query is
+    dotted with every centroid once per search, and each row's score is the sum
+    of its looked-up slice scores.
+    """
+
+    def __init__(self, dimension: int, num_subvectors: int = 8):
+        if dimension % num_subvectors:
+            raise ValueError(f"Dimension {dimension} is not divisible into {num_subvectors} subvectors")
+        self.dimension = dimension
+        self.num_subvectors = num_subvectors
+        self.sub_dimension = dimension // num_subvectors
+        self.codebooks = np.zeros((num_subvectors, 256, self.sub_dimension), dtype=np.float32)
+
+    def _slices(self, vectors: np.ndarray) -> np.ndarray:
+        return vectors.reshape(len(vectors), self.num_subvectors, self.sub_dimension)
+
+    def train(self, vectors: np.ndarray):
+        slices = self._slices(vectors)
+        for j in range(self.num_subvectors):
+            self.codebooks[j] = _kmeans(np.ascontiguousarray(slices[:, j, :]), 256, seed=j, spherical=False)
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        slices = self._slices(vectors)
+        codes = np.empty((len(vectors), self.num_subvectors), dtype=np.uint8)
+        for j in range(self.num_subvectors):
+            codebook = self.codebooks[j]
+            scores = slices[:, j, :] @ codebook.T - 0.5 * (codebook ** 2).sum(axis=1)
+            codes[:, j] = np.argmax(scores, axis=1)
+        return codes
+
+    def decode(self, codes: np.ndarray) -> np.ndarray:
+        parts = [self.codebooks[j][codes[:, j]] for j in range(self.num_subvectors)]
+        return np.concatenate(parts, axis=1) if parts else np.zeros((0, self.dimension), dtype=np.float32)
+
+    def score(self, codes: np.ndarray, query: np.ndarray) -> np.ndarray:
+        """Approximate inner products of one float query against coded rows"""
+        lookup = np.einsum('jkd,jd->jk', self.codebooks, query.reshape(self.num_subvectors, self.sub_dimension))
+        return lookup[np.arange(self.num_subvectors), codes].sum(axis=1)
+
+
+class IVFIndex:
+    """Inverted-file approximate index: rows are bucketed by their nearest centroid"""
+
+    def __init__(self, centroids: np.ndarray, nprobe: int = 8):
+        self.centroids = centroids
+        self.nprobe = nprobe
+        self.assignments = np.zeros(0, dtype=np.int32)
+        self._order = np.zeros(0, dtype=np.int64)
+        self._offsets = np.zeros(len(centroids) + 1, dtype=np.int64)
+
+    @classmethod
+    def train(cls, vectors: np.ndarray, nprobe: int = 8) -> 'IVFIndex':
+        num_clusters = max(1, int(np.sqrt(len(vectors))))
+        index = cls(_kmeans(vectors, num_clusters), nprobe=nprobe)
+        index.assign(vectors)
+        return index
+
+    def assign(self, vectors: np.ndarray):
+        """Assign all rows to lists, replacing any previous assignment"""
+        self.assignments = self._nearest(vectors)
+        self._rebuild_lists()
+
+    def append(self, vectors: np.ndarray):
+        """Assign newly appended rows without retraining"""
+        self.assignments = np.concatenate([self.assignments, self._nearest(vectors)])
+        self._rebuild_lists()
+
+    def keep(self, mask: np.ndarray):
+        """Drop rows whose mask entry is False"""
+        self.assignments = self.assignments[mask]
+        self._rebuild_lists()
+
+    def _nearest(self, vectors: np.ndarray) -> np.ndarray:
+        if not len(vectors):
+            return np.zeros(0, dtype=np.int32)
+        return np.argmax(vectors @ self.centroids.T, axis=1).astype(np.int32)
+
+    def _rebuild_lists(self):
+        self._order = np.argsort(self.assignments, kind='stable')
+        self._offsets = np.searchsorted(self.assignments[self._order],
+                                        np.arange(len(self.centroids) + 1))
+
+    def candidates(self, query: np.ndarray) -> np.ndarray:
+        """Row ids stored in the `nprobe` lists closest to the query"""
+        nprobe = min(self.nprobe, len(self.centroids))
+        centroid_scores = self.centroids @ query
+        probe = np.argpartition(-centroid_scores, nprobe - 1)[:nprobe]
+        return np.concatenate([self._order[self._offsets[c]:self._offsets[c + 1]] for c in probe])
+
+
+class UserVectors:
+    """Contiguous matrix of one user's chunk vectors plus row metadata.
+
+    Rows are stored according to `storage`: as float32, as int8 codes with a
+    per-row scale, or as PQ codes once enough rows exist to train a codebook.
+    """
+
+    def __init__(self, dimension: int, storage: str = 'float32', pq_subvectors: int = 8):
+        self.dimension = dimension
+        self.storage = storage
+        self.pq_subvectors = pq_subvectors
+        self.vectors = np.zeros((0, dimension), dtype=np.int8 if storage == 'int8' else np.float32)
+        self.scales = np.zeros(0, dtype=np.float32)  # per-row dequantization scale for int8
+        self.doc_ids = np.zeros(0, dtype=np.int64)
+        self.chunk_ids = np.zeros(0, dtype=np.int32)
+        self.pq: Optional[ProductQuantizer] = None
+        self.ivf: Optional[IVFIndex] = None
+        self.ivf_trained_rows = 0
+
+    def __len__(self):
+        return len(self.doc_ids)
+
+    def _encode_rows(self, vectors: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        if self.storage == 'int8':
+            scales = np.maximum(np.abs(vectors).max(axis=1), 1e-12) / 127.0
+            codes = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+            return codes, scales.astype(np.float32)
+        if self.pq is not None:
+            return self.pq.encode(vectors), np.ones(len(vectors), dtype=np.float32)
+        return vectors.astype(np.float32), np.ones(len(vectors), dtype=np.float32)
+
+    def decode_rows(self, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        """Float32 view of the stored vectors for the given rows (all rows if None)"""
+        vectors = self.vectors if rows is None else self.vectors[rows]
+        if self.storage == 'int8':
+            scales = self.scales if rows is None else self.scales[rows]
+            return vectors.astype(np.float32) * scales[:, None]
+        if self.pq is not None:
+            return self.pq.decode(vectors)
+        return vectors
+
+    def _maybe_train_pq(self):
+        if self.storage != 'pq' or self.pq is not None or len(self) < PQ_MIN_TRAIN_ROWS:
+            return
+        logging.info(f"Training PQ codebook over {len(self)} vectors")
+        self.pq = ProductQuantizer(self.dimension, self.pq_subvectors)
+        self.pq.train(self.vectors)
+        self.vectors = self.pq.encode(self.vectors)
+
+    def add(self, doc_id: int, vectors: np.ndarray):
+        codes, scales = self._encode_rows(vectors)
+        self.vectors = np.concatenate([self.vectors, codes])
+        self.scales = np.concatenate([self.scales, scales])
+        self.doc_ids = np.concatenate([self.doc_ids, np.full(len(vectors), doc_id, dtype=np.int64)])
+        self.chunk_ids = np.concatenate([self.chunk_ids, np.arange(len(vectors), dtype=np.int32)])
+        if self.ivf is not None:
+            self.ivf.append(vectors.astype(np.float32))
+        self._maybe_train_pq()
+
+    def remove(self, doc_id: int):
+        keep = self.doc_ids != doc_id
+        self.vectors = self.vectors[keep]
+        self.scales = self.scales[keep]
+        self.doc_ids = self.doc_ids[keep]
+        self.chunk_ids = self.chunk_ids[keep]
+        if self.ivf is not None:
+            self.ivf.keep(keep)
+
+    def score_rows(self, queries: np.ndarray, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        """Inner products of queries (m, d) against rows, as an (n, m) matrix"""
+        vectors = self.vectors if rows is None else self.vectors[rows]
+        if self.storage == 'int8':
+            scales = self.scales if rows is None else self.scales[rows]
+            return (vectors.astype(np.float32) @ queries.T) * scales[:, None]
+        if self.pq is not None:
+            return np.stack([self.pq.score(vectors, query) for query in queries], axis=1)
+        return vectors @ queries.T
+
+    def nbytes(self) -> int:
+        total = self.vectors.nbytes + self.doc_ids.nbytes + self.chunk_ids.nbytes
+        if self.storage == 'int8':
+            total += self.scales.nbytes
+        if self.pq is not None:
+            total += self.pq.codebooks.nbytes
+        return total
+
+
+class DenseVectorIndex:
+    """Per-user dense chunk vectors searched exactly with BLAS or through an IVF index.
+
+    Users whose matrix grows past `ann_threshold` rows get an IVF index trained
+    on their vectors; it is retrained whenever the matrix doubles in size.
+
+    With quantized storage, setting `rerank` above k re-scores that many of the
+    best approximate candidates with full-precision vectors from `vector_source`,
+    a callable mapping ``[(doc_id, chunk_id), ...]`` to an ``(n, dimension)`` array.
+    """
+
+    def __init__(self, dimension: int, storage: str = 'float32', ann_threshold: int = 20000, nprobe: int = 8,
+                 pq_subvectors: int = 8, rerank: int = 0,
+                 vector_source: Optional[Callable[[List[Tuple[int, int]]], np.ndarray]] = None):
+        if storage not in STORAGE_TYPES:
+            raise ValueError(f"Unsupported vector storage: {storage}")
+        if storage == 'pq' and dimension % pq_subvectors:
+            raise ValueError(f"Dimension {dimension} is not divisible into {pq_subvectors} PQ subvectors")
+        self.dimension = dimension
+        self.storage = storage
+        self.ann_threshold = ann_threshold
+        self.nprobe = nprobe
+        self.pq_subvectors = pq_subvectors
+        self.rerank = rerank
+        self.vector_source = vector_source
+        self.users: Dict[int, UserVectors] = {}
+        self.doc_users: Dict[int, int] = {}
+
+    def _new_user(self) -> UserVectors:
+        return UserVectors(self.dimension, self.storage, self.pq_subvectors)
+
+    def add(self, user_id: int, doc_id: int, vectors: np.ndarray):
+        """Add a document's chunk vectors, replacing any previous version"""
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dimension)
+        if doc_id in self.doc_users:
+            self.remove(doc_id)
+        user = self.users.get(user_id)
+        if user is None:
+            user = self.users[user_id] = self._new_user()
+        user.add(doc_id, vectors)
+        self.doc_users[doc_id] = user_id
+        self._maybe_train(user)
+
+    def remove(self, doc_id: int):
+        user_id = self.doc_users.pop(doc_id, None)
+        if user_id is None:
+            return
+        user = self.users[user_id]
+        user.remove(doc_id)
+        if not len(user):
+            del self.users[user_id]
+
+    def document_size(self, doc_id: int) -> int:
+        """Number of stored chunk vectors of a document"""
+        user_id = self.doc_users.get(doc_id)
+        if user_id is None:
+            return 0
+        return int(np.count_nonzero(self.users[user_id].doc_ids == doc_id))
+
+    def document_vectors(self, doc_id: int) -> np.ndarray:
+        """Float32 vectors of a document's chunks in chunk order, decoded if quantized"""
+        user_id = self.doc_users.get(doc_id)
+        if user_id is None:
+            return np.zeros((0, self.dimension), dtype=np.float32)
+        user = self.users[user_id]
+        rows = np.flatnonzero(user.doc_ids == doc_id)
+        rows = rows[np.argsort(user.chunk_ids[rows], kind='stable')]
+        return user.decode_rows(rows)
+
+    def _maybe_train(self, user: UserVectors):
+        if len(user) < self.ann_threshold:
+            user.ivf = None
+            user.ivf_trained_rows = 0
+            return
+        if user.ivf is None or len(user) >= 2 * user.ivf_trained_rows:
+            logging.info(f"Training IVF index over {len(user)} vectors")
+            user.ivf = IVFIndex.train(user.decode_rows(), nprobe=self.nprobe)
+            user.ivf_trained_rows = len(user)
+
+    def search(self, user_id: int, queries: np.ndarray, k: int,
+               allowed_doc_ids: Optional[Iterable[int]] = None) -> List[List[Tuple[float, int, int]]]:
+        """Top k (score, doc_id, chunk_id) per query among the user's vectors"""
+        queries = np.asarray(queries, dtype=np.float32).reshape(-1, self.dimension)
+        user = self.users.get(user_id)
+        if user is None or not len(user):
+            return [[] for _ in range(len(queries))]
+
+        allowed = None
+        if allowed_doc_ids is not None:
+            allowed = np.isin(user.doc_ids, np.fromiter(allowed_doc_ids, dtype=np.int64))
+
+        reranking = self.rerank > k and self.vector_source is not None and self.storage != 'float32'
+        fetch = self.rerank if reranking else k
+
+        if user.ivf is None:
+            scores = user.score_rows(queries)
+            if allowed is not None:
+                scores[~allowed] = -np.inf
+            results = [self._top_k(user, scores[:, q], None, fetch) for q in range(len(queries))]
+        else:
+            results = []
+            for query in queries:
+                rows = user.ivf.candidates(query)
+                if allowed is not None:
+                    rows = rows[allowed[rows]]
+                scores = user.score_rows(query[None, :], rows)[:, 0]
+                results.append(self._top_k(user, scores, rows, fetch))
+
+        if reranking:
+            results = [self._rerank(query, candidates, k) for query, candidates in zip(queries, results)]
+        return results
+
+    def _top_k(self, user: UserVectors, scores: np.ndarray, rows: Optional[np.ndarray], k: int):
+        valid = np.flatnonzero(np.isfinite(scores))
+        if not len(valid):
+            return []
+        if len(valid) > k:
+            valid = valid[np.argpartition(-scores[valid], k - 1)[:k]]
+        valid = valid[np.argsort(-scores[valid], kind='stable')]
+        row_ids = valid if rows is None else rows[valid]
+        return [(float(scores[i]), int(user.doc_ids[r]), int(user.chunk_ids[r]))
+                for i, r in zip(valid, row_ids)]
+
+    def _rerank(self, query: np.ndarray, candidates: List[Tuple[float, int, int]], k: int):
+        """Re-score approximate candidates with full-precision vectors"""
+        if not candidates:
+            return candidates
+        refs = [(doc_id, chunk_id) for _, doc_id, chunk_id in candidates]
+        exact = np.asarray(self.vector_source(refs), dtype=np.float32) @ query
+        order = np.argsort(-exact, kind='stable')[:k]
+        return [(float(exact[i]), refs[i][0], refs[i][1]) for i in order]
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'users': len(self.users),
+            'vectors': sum(len(user) for user in self.users.values()),
+            'bytes': sum(user.nbytes() for user in self.users.values()),
+            'float32_bytes': sum(len(user) * self.dimension * 4 for user in self.users.values()),
+            'ann_users': sum(1 for user in self.users.values() if user.ivf is not None),
+            'pq_users': sum(1 for user in self.users.values() if user.pq is not None),
+        }
+
+    def save(self, path: str):
+        arrays = {
+            'dimension': np.array(self.dimension),
+            'storage': np.array(self.storage),
+            'pq_subvectors': np.array(self.pq_subvectors),
+        }
+        for user_id, user in self.users.items():
+            arrays[f"{user_id}_vectors"] = user.vectors
+            arrays[f"{user_id}_scales"] = user.scales
+            arrays[f"{user_id}_doc_ids"] = user.doc_ids
+            arrays[f"{user_id}_chunk_ids"] = user.chunk_ids
+            if user.pq is not None:
+                arrays[f"{user_id}_pq_codebooks"] = user.pq.codebooks
+        with open(path, 'wb') as f:
+            np.savez(f, **arrays)
+
+    def load(self, path: str) -> bool:
+        """Load vectors saved by `save`; returns False if they don't match this index's settings"""
+        with np.load(path) as data:
+            if int(data['dimension']) != self.dimension or str(data['storage']) != self.storage:
+                return False
+            if 'pq_subvectors' in data.files and int(data['pq_subvectors']) != self.pq_subvectors \
+                    and self.storage == 'pq':
+                return False
+            user_ids = {int(key.split('_', 1)[0]) for key in data.files if key.endswith('_vectors')}
+            for user_id in user_ids:
+                user = self._new_user()
+                user.vectors = data[f"{user_id}_vectors"]
+                user.scales = data[f"{user_id}_scales"]
+                user.doc_ids = data[f"{user_id}_doc_ids"]
+                user.chunk_ids = data[f"{user_id}_chunk_ids"]
+                if f"{user_id}_pq_codebooks" in data.files:
+                    user.pq = ProductQuantizer(self.dimension, self.pq_subvectors)
+                    user.pq.codebooks = data[f"{user_id}_pq_codebooks"]
+                self.users[user_id] = user
+                for doc_id in np.unique(user.doc_ids):
+                    self.doc_users[int(doc_id)] = user_id
+                self._maybe_train(user)
+        return True